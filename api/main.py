@@ -1,10 +1,27 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image
 import httpx
+import asyncio
 import os
+import sys
 import logging
-import io
+
+# Shared vectorization modules live in ../python
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python'))
+from svg_cache import get_svg_cache, make_cache_key
+from image_analysis import analyze_image, ANALYSIS_MAX_SIDE
+from preprocess import open_header, ImageTooLarge
+from upstream_client import HedgedUpstreamClient, UpstreamError, UpstreamUnavailable
+from vtracer_presets import resolve_preset
+from upload_ingest import SpooledUpload, UploadError, UploadTooLarge, ingest_upload, MULTIPART_OVERHEAD_BYTES
+from metrics import get_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+
+try:
+    # Local tracing is only a fallback; the proxy runs without it
+    import memory_trace
+except ImportError:
+    memory_trace = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -32,8 +49,40 @@ SALAD_KEY = os.getenv("SALAD_KEY")
 if not SALAD_KEY:
     logger.warning("SALAD_KEY environment variable not set")
 
-# Salad API configuration
-SALAD_API_URL = "https://api.salad.com/api/v1/vectorize"
+# Salad API configuration (point at python/fake_salad.py to test locally)
+SALAD_API_URL = os.getenv("SALAD_API_URL", "https://api.salad.com/api/v1/vectorize")
+
+# Trace locally with VTracer when Salad is down or slower than usual
+UPSTREAM_LOCAL_FALLBACK = os.getenv("UPSTREAM_LOCAL_FALLBACK", "true").lower() == "true"
+
+# One pooled client for every upload instead of a connection per request
+salad_client = HedgedUpstreamClient(
+    SALAD_API_URL,
+    headers={
+        'Authorization': f'Bearer {SALAD_KEY}',
+        'User-Agent': 'VectraHub/1.0.0'
+    }
+)
+
+# Uploads are streamed and rejected as soon as they pass this size
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+MAX_UPLOAD_MB = MAX_UPLOAD_BYTES // (1024 * 1024)
+
+# Content-addressed result cache (repeat uploads skip the upstream call)
+svg_cache = get_svg_cache()
+
+# Stage timings, in-flight uploads and error counts served on /metrics
+metrics = get_metrics()
+upstream_results = metrics.registry.counter(
+    'vectorizer_upstream_results_total', "Vectorized uploads by where the SVG came from", ('source',)
+)
+upstream_circuit_open = metrics.registry.gauge('vectorizer_upstream_circuit_open', "1 while the Salad circuit breaker is open")
+upstream_circuit_open.set_function(lambda: int(salad_client.breaker.state != "closed"))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Close pooled upstream connections"""
+    await salad_client.close()
 
 @app.get("/")
 async def root():
@@ -44,31 +93,49 @@ async def root():
         "salad_key_configured": bool(SALAD_KEY)
     }
 
-def is_black_and_white(image_bytes: bytes) -> bool:
-    """
-    Strictly checks if an image is purely black and white (or grayscale).
-    Returns True only if all pixels are either very dark or very light.
-    """
-    try:
-        image = Image.open(io.BytesIO(image_bytes)).convert("L") # Convert to grayscale
-        
-        # Define strict thresholds for "black" and "white"
-        black_threshold = 20  # Pixels darker than this are considered black
-        white_threshold = 235 # Pixels lighter than this are considered white
-        
-        # Iterate through all pixels
-        for pixel_value in image.getdata():
-            # If a pixel is NOT black AND NOT white, then it's not purely B&W
-            if not (pixel_value <= black_threshold or pixel_value >= white_threshold):
-                return False # Found a pixel that is not strictly black or white
-        
-        return True # All pixels are strictly black or white
-    except Exception as e:
-        logger.error(f"Error checking if image is black and white: {e}")
-        return False # Default to false on error, treat as regular image
+def inspect_upload(image: SpooledUpload):
+    """Analyze an upload and fingerprint it for the cache, decoding it only once"""
+    # The pixel limit is checked from the header before anything is decoded
+    with open_header(image.reader()) as img:
+        original_size = img.size
+        if not svg_cache:
+            # Only thumbnail statistics are needed, so JPEGs can decode at a reduced scale
+            img.draft(None, (ANALYSIS_MAX_SIDE, ANALYSIS_MAX_SIDE))
+        img.load()
+        analysis = analyze_image(img, original_size)
+        cache_key = make_cache_key(img, {"backend": "salad", "url": SALAD_API_URL}) if svg_cache else None
+    return analysis, cache_key
+
+def local_fallback(image: SpooledUpload, analysis: dict):
+    """Build a coroutine factory that traces the upload locally, or None if unavailable"""
+    if not UPSTREAM_LOCAL_FALLBACK or memory_trace is None:
+        return None
+    
+    # Salad picks its own settings; locally the auto preset matches them to the image
+    params = resolve_preset('auto', analysis)['vtracer']
+    
+    async def trace():
+        logger.info("Tracing locally with VTracer")
+        return await asyncio.to_thread(lambda: memory_trace.trace_bytes(image.read_bytes(), params))
+    return trace
 
-@app.post("/vectorize")
-async def vectorize_image(image: UploadFile = File(...)):
+UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["image"],
+                    "properties": {"image": {"type": "string", "format": "binary"}}
+                }
+            }
+        }
+    }
+}
+
+@app.post("/vectorize", openapi_extra=UPLOAD_OPENAPI)
+async def vectorize_image(request: Request):
     """
     Vectorize an uploaded image using Salad's vectorization service
     """
@@ -78,6 +145,45 @@ async def vectorize_image(image: UploadFile = File(...)):
             detail="SALAD_KEY not configured. Please set the environment variable."
         )
     
+    # Check file size (limit to 10MB) before reading anything when the client declares it
+    content_length = request.headers.get('content-length')
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES:
+        metrics.error('UploadTooLarge')
+        raise HTTPException(
+            status_code=400,
+            detail=f"File too large. Maximum size is {MAX_UPLOAD_MB}MB."
+        )
+    
+    # Stream the body into one spooled buffer, enforcing the limit as bytes arrive
+    try:
+        with metrics.stage('download'):
+            image = await ingest_upload(request.stream(), request.headers.get('content-type'), 'image', MAX_UPLOAD_BYTES)
+    except UploadTooLarge as e:
+        metrics.error(e)
+        raise HTTPException(
+            status_code=400,
+            detail=f"File too large. Maximum size is {MAX_UPLOAD_MB}MB."
+        )
+    except UploadError as e:
+        metrics.error(e)
+        raise HTTPException(
+            status_code=400,
+            detail=str(e)
+        )
+    
+    try:
+        with metrics.jobs_in_flight.track():
+            response = await vectorize_upload(image)
+        metrics.jobs.labels('cached' if response["cached"] else 'done').inc()
+        return response
+    except HTTPException:
+        metrics.jobs.labels('failed').inc()
+        raise
+    finally:
+        image.close()
+
+async def vectorize_upload(image: SpooledUpload):
+    """Analyze, cache-check and vectorize one ingested upload"""
     # Validate file type
     if not image.content_type or not image.content_type.startswith('image/'):
         raise HTTPException(
@@ -85,85 +191,127 @@ async def vectorize_image(image: UploadFile = File(...)):
             detail="Invalid file type. Please upload an image file."
         )
     
-    # Check file size (limit to 10MB)
-    content = await image.read()
-    if len(content) > 10 * 1024 * 1024:
+    # Thumbnail statistics run in a worker thread so the event loop keeps serving
+    try:
+        with metrics.stage('verify'):
+            analysis, cache_key = await asyncio.to_thread(inspect_upload, image)
+    except ImageTooLarge as e:
+        logger.warning(f"Rejecting upload: {e}")
+        metrics.error(e)
         raise HTTPException(
             status_code=400,
-            detail="File too large. Maximum size is 10MB."
+            detail=str(e)
+        )
+    except Exception as e:
+        logger.error(f"Error analyzing image: {e}")
+        metrics.error(e)
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid image file. Could not decode the upload."
         )
     
-    is_black_image = is_black_and_white(content)
-    logger.info(f"Image '{image.filename}' detected as strictly black and white: {is_black_image}")
+    is_black_image = analysis["is_black_and_white"]
+    width, height = analysis["size"]
+    metrics.input_pixels.observe(width * height)
+    logger.info(f"Image '{image.filename}' analyzed: kind={analysis['kind']}, "
+                f"strictly black and white: {is_black_image}, colors~{analysis['distinct_colors']}")
+    if analysis["near_blank"]:
+        logger.warning(f"Image '{image.filename}' looks blank, vectorizing anyway")
+
+    svg_filename = f"{os.path.splitext(image.filename)[0]}.svg" # Ensure .svg extension
+
+    cached_svg = svg_cache.get(cache_key) if cache_key else None
+    if cached_svg is not None:
+        logger.info(f"Cache hit for file: {image.filename}")
+        metrics.output_bytes.observe(len(cached_svg))  # Traced SVG is ASCII, so characters are bytes
+        return {
+            "success": True,
+            "message": "Image vectorized successfully",
+            "data": {
+                "svg_content": cached_svg,
+                "svg_filename": svg_filename
+            },
+            "is_black_image": is_black_image,
+            "analysis": analysis,
+            "filename": image.filename,
+            "cached": True
+        }
 
     try:
         # Prepare the request to Salad API
-        files = {
-            'image': (image.filename, content, image.content_type)
-        }
+        # Each attempt (including a hedge) streams from its own reader over the same buffer
+        def files():
+            return {
+                'image': (image.filename, image.reader(), image.content_type)
+            }
         
-        headers = {
-            'Authorization': f'Bearer {SALAD_KEY}',
-            'User-Agent': 'VectraHub/1.0.0'
-        }
+        logger.info(f"Sending vectorization request for file: {image.filename}")
+        with metrics.stage('trace'):
+            svg_content, source = await salad_client.vectorize(files, local_fallback(image, analysis))
+        logger.info(f"Vectorization successful (source: {source})")
+        upstream_results.labels(source).inc()
+        metrics.output_bytes.observe(len(svg_content))
         
-        # Make request to Salad vectorization service
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            logger.info(f"Sending vectorization request for file: {image.filename}")
-            
-            response = await client.post(
-                SALAD_API_URL,
-                files=files,
-                headers=headers
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                logger.info("Vectorization successful")
-                
-                # Return SVG content directly for PHP to save and serve
-                if 'svg_content' not in result:
-                    raise HTTPException(
-                        status_code=500,
-                        detail="Salad API did not return SVG content."
-                    )
-
-                return {
-                    "success": True,
-                    "message": "Image vectorized successfully",
-                    "data": {
-                        "svg_content": result['svg_content'],
-                        "svg_filename": f"{os.path.splitext(image.filename)[0]}.svg" # Ensure .svg extension
-                    },
-                    "is_black_image": is_black_image, # Pass this strict B&W flag back to PHP
-                    "filename": image.filename
-                }
-            else:
-                logger.error(f"Salad API error: {response.status_code} - {response.text}")
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Vectorization service error: {response.text}"
-                )
+        # Local fallback output differs from Salad's, so only upstream results are cached
+        if cache_key and source != "local":
+            svg_cache.put(cache_key, svg_content)
+        
+        # Return SVG content directly for PHP to save and serve
+        return {
+            "success": True,
+            "message": "Image vectorized successfully",
+            "data": {
+                "svg_content": svg_content,
+                "svg_filename": svg_filename
+            },
+            "is_black_image": is_black_image, # Pass this strict B&W flag back to PHP
+            "analysis": analysis,
+            "filename": image.filename,
+            "cached": False,
+            "source": source
+        }
                 
-    except httpx.TimeoutException:
+    except UpstreamError as e:
+        logger.error(f"Salad API error: {e.status_code} - {e.detail}")
+        metrics.error(e)
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=f"Vectorization service error: {e.detail}"
+        )
+    except UpstreamUnavailable as e:
+        logger.error(f"Salad API unavailable: {e}")
+        metrics.error(e)
+        raise HTTPException(
+            status_code=503,
+            detail=str(e)
+        )
+    except httpx.TimeoutException as e:
         logger.error("Timeout while calling Salad API")
+        metrics.error(e)
         raise HTTPException(
             status_code=504,
             detail="Vectorization service timeout. Please try again."
         )
     except httpx.RequestError as e:
         logger.error(f"Request error: {str(e)}")
+        metrics.error(e)
         raise HTTPException(
             status_code=503,
             detail="Unable to connect to vectorization service"
         )
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
+        metrics.error(e)
         raise HTTPException(
             status_code=500,
             detail="Internal server error during vectorization"
         )
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/health")
 async def health_check():
     """Detailed health check"""
@@ -171,7 +319,10 @@ async def health_check():
         "status": "healthy",
         "service": "VectraHub API",
         "version": "1.0.0",
-        "salad_integration": "configured" if SALAD_KEY else "missing_key"
+        "salad_integration": "configured" if SALAD_KEY else "missing_key",
+        "upstream": salad_client.stats(),
+        "local_fallback": UPSTREAM_LOCAL_FALLBACK and memory_trace is not None,
+        "cache": svg_cache.stats() if svg_cache else None
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,23 @@
+"""Fixtures shared by the python/tests and runner/tests suites"""
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+
+@pytest.fixture
+def serve():
+    """Start a fake's request handler on a free local port; returns its base URL"""
+    servers = []
+
+    def start(handler_class) -> str:
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -1,6 +1,8 @@
 <?php
 declare(strict_types=1);
 require_once __DIR__ . '/../config/bootstrap.php';
+require_once __DIR__ . '/../config.php';
+require_once __DIR__ . '/../utils.php';
 require_once __DIR__ . '/../services/Http.php';
 require_once __DIR__ . '/../services/RunnerClient.php';
 
@@ -84,12 +86,35 @@ if (!$probe['ok']) {
   ], JSON_UNESCAPED_SLASHES); exit;
 }
 
+// Plan tier and user for the runner's scheduler (anonymous callers are scheduled as free)
+$tier = null;
+$userId = null;
+try {
+    startSession();
+    if (!empty($_SESSION['user_id'])) {
+        $userId = (string)$_SESSION['user_id'];
+        $tier = strtolower((string)(getCurrentUserSubscription($userId)['name'] ?? 'Free'));
+    }
+    // Release the session lock so status polls are not serialized behind this request
+    session_write_close();
+} catch (Throwable $e) {
+    error_log('[gpu_vectorize] Plan lookup failed: ' . $e->getMessage());
+}
+
 // Process with runner - never return 5xx to prevent Cloudflare HTML masking
 try {
     $client = new RunnerClient();
     $client->checkHealth(); // Fast fail if runner down
-    $result = $client->vectorizeStart($inputUrl, $mode, $filename);
-    echo json_encode(['success'=>true,'data'=>$result], JSON_UNESCAPED_SLASHES);
+    $result = $client->vectorizeStart($inputUrl, $mode, $filename, $tier, $userId);
+    // Runner queues the job (202) and is polled through job_status.php
+    $queued = !empty($result['queued']) && !empty($result['job_id']);
+    echo json_encode([
+        'success'    => true,
+        'queued'     => $queued,
+        'job_id'     => $result['job_id'] ?? null,
+        'status_url' => null,
+        'data'       => $result
+    ], JSON_UNESCAPED_SLASHES);
 } catch (RunnerAuthException $e) {
     error_log('[gpu_vectorize] Runner auth error: ' . $e->getMessage());
     http_response_code(401);
@@ -98,6 +123,11 @@ try {
     error_log('[gpu_vectorize] Runner bad request: ' . $e->getMessage());
     http_response_code(400);
     echo json_encode(['success'=>false,'error'=>$e->getMessage()]);
+} catch (RunnerBusyException $e) {
+    error_log('[gpu_vectorize] Runner busy: ' . $e->getMessage());
+    http_response_code(429);
+    header('Retry-After: ' . $e->retryAfter);
+    echo json_encode(['success'=>false,'code'=>'runner_busy','retry_after'=>$e->retryAfter,'error'=>'The service is busy. Please try again in ' . $e->retryAfter . ' seconds.']);
 } catch (RunnerProcessingException|RunnerUnavailableException $e) {
     error_log('[gpu_vectorize] Runner unavailable: ' . $e->getMessage());
     // CRITICAL: Never send 5xx - Cloudflare will mask JSON with HTML
@@ -49,6 +49,14 @@ class PythonApiClient {
 
         $responseData = json_decode($response, true);
 
+        if ($httpCode === 429) {
+            // The API sheds load when it is at capacity; retry_after comes from its drain rate
+            $retryAfter = (int)($responseData['retry_after'] ?? 30);
+            error_log("Python API Client: at capacity, retry after {$retryAfter}s");
+            return ['success' => false, 'busy' => true, 'retry_after' => $retryAfter,
+                    'error' => 'Vectorization service is busy, please retry in ' . $retryAfter . ' seconds'];
+        }
+
         if ($httpCode !== 200) {
             $errorMessage = $responseData['detail'] ?? 'Unknown API error';
             error_log("Python API Client Error ($httpCode): " . $errorMessage);
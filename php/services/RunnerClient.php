@@ -6,24 +6,43 @@ require_once __DIR__ . '/RunnerExceptions.php';
 final class RunnerClient {
     private string $base;
     private string $token;
+    private int $healthWait;
 
     public function __construct() {
         $this->base  = rtrim(getenv('RUNNER_BASE_URL') ?: '', '/');
         $this->token = getenv('RUNNER_SHARED_TOKEN') ?: (getenv('RUNNER_TOKEN') ?: '');
+        // The runner scales to zero, so the first call after idle may arrive while it is still booting
+        $this->healthWait = (int)(getenv('RUNNER_HEALTH_WAIT_SEC') ?: 20);
         if ($this->base === '')  throw new RunnerUnavailableException('runner-base-missing');
         if ($this->token === '') throw new RunnerUnavailableException('runner-token-missing');
     }
 
     public function checkHealth(): void {
-        $this->curl('GET', '/health', null, 10); // throws if not healthy
+        // /health answers as soon as the runner listens; jobs queue behind its prewarm from then on
+        $deadline = microtime(true) + $this->healthWait;
+        while (true) {
+            $remaining = $deadline - microtime(true);
+            try {
+                $this->curl('GET', '/health', null, max(1, min(5, (int)ceil($remaining))));
+                return;
+            } catch (RunnerUnavailableException | RunnerProcessingException $e) {
+                // Not listening yet (or the tunnel answered 5xx): retry until the cold-start budget runs out
+                if ($remaining <= 0.5) throw $e;
+                usleep(500000);
+            }
+        }
     }
 
-    public function vectorizeStart(string $url, string $mode, string $filename): array {
-        return $this->curl('POST', '/run', [
+    public function vectorizeStart(string $url, string $mode, string $filename, ?string $tier = null, ?string $user = null): array {
+        $payload = [
             'input_url' => $url,
             'mode'      => $mode,      // 'color' | 'bw'
             'filename'  => $filename
-        ], 15);
+        ];
+        // Plan tier and user id let the runner share its workers fairly between customers
+        if ($tier !== null) $payload['tier'] = $tier;
+        if ($user !== null) $payload['user'] = $user;
+        return $this->curl('POST', '/run', $payload, 15);
     }
 
     private function curl(string $method, string $path, ?array $payload, int $timeout): array {
@@ -36,7 +55,12 @@ final class RunnerClient {
             curl_setopt($ch, CURLOPT_POSTFIELDS, json_encode($payload, JSON_UNESCAPED_SLASHES));
         }
         
+        $retryAfter = null;
         curl_setopt_array($ch, [
+            CURLOPT_HEADERFUNCTION => function ($ch, string $line) use (&$retryAfter): int {
+                if (stripos($line, 'Retry-After:') === 0) $retryAfter = (int)trim(substr($line, 12));
+                return strlen($line);
+            },
             CURLOPT_HTTPHEADER => $headers,
             CURLOPT_RETURNTRANSFER => true,
             CURLOPT_TIMEOUT => $timeout,
@@ -54,9 +78,11 @@ final class RunnerClient {
         if ($err) throw new RunnerUnavailableException('curl: ' . $err);
         
         $json = json_decode((string)$raw, true);
-        if ($code === 200 && is_array($json)) return $json;
+        if (($code === 200 || $code === 202) && is_array($json)) return $json;
+        if ($code === 404) throw new RunnerBadRequestException($json['detail'] ?? 'job not found', 404);
         if ($code === 401) throw new RunnerAuthException('unauthorized');
-        if ($code === 400) throw new RunnerBadRequestException($json['error'] ?? 'bad request');
+        if ($code === 400) throw new RunnerBadRequestException($json['error'] ?? 'bad request', 400);
+        if ($code === 429) throw new RunnerBusyException($json['detail'] ?? 'runner busy', max(1, $retryAfter ?? 30));
         if ($code >= 500) throw new RunnerProcessingException($json['error'] ?? 'runner 5xx');
         
         throw new RunnerProcessingException('unexpected status ' . $code);
@@ -71,7 +97,10 @@ final class RunnerClient {
                 // For now, fall back to job ID
             }
             $jobId = trim((string)$jobId, " \t\n\r\0\x0B\"'");
-            return $this->curl('GET', "/status/{$jobId}", null, 30);
+            $json = $this->curl('GET', "/status/" . rawurlencode($jobId), null, 30);
+            return ['ok' => true, 'status' => 200, 'json' => $json, 'raw' => null, 'error' => null];
+        } catch (RunnerBadRequestException $e) {
+            return ['ok' => false, 'status' => $e->getCode() ?: 400, 'json' => null, 'raw' => null, 'error' => $e->getMessage()];
         } catch (RunnerUnavailableException | RunnerProcessingException $e) {
             // Return old format for backwards compatibility
             return ['ok' => false, 'status' => 0, 'json' => null, 'raw' => null, 'error' => $e->getMessage()];
@@ -6,6 +6,13 @@ class RunnerAuthException extends Exception {}
 class RunnerBadRequestException extends Exception {}
 class RunnerProcessingException extends Exception {}
 
+// 429: the runner's queue is full; retry after the given number of seconds
+class RunnerBusyException extends RunnerUnavailableException {
+    public function __construct(string $message, public readonly int $retryAfter = 30) {
+        parent::__construct($message, 429);
+    }
+}
+
 
 
 
@@ -0,0 +1,236 @@
+"""
+Admission control: only start jobs whose estimated peak memory and CPU fit the budget.
+
+A job's cost is estimated from the input header alone (dimensions and planned
+upscale), before anything is decoded. VTracer holds about 64 bytes per traced
+pixel at its peak (measured), so a single 8192x8192 upscaled raster needs over
+4 GB; tiled traces instead keep the raster plus one padded tile per tracing
+process. Jobs that fit the remaining budget start at once, the rest wait in
+arrival order (a big job is not overtaken indefinitely by small ones), and a
+job larger than the whole budget runs alone. When the wait list is full the
+caller is told to come back later, with a Retry-After derived from how fast
+jobs have been finishing recently.
+"""
+import os
+import math
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Optional
+
+from tiled_trace import TILE_SIZE, TILE_OVERLAP, TILE_MIN_PIXELS, TILE_WORKERS
+
+# === CONFIG ===
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+# Memory jobs may hold at once (0 = 60% of physical memory)
+ADMISSION_MEMORY_MB = int(os.getenv('ADMISSION_MEMORY_MB', '0'))
+# Cores jobs may occupy at once (0 = CPU count)
+ADMISSION_CPU = int(os.getenv('ADMISSION_CPU', '0'))
+# Jobs allowed to wait for budget before new ones are turned away (0 = no limit)
+ADMISSION_MAX_WAITING = int(os.getenv('ADMISSION_MAX_WAITING', '8'))
+ADMISSION_MAX_RETRY_AFTER_SEC = int(os.getenv('ADMISSION_MAX_RETRY_AFTER_SEC', '300'))
+
+# Peak bytes per pixel: VTracer's working set, and a decoded RGBA raster
+TRACE_BYTES_PER_PIXEL = 64
+RASTER_BYTES_PER_PIXEL = 4
+# Completions this recent set the drain rate
+DRAIN_WINDOW_SEC = 300
+# Retry-After when nothing has finished recently to measure a rate from
+DEFAULT_RETRY_AFTER_SEC = 30
+# Shortest span a drain rate is measured over, so one early completion does not promise a fast queue
+MIN_DRAIN_SPAN_SEC = 10
+FALLBACK_MEMORY_MB = 4096
+
+
+class AdmissionRejected(Exception):
+    """Too many jobs are already waiting for budget; retry_after says when to try again"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# eq=False: waiting jobs are told apart by identity, even with equal costs
+@dataclass(eq=False)
+class JobCost:
+    memory_bytes: int
+    cpu: int
+    traced_pixels: int
+    tiled: bool
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def estimate_cost(width: int, height: int, scale: int = 1, tiling: bool = True) -> JobCost:
+    """Peak memory and cores for a width x height raster traced after a scale-times upscale"""
+    source_pixels = width * height
+    traced_pixels = source_pixels * scale * scale
+    memory = source_pixels * RASTER_BYTES_PER_PIXEL
+
+    tiled = tiling and TILE_WORKERS > 1 and traced_pixels >= TILE_MIN_PIXELS
+    if tiled:
+        tiles = math.ceil(width * scale / TILE_SIZE) * math.ceil(height * scale / TILE_SIZE)
+        cpu = min(TILE_WORKERS, tiles)
+        tile_pixels = (TILE_SIZE + 2 * TILE_OVERLAP) ** 2
+        # The upscaled raster (and its PNG) in this process, one padded tile per tracing process
+        memory += traced_pixels * RASTER_BYTES_PER_PIXEL * 2 + cpu * tile_pixels * TRACE_BYTES_PER_PIXEL
+    else:
+        cpu = 1
+        memory += traced_pixels * TRACE_BYTES_PER_PIXEL
+    return JobCost(memory_bytes=memory, cpu=cpu, traced_pixels=traced_pixels, tiled=tiled)
+
+
+def default_memory_budget() -> int:
+    if ADMISSION_MEMORY_MB:
+        return ADMISSION_MEMORY_MB * 1024 * 1024
+    try:
+        return int(os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') * 0.6)
+    except (AttributeError, ValueError, OSError):
+        # No sysconf (Windows)
+        return FALLBACK_MEMORY_MB * 1024 * 1024
+
+
+class AdmissionController:
+    """Memory and CPU budget shared by the jobs of one process, with a bounded FIFO wait list"""
+
+    def __init__(self, memory_budget: Optional[int] = None, cpu_budget: Optional[int] = None,
+                 max_waiting: int = ADMISSION_MAX_WAITING, max_running: int = 0,
+                 enabled: bool = ADMISSION_ENABLED):
+        self.memory_budget = memory_budget or default_memory_budget()
+        self.cpu_budget = cpu_budget or ADMISSION_CPU or (os.cpu_count() or 1)
+        self.max_waiting = max_waiting
+        # Jobs running at once regardless of their cost (0 = only the budget limits them)
+        self.max_running = max_running
+        self.enabled = enabled
+        self.memory_in_use = 0
+        self.cpu_in_use = 0
+        self.running = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.waited_seconds = 0.0
+        self._waiting = deque()
+        self._finished = deque()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def acquire(self, cost: JobCost) -> JobCost:
+        """Wait until the job fits and reserve its share; returns the reservation to release
+
+        Raises AdmissionRejected straight away when the wait list is full.
+        """
+        # A job bigger than the whole budget is admitted once it has the machine to itself
+        share = JobCost(min(cost.memory_bytes, self.memory_budget), min(cost.cpu, self.cpu_budget),
+                        cost.traced_pixels, cost.tiled)
+        with self._lock:
+            if self._waiting or not self._fits(share):
+                if self.max_waiting and len(self._waiting) >= self.max_waiting:
+                    self.rejected += 1
+                    retry_after = self._retry_after(len(self._waiting) + self.running)
+                    raise AdmissionRejected(
+                        f"Server is at capacity ({self.running} running, {len(self._waiting)} waiting)",
+                        retry_after
+                    )
+                started = time.time()
+                self._waiting.append(share)
+                try:
+                    self._changed.wait_for(lambda: self._waiting[0] is share and self._fits(share))
+                finally:
+                    self._waiting.remove(share)
+                    self._changed.notify_all()
+                self.waited_seconds += time.time() - started
+
+            self.memory_in_use += share.memory_bytes
+            self.cpu_in_use += share.cpu
+            self.running += 1
+            self.admitted += 1
+        return share
+
+    def release(self, share: JobCost):
+        with self._lock:
+            self.memory_in_use -= share.memory_bytes
+            self.cpu_in_use -= share.cpu
+            self.running -= 1
+            self._finished.append(time.time())
+            self._changed.notify_all()
+
+    @contextmanager
+    def admit(self, cost: JobCost):
+        """Hold the job's share of the budget for the duration of the block"""
+        share = self.acquire(cost)
+        try:
+            yield share
+        finally:
+            self.release(share)
+
+    def _fits(self, share: JobCost) -> bool:
+        if self.running == 0:
+            return True
+        if self.max_running and self.running >= self.max_running:
+            return False
+        if not self.enabled:
+            return True
+        return (self.memory_in_use + share.memory_bytes <= self.memory_budget
+                and self.cpu_in_use + share.cpu <= self.cpu_budget)
+
+    def drain_rate(self) -> float:
+        """Jobs finished per second over the recent window"""
+        with self._lock:
+            return self._drain_rate()
+
+    def _drain_rate(self) -> float:
+        now = time.time()
+        while self._finished and self._finished[0] < now - DRAIN_WINDOW_SEC:
+            self._finished.popleft()
+        if not self._finished:
+            return 0.0
+        # Measure over the span actually observed, so a fresh process is not read as slow
+        span = max(now - self._finished[0], MIN_DRAIN_SPAN_SEC)
+        return len(self._finished) / span
+
+    def retry_after(self, backlog: int) -> int:
+        """Seconds until the given number of jobs ahead should have drained"""
+        with self._lock:
+            return self._retry_after(backlog)
+
+    def _retry_after(self, backlog: int) -> int:
+        rate = self._drain_rate()
+        seconds = (backlog + 1) / rate if rate > 0 else DEFAULT_RETRY_AFTER_SEC
+        return max(1, min(ADMISSION_MAX_RETRY_AFTER_SEC, math.ceil(seconds)))
+
+    def export_metrics(self, metrics):
+        """Budget use and the wait list as gauges on the given Metrics (rejections count as errors)"""
+        memory = metrics.registry.gauge('vectorizer_admission_memory_bytes',
+                                        "Estimated job memory admitted, and the budget", ['state'])
+        memory.set_function(lambda: {'in_use': self.memory_in_use, 'budget': self.memory_budget})
+        jobs = metrics.registry.gauge('vectorizer_admission_jobs', "Jobs holding or waiting for budget", ['state'])
+        jobs.set_function(lambda: {'running': self.running, 'waiting': len(self._waiting)})
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "memory_budget_mb": round(self.memory_budget / 1048576),
+                "memory_in_use_mb": round(self.memory_in_use / 1048576, 1),
+                "cpu_budget": self.cpu_budget,
+                "cpu_in_use": self.cpu_in_use,
+                "running": self.running,
+                "waiting": len(self._waiting),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "waited_seconds": round(self.waited_seconds, 1),
+                "drain_rate_per_min": round(self._drain_rate() * 60, 2),
+            }
+
+
+_admission_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller(**kwargs) -> AdmissionController:
+    """Get or create the process-wide admission controller"""
+    global _admission_controller
+    if _admission_controller is None:
+        _admission_controller = AdmissionController(**kwargs)
+    return _admission_controller
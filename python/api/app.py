@@ -1,21 +1,36 @@
 import os
-import subprocess
 import sys
-import uuid
-import requests
-from flask import Flask, request, jsonify, send_file
+import shlex
+from flask import Flask, request, jsonify, send_file, Response
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import logging
 import traceback
 
+from PIL import Image
+
+# Shared vectorization modules live one level up in python/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 try:
-    import vtracer
+    # Traces with vtracer, so a missing install shows up here
+    import memory_trace
 except ImportError:
     print("You need to install vtracer: python -m pip install vtracer")
     sys.exit(1)
-
-from PIL import Image
+from preprocess import open_header, load_image, fit_size, optimize_large_image, ImageTooLarge
+from svg_cache import get_svg_cache, make_cache_key
+from image_fetcher import get_image_fetcher
+from waifu2x_batcher import Waifu2xBatcher
+from upscale_planner import plan_upscale
+from svg_simplify import simplify_svg
+from precompress import select_variant, strong_etag
+from output_store import get_output_store, Janitor, JANITOR_ENABLED
+from image_analysis import analyze_image
+from vtracer_presets import resolve_preset, get_preset, PRESET_NAMES, DEFAULT_PRESET
+from metrics import get_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from worker_slots import get_worker_slots
+from admission import (get_admission_controller, estimate_cost, default_memory_budget,
+                       AdmissionRejected, ADMISSION_CPU)
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -35,15 +50,74 @@ logger = logging.getLogger(__name__)
 # === CONFIG ===
 waifu2x_dir = r"C:\waifu2x-ncnn-vulkan-20230413-win64"  # Update this path
 waifu2x_exe = os.path.join(waifu2x_dir, "waifu2x-ncnn-vulkan.exe" if os.name == "nt" else "waifu2x-ncnn-vulkan")
-scale = 4
+scale = 4  # Maximum scale; the upscale planner picks 4, 2 or 1 per image
+pixel_budget = int(os.environ.get('UPSCALE_PIXEL_BUDGET', str(4096 * 4096)))  # Upscaled raster size limit
 noise = 3
 model = "models-upconv_7_anime_style_art_rgb"
+waifu2x_cmd = os.environ.get('WAIFU2X_CMD', '')  # Optional override, e.g. "python ../fake_waifu2x.py" without a GPU
+use_tiling = os.environ.get('VTRACER_TILING', 'true').lower() == 'true'  # Trace large rasters in parallel tiles
+simplify_default = os.environ.get('SVG_SIMPLIFY', 'false').lower() == 'true'  # Simplify paths after tracing (opt-in)
+simplify_tolerance = float(os.environ.get('SVG_SIMPLIFY_TOLERANCE', '0.5'))  # Max deviation in pixels
+merge_fills_default = os.environ.get('SVG_MERGE_FILLS', 'true').lower() == 'true'  # Merge same-fill neighbours
+worker_concurrency = int(os.environ.get('API_WORKER_CONCURRENCY', '1'))  # /vectorize jobs one worker process runs at once
 
 # Directory configuration
 UPLOAD_FOLDER = os.path.abspath('uploads')
 OUTPUT_FOLDER = os.path.abspath('outputs')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+DOWNLOAD_MAX_AGE = 365 * 24 * 3600  # Output files never change once written
+
+MAX_DIMENSION = 2048  # Larger inputs are downscaled before processing
+
+def cache_params(preset):
+    """Everything that affects the SVG output, used for the result cache key"""
+    return {
+        'preset': preset['resolved'],
+        'max_scale': preset['max_scale'],
+        'pixel_budget': pixel_budget,
+        'noise': noise,
+        'model': model,
+        'max_dimension': MAX_DIMENSION,
+        'vtracer': preset['vtracer']
+    }
+
+svg_cache = get_svg_cache()
+# Busy/idle state of every worker process serving this API (just this one under the dev server)
+worker_slots = get_worker_slots()
+# Content-addressed, sharded outputs; the janitor applies TTL and quota and clears stale temp files.
+# Every worker runs one, but only the lowest-numbered live worker sweeps.
+output_store = get_output_store(OUTPUT_FOLDER)
+janitor = Janitor(output_store, temp_dirs=[UPLOAD_FOLDER], leader=worker_slots.is_leader)
+if JANITOR_ENABLED:
+    janitor.start()
+image_fetcher = get_image_fetcher()
+metrics = get_metrics()
+workers_gauge = metrics.registry.gauge('vectorizer_workers', "API worker processes by state", ['state'])
+
+def worker_counts():
+    snapshot = worker_slots.snapshot()
+    return {'total': snapshot['workers'], 'busy': snapshot['busy']}
+
+# Already pool-wide (shared memory), so not summed across workers
+workers_gauge.set_function(worker_counts, pool_wide=True)
+
+# Jobs start only when their estimated memory and CPU fit; each worker process gets an equal part
+# of the machine, runs at most worker_concurrency jobs and turns requests away once too many wait
+admission = get_admission_controller(
+    memory_budget=default_memory_budget() // worker_slots.workers,
+    cpu_budget=max(1, (ADMISSION_CPU or os.cpu_count() or 1) // worker_slots.workers),
+    max_running=max(1, worker_concurrency)
+)
+admission.export_metrics(metrics)
+
+# Concurrent uploads needing the same settings share one Waifu2x launch
+if waifu2x_cmd:
+    waifu2x_batcher = Waifu2xBatcher(shlex.split(waifu2x_cmd, posix=os.name != 'nt'), UPLOAD_FOLDER)
+elif os.path.exists(waifu2x_exe):
+    waifu2x_batcher = Waifu2xBatcher([waifu2x_exe], UPLOAD_FOLDER)
+else:
+    waifu2x_batcher = None
 
 def create_directories():
     """Create upload and output directories if they don't exist"""
@@ -55,109 +129,64 @@ def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def generate_unique_filename(extension):
-    """Generate a unique filename with the given extension"""
-    return f"{uuid.uuid4().hex}.{extension}"
-
-def download_image_from_url(url, save_path):
-    """Download image from URL and save to specified path"""
+def download_image_from_url(url):
+    """Download image from URL into memory through the pooled fetcher"""
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=30, stream=True)
-        response.raise_for_status()
-        
-        # Check content type
-        content_type = response.headers.get('content-type', '').lower()
-        if not any(img_type in content_type for img_type in ['image/jpeg', 'image/png', 'image/jpg']):
-            raise ValueError(f"Invalid content type: {content_type}")
-        
-        # Check file size
-        content_length = response.headers.get('content-length')
-        if content_length and int(content_length) > MAX_FILE_SIZE:
-            raise ValueError("File too large")
-        
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        
-        return True
+        return image_fetcher.fetch(url, max_bytes=MAX_FILE_SIZE)
     except Exception as e:
         logger.error(f"Failed to download image from URL: {str(e)}")
         raise
 
-def run_waifu2x(input_path, output_path):
-    """Run Waifu2x upscaling with the same settings as original script"""
-    # Check if waifu2x exists
-    if not os.path.exists(waifu2x_exe):
-        logger.warning(f"Waifu2x not found at {waifu2x_exe}, skipping upscaling")
-        # Copy original file instead of upscaling
-        import shutil
-        shutil.copy2(input_path, output_path)
-        return True
+def upscale_image_bytes(image_data, upscale_scale):
+    """Upscale image bytes with Waifu2x, sharing one launch with other queued images"""
+    if upscale_scale <= 1:
+        logger.info("Upscale plan is 1x, skipping Waifu2x")
+        return image_data
     
-    cmd = [
-        waifu2x_exe,
-        "-i", input_path,
-        "-o", output_path,
-        "-n", str(noise),
-        "-s", str(scale),
-        "-m", model
-    ]
-    
-    logger.info(f"Running Waifu2x: {' '.join(cmd)}")
+    if waifu2x_batcher is None:
+        logger.warning(f"Waifu2x not found at {waifu2x_exe}, skipping upscaling")
+        metrics.waifu2x_fallbacks.labels('unavailable').inc()
+        return image_data
     
-    try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)  # Increased from 300 to 600 seconds (10 minutes)
-        if result.returncode != 0:
-            error_msg = result.stderr or result.stdout or "Unknown Waifu2x error"
-            logger.error(f"Waifu2x failed: {error_msg}")
-            # Fallback: copy original file
-            import shutil
-            shutil.copy2(input_path, output_path)
-            logger.info("Fallback: copied original file instead of upscaling")
-        
-        logger.info(f"Waifu2x completed successfully: {output_path}")
-        return True
-    except subprocess.TimeoutExpired:
-        logger.error("Waifu2x process timed out after 10 minutes, using fallback")
-        import shutil
-        shutil.copy2(input_path, output_path)
-        return True
-    except Exception as e:
-        logger.error(f"Waifu2x execution error: {str(e)}, using fallback")
-        import shutil
-        shutil.copy2(input_path, output_path)
-        return True
+    upscaled = waifu2x_batcher.upscale(image_data, upscale_scale, noise, model)
+    if upscaled is image_data:
+        # The batcher hands back the original bytes when Waifu2x failed
+        metrics.waifu2x_fallbacks.labels('failed').inc()
+    return upscaled
 
-def run_vtracer(input_path, output_path):
-    """Run VTracer with the same settings as original script"""
+def run_vtracer(image_data, preset):
+    """Run VTracer in memory with the preset's settings, returning the SVG"""
     try:
-        logger.info(f"Running VTracer: {input_path} -> {output_path}")
+        logger.info(f"Running VTracer on {len(image_data)} bytes")
         
-        vtracer.convert_image_to_svg_py(
-            input_path,
-            output_path,
-            colormode="color",
-            mode="spline",
-            filter_speckle=12,
-            color_precision=8,
-            layer_difference=16,
-            corner_threshold=55,
-            length_threshold=3.0,
-            max_iterations=15,
-            splice_threshold=55,
-            path_precision=3
-        )
+        # Large upscaled rasters are split into tiles and traced on all cores
+        svg = memory_trace.trace_bytes(image_data, preset['vtracer'], tiling=use_tiling)
         
-        logger.info(f"VTracer completed successfully: {output_path}")
-        return True
+        logger.info(f"VTracer completed successfully ({len(svg)} bytes of SVG)")
+        return svg
     except Exception as e:
         logger.error(f"VTracer error: {str(e)}")
         logger.error(f"VTracer traceback: {traceback.format_exc()}")
         raise RuntimeError(f"VTracer failed: {str(e)}")
 
+def estimate_job_cost(width, height, preset_name):
+    """Peak memory and cores of a job, from the header size and the upscale it will get"""
+    if max(width, height) > MAX_DIMENSION:
+        width, height = fit_size(width, height, MAX_DIMENSION)
+    # 'auto' is only resolved after decoding, so assume the largest scale
+    max_scale = scale if preset_name == 'auto' else min(get_preset(preset_name)['max_scale'], scale)
+    upscale = plan_upscale(width, height, max_scale, pixel_budget)['scale'] if waifu2x_batcher else 1
+    return estimate_cost(width, height, upscale, use_tiling)
+
+def warm_up():
+    """Run a tiny image through decoding, tracing and simplification so this process's first job is not slower"""
+    img = Image.new('RGB', (64, 64), 'white')
+    img.paste((200, 30, 30), (16, 16, 48, 48))
+    image_data = memory_trace.encode_png(img)
+    load_image(open_header(image_data), MAX_DIMENSION)
+    svg = run_vtracer(image_data, resolve_preset(DEFAULT_PRESET))
+    simplify_svg(svg, simplify_tolerance, None, merge_fills_default)
+
 def cleanup_file(file_path):
     """Safely delete a file"""
     try:
@@ -167,46 +196,46 @@ def cleanup_file(file_path):
     except Exception as e:
         logger.warning(f"Failed to cleanup file {file_path}: {str(e)}")
 
-def optimize_large_image(input_path, max_dimension=2048):
-    """Optimize large images before processing to prevent timeouts"""
-    try:
-        with Image.open(input_path) as img:
-            width, height = img.size
-            logger.info(f"Original image size: {width}x{height}")
-            
-            # If image is too large, resize it
-            if width > max_dimension or height > max_dimension:
-                logger.info(f"Image is large, resizing to max dimension: {max_dimension}")
-                
-                # Calculate new size maintaining aspect ratio
-                if width > height:
-                    new_width = max_dimension
-                    new_height = int((height * max_dimension) / width)
-                else:
-                    new_height = max_dimension
-                    new_width = int((width * max_dimension) / height)
-                
-                # Resize image
-                resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                
-                # Save optimized image
-                optimized_path = input_path.replace('.', '_optimized.')
-                resized_img.save(optimized_path, optimize=True, quality=95)
-                
-                logger.info(f"Optimized image saved: {optimized_path} ({new_width}x{new_height})")
-                return optimized_path
-            
-            return input_path
-    except Exception as e:
-        logger.error(f"Image optimization failed: {str(e)}")
-        return input_path
+def get_request_source():
+    """Form fields for uploads, otherwise the JSON body"""
+    return request.form if request.files else (request.get_json(silent=True) or {})
+
+def get_simplify_options():
+    """Read per-request simplification settings from form fields or the JSON body"""
+    source = get_request_source()
+    
+    def flag(name, default):
+        value = source.get(name)
+        if value is None:
+            return default
+        return str(value).lower() in ('1', 'true', 'yes', 'on')
+    
+    precision = source.get('simplify_precision')
+    options = {
+        'enabled': flag('simplify', simplify_default),
+        'tolerance': float(source.get('simplify_tolerance', simplify_tolerance)),
+        'precision': int(precision) if precision not in (None, '') else None,
+        'merge_fills': flag('merge_fills', merge_fills_default)
+    }
+    if not 0 <= options['tolerance'] <= 10:
+        raise ValueError('simplify_tolerance must be between 0 and 10')
+    if options['precision'] is not None and not 0 <= options['precision'] <= 6:
+        raise ValueError('simplify_precision must be between 0 and 6')
+    return options
 
 @app.route('/vectorize', methods=['POST'])
 def vectorize_image():
     """Main endpoint for image vectorization"""
-    input_file_path = None
-    upscaled_file_path = None
+    with metrics.jobs_in_flight.track():
+        response = vectorize_request()
     
+    status = response[1] if isinstance(response, tuple) else 200
+    metrics.jobs.labels('failed' if status >= 400 else 'done').inc()
+    return response
+
+def vectorize_request():
+    """Handle one /vectorize request, returning the Flask response"""
+    share = None
     try:
         logger.info(f"Received vectorize request")
         logger.info(f"Content-Type: {request.content_type}")
@@ -224,20 +253,9 @@ def vectorize_image():
             if not allowed_file(file.filename):
                 return jsonify({'success': False, 'error': 'Invalid file type. Only PNG, JPG, JPEG allowed'}), 400
             
-            # Save uploaded file
-            file_extension = file.filename.rsplit('.', 1)[1].lower()
-            input_filename = generate_unique_filename(file_extension)
-            input_file_path = os.path.join(UPLOAD_FOLDER, input_filename)
-            
-            logger.info(f"Saving file to: {input_file_path}")
-            file.save(input_file_path)
-            
-            # Verify file was saved
-            if not os.path.exists(input_file_path):
-                return jsonify({'success': False, 'error': 'Failed to save uploaded file'}), 500
-            
-            file_size = os.path.getsize(input_file_path)
-            logger.info(f"File saved successfully: {input_file_path} ({file_size} bytes)")
+            # Read uploaded file into memory
+            image_data = file.read()
+            logger.info(f"File received: {file.filename} ({len(image_data)} bytes)")
             
         elif request.is_json and 'image_url' in request.json:
             # Handle URL download
@@ -247,116 +265,171 @@ def vectorize_image():
             if not image_url:
                 return jsonify({'success': False, 'error': 'No image URL provided'}), 400
             
-            # Determine file extension from URL or default to jpg
-            url_lower = image_url.lower()
-            if url_lower.endswith('.png'):
-                file_extension = 'png'
-            elif url_lower.endswith(('.jpg', '.jpeg')):
-                file_extension = 'jpg'
-            else:
-                file_extension = 'jpg'  # Default
-            
-            input_filename = generate_unique_filename(file_extension)
-            input_file_path = os.path.join(UPLOAD_FOLDER, input_filename)
-            
             # Download image from URL
-            download_image_from_url(image_url, input_file_path)
-            logger.info(f"Image downloaded from URL: {input_file_path}")
+            with metrics.stage('download'):
+                image_data = download_image_from_url(image_url)
+            logger.info(f"Image downloaded from URL ({len(image_data)} bytes)")
             
         else:
             logger.warning(f"Invalid request format")
             return jsonify({'success': False, 'error': 'No image file or URL provided'}), 400
         
-        # Validate that the file exists and is a valid image
-        if not os.path.exists(input_file_path):
-            return jsonify({'success': False, 'error': 'Failed to save input file'}), 500
+        if not image_data:
+            return jsonify({'success': False, 'error': 'Empty input file'}), 400
+        
+        try:
+            simplify = get_simplify_options()
+        except ValueError as e:
+            return jsonify({'success': False, 'error': f'Invalid simplify options: {str(e)}'}), 400
+        
+        preset_name = get_request_source().get('preset') or DEFAULT_PRESET
+        if preset_name not in PRESET_NAMES:
+            return jsonify({'success': False, 'error': f'Invalid preset. Must be one of: {", ".join(PRESET_NAMES)}'}), 400
 
         try:
-            # Verify it's a valid image
-            with Image.open(input_file_path) as img:
-                width, height = img.size
-                logger.info(f"Image dimensions: {width}x{height}")
-                img.verify()
+            # Header check and pixel limit before any decoding
+            with metrics.stage('verify'):
+                img = open_header(image_data)
+                source_size = img.size
+        except ImageTooLarge as e:
+            metrics.error(e)
+            return jsonify({'success': False, 'error': str(e)}), 413
         except Exception as e:
-            cleanup_file(input_file_path)
+            metrics.error(e)
             return jsonify({'success': False, 'error': f'Invalid image file: {str(e)}'}), 400
 
-        # Optimize large images before processing
-        input_file_path = optimize_large_image(input_file_path)
-        
-        # Generate paths for processing
-        base_name = os.path.splitext(input_filename)[0]
-        upscaled_filename = f"{base_name}_waifu2x.png"
-        upscaled_file_path = os.path.join(UPLOAD_FOLDER, upscaled_filename)
-        
-        svg_filename = f"{base_name}.svg"
-        svg_file_path = os.path.join(OUTPUT_FOLDER, svg_filename)
-        
-        logger.info(f"Processing paths:")
-        logger.info(f"  Input: {input_file_path}")
-        logger.info(f"  Upscaled: {upscaled_file_path}")
-        logger.info(f"  SVG: {svg_file_path}")
-        
-        # Step 1: Run Waifu2x upscaling
-        logger.info("Starting Waifu2x upscaling...")
-        run_waifu2x(input_file_path, upscaled_file_path)
-        
-        # Verify upscaled file exists
-        if not os.path.exists(upscaled_file_path):
-            cleanup_file(input_file_path)
-            return jsonify({'success': False, 'error': 'Upscaling failed - no output file'}), 500
-        
-        # Step 2: Run VTracer vectorization
-        logger.info("Starting VTracer vectorization...")
-        run_vtracer(upscaled_file_path, svg_file_path)
+        # Wait for this job's memory and CPU (estimated from the header), or shed it when too many wait
+        try:
+            with metrics.stage('admission'):
+                share = admission.acquire(estimate_job_cost(*source_size, preset_name))
+        except AdmissionRejected as e:
+            logger.warning(f"Rejecting request: {e}")
+            metrics.error(e)
+            return (jsonify({'success': False, 'error': str(e), 'retry_after': e.retry_after}), 429,
+                    {'Retry-After': str(e.retry_after)})
+        worker_slots.job_started()
+
+        try:
+            # A single decode (large JPEGs decode straight at a reduced scale)
+            with metrics.stage('verify'):
+                load_image(img, MAX_DIMENSION)
+            width, height = img.size
+            logger.info(f"Image dimensions: {source_size[0]}x{source_size[1]}")
+            metrics.input_pixels.observe(source_size[0] * source_size[1])
+        except Exception as e:
+            metrics.error(e)
+            return jsonify({'success': False, 'error': f'Invalid image file: {str(e)}'}), 400
+
+        # Pick the preset; 'auto' classifies the image from a thumbnail first
+        analysis = analyze_image(img) if preset_name == 'auto' else None
+        preset = resolve_preset(preset_name, analysis)
+        preset['max_scale'] = min(preset['max_scale'], scale)
+        logger.info(f"Preset: {preset['resolved']} ({preset['reason']})")
+
+        # Serve repeat uploads of the same pixels straight from the result cache
+        cache_key = make_cache_key(img, cache_params(preset)) if svg_cache else None
+        svg = svg_cache.get(cache_key) if cache_key else None
+        cached = svg is not None
+        upscale_plan = None
         
-        # Verify SVG was created
-        if not os.path.exists(svg_file_path):
-            cleanup_file(input_file_path)
-            cleanup_file(upscaled_file_path)
-            return jsonify({'success': False, 'error': 'Vectorization failed - no SVG output'}), 500
+        if cached:
+            logger.info(f"Cache hit ({cache_key[:12]})")
+        else:
+            # Optimize large images before processing
+            with metrics.stage('optimize'):
+                processed_img = optimize_large_image(img, MAX_DIMENSION) or img
+                if processed_img.size != source_size:
+                    # The upload's own bytes no longer match: hand on a fast, lightly compressed PNG
+                    image_data = memory_trace.encode_png(processed_img)
+                    width, height = processed_img.size
+            
+            # Step 1: Run Waifu2x upscaling at the planned scale
+            upscale_plan = plan_upscale(width, height, preset['max_scale'], pixel_budget)
+            logger.info(f"Starting Waifu2x upscaling ({upscale_plan['scale']}x: {upscale_plan['reason']})...")
+            with metrics.stage('upscale'):
+                upscaled_data = upscale_image_bytes(image_data, upscale_plan['scale'])
+            
+            # Step 2: Run VTracer vectorization
+            logger.info("Starting VTracer vectorization...")
+            with metrics.stage('trace'):
+                svg = run_vtracer(upscaled_data, preset)
+            
+            # A trace of the original bytes after a Waifu2x fallback does not match the key's scale
+            upscale_fell_back = upscale_plan['scale'] > 1 and upscaled_data is image_data
+            if cache_key and not upscale_fell_back:
+                svg_cache.put(cache_key, svg)
         
-        svg_size = os.path.getsize(svg_file_path)
-        logger.info(f"SVG created successfully: {svg_file_path} ({svg_size} bytes)")
+        # Step 3: Simplify paths (the cache keeps the raw trace so options can differ per request)
+        simplify_stats = None
+        if simplify['enabled']:
+            with metrics.stage('simplify'):
+                svg, simplify_stats = simplify_svg(svg, simplify['tolerance'], simplify['precision'], simplify['merge_fills'])
+            logger.info(f"Simplified SVG: {simplify_stats['bytes_before']} -> {simplify_stats['bytes_after']} bytes")
         
-        # Cleanup temporary files
-        cleanup_file(input_file_path)
-        cleanup_file(upscaled_file_path)
+        # Store the SVG (named by its content) with gzip/brotli sidecars so downloads never compress on the fly
+        svg_bytes = svg.encode('utf-8')
+        metrics.output_bytes.observe(len(svg_bytes))
+        with metrics.stage('upload'):
+            svg_filename = output_store.put(svg_bytes)
         
-        logger.info(f"Vectorization completed successfully: {svg_filename}")
+        logger.info(f"Vectorization completed successfully: {svg_filename} ({len(svg)} bytes)")
         
         return jsonify({
             'success': True,
             'svg_filename': svg_filename,
-            'download_url': f'/download/{svg_filename}'
+            'download_url': f'/download/{svg_filename}',
+            'cached': cached,
+            'upscale': upscale_plan,
+            'preset': {key: preset[key] for key in ('name', 'resolved', 'reason')},
+            'simplify': simplify_stats
         })
         
     except Exception as e:
-        # Cleanup on error
-        cleanup_file(input_file_path)
-        cleanup_file(upscaled_file_path)
-        
         error_message = str(e)
         logger.error(f"Vectorization failed: {error_message}")
+        metrics.error(e)
         logger.error(f"Traceback: {traceback.format_exc()}")
         
         return jsonify({
             'success': False,
             'error': error_message
         }), 500
+    finally:
+        if share is not None:
+            worker_slots.job_finished()
+            admission.release(share)
 
 @app.route('/download/<filename>')
 def download_file(filename):
-    """Download endpoint for SVG files"""
+    """Download endpoint for SVG files (precompressed, ETag/304 and Range aware)"""
     try:
-        file_path = os.path.join(OUTPUT_FOLDER, secure_filename(filename))
-        logger.info(f"Download request for: {file_path}")
+        name = secure_filename(filename)
+        file_path = output_store.locate(name)
+        logger.info(f"Download request for: {name}")
         
-        if not os.path.exists(file_path):
-            logger.warning(f"File not found: {file_path}")
+        if file_path is None:
+            logger.warning(f"File not found: {name}")
             return jsonify({'error': 'File not found'}), 404
+        output_store.touch(name)
+        
+        # Serve the best precompressed sidecar the client accepts
+        served_path, encoding = select_variant(file_path, request.headers.get('Accept-Encoding'))
         
-        return send_file(file_path, as_attachment=True)
+        # conditional=True answers If-None-Match with 304 and Range with 206
+        response = send_file(
+            served_path,
+            mimetype='image/svg+xml',
+            as_attachment=True,
+            download_name=os.path.basename(file_path),
+            conditional=True,
+            etag=strong_etag(file_path, encoding),
+            max_age=DOWNLOAD_MAX_AGE
+        )
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.cache_control.immutable = True
+        return response
     except Exception as e:
         logger.error(f"Download error: {str(e)}")
         return jsonify({'error': 'Download failed'}), 500
@@ -366,13 +439,25 @@ def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
-        'waifu2x_available': os.path.exists(waifu2x_exe),
+        'waifu2x_available': waifu2x_batcher is not None,
+        'waifu2x': waifu2x_batcher.stats() if waifu2x_batcher else None,
         'directories': {
             'uploads': os.path.exists(UPLOAD_FOLDER),
             'outputs': os.path.exists(OUTPUT_FOLDER)
-        }
+        },
+        'cache': svg_cache.stats() if svg_cache else None,
+        'outputs': output_store.stats(),
+        'janitor': janitor.stats(),
+        'workers': dict(worker_slots.snapshot(), pid=os.getpid(), concurrency=worker_concurrency),
+        'admission': admission.stats(),
+        'fetch': image_fetcher.host_stats()
     })
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
 @app.errorhandler(413)
 def too_large(e):
     return jsonify({'success': False, 'error': 'File too large'}), 413
@@ -1,10 +1,44 @@
 #!/usr/bin/env python3
 """
 Production runner for the VectorizeAI Flask API
+
+Serves the app with Gunicorn: API_WORKERS processes (one per core by default),
+each importing the app and warming vtracer/PIL once before taking traffic.
+A worker runs up to API_WORKER_CONCURRENCY vectorize jobs at a time and has
+API_WORKER_THREADS request threads, so /health and downloads are answered while
+its jobs run. `kill -HUP <master pid>` (written to API_PIDFILE) reloads
+gracefully: fresh workers start on the new code and the old ones finish their
+requests (up to API_GRACEFUL_TIMEOUT) before exiting. /health and the
+vectorizer_workers gauge report how many workers are busy, and the workers
+share their metrics through METRICS_MULTIPROC_DIR so /metrics covers the pool.
+
+Gunicorn does not run on Windows; there, or with FLASK_DEBUG=true, the Flask
+development server is used as before (one process).
 """
 import os
 import sys
-from app import app, create_directories, waifu2x_exe
+import time
+import tempfile
+
+# Shared vectorization modules live one level up in python/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from worker_slots import create_worker_slots, get_worker_slots
+
+# === CONFIG ===
+API_WORKERS = int(os.environ.get('API_WORKERS', '0')) or (os.cpu_count() or 1)
+API_WORKER_CONCURRENCY = int(os.environ.get('API_WORKER_CONCURRENCY', '1'))
+# Request threads per worker: the job slots plus room for health checks and downloads
+API_WORKER_THREADS = int(os.environ.get('API_WORKER_THREADS', '0')) or API_WORKER_CONCURRENCY + 4
+API_TIMEOUT = int(os.environ.get('API_TIMEOUT', '600'))
+API_GRACEFUL_TIMEOUT = int(os.environ.get('API_GRACEFUL_TIMEOUT', '120'))
+# Recycle a worker after this many requests (0 = never), against slow leaks in native code
+API_MAX_REQUESTS = int(os.environ.get('API_MAX_REQUESTS', '0'))
+API_PIDFILE = os.environ.get('API_PIDFILE', '')
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
 
 def check_dependencies():
     """Check if all required dependencies are available"""
@@ -12,7 +46,7 @@ def check_dependencies():
         import vtracer
         import PIL
         import flask
-        import requests
+        import httpx
         print("✓ All Python dependencies are available")
         return True
     except ImportError as e:
@@ -20,7 +54,7 @@ def check_dependencies():
         print("Please run: pip install -r requirements.txt")
         return False
 
-def check_waifu2x():
+def check_waifu2x(waifu2x_exe):
     """Check if Waifu2x executable is available"""
     if os.path.exists(waifu2x_exe):
         print(f"✓ Waifu2x found at: {waifu2x_exe}")
@@ -30,26 +64,96 @@ def check_waifu2x():
         print("Please update the waifu2x_dir path in app.py")
         return False
 
+def post_fork(server, worker):
+    """In the new worker, before the app is imported: take a row in the busy table"""
+    if get_worker_slots().claim(worker.pid) is None:
+        server.log.warning(f"Worker {worker.pid}: no free slot, it will not show up in worker counts")
+
+def post_worker_init(worker):
+    """Import and warm the app in this worker before it accepts connections"""
+    import app as api
+
+    api.create_directories()
+    started = time.perf_counter()
+    try:
+        api.warm_up()
+        worker.log.info(f"Worker {worker.pid} warmed up in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        worker.log.warning(f"Worker {worker.pid} warm-up failed: {e}")
+
+    if get_worker_slots().slot == 0:
+        check_waifu2x(api.waifu2x_exe)
+
+def child_exit(server, worker):
+    """In the master, when a worker exits for any reason: free its row and archive its metrics"""
+    from metrics import mark_process_dead
+
+    get_worker_slots().release(worker.pid)
+    mark_process_dead(os.environ['METRICS_MULTIPROC_DIR'], worker.pid)
+
+class VectorizeServer(BaseApplication or object):
+    """Gunicorn application that loads the Flask app separately in every worker"""
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Not preloaded in the master, so a HUP reload picks up new code
+        from app import app
+        return app
+
+def serve(host, port):
+    """Run the API under Gunicorn with one warmed process per worker"""
+    # Tile tracing pools are per worker: split the cores between them instead of multiplying
+    os.environ.setdefault('VTRACER_TILE_WORKERS', str(max(1, (os.cpu_count() or 1) // API_WORKERS)))
+    # Room for a full second generation of workers during a graceful reload
+    create_worker_slots(API_WORKERS * 2 + 2, API_WORKERS)
+    # Workers share their metrics through this directory, so any of them can answer /metrics for the pool
+    os.environ.setdefault('METRICS_MULTIPROC_DIR', tempfile.mkdtemp(prefix='vectorize-metrics-'))
+    # Imported only now: the workers forked from here inherit the module with the directory set
+    from metrics import reset_multiproc_dir
+    reset_multiproc_dir(os.environ['METRICS_MULTIPROC_DIR'])
+
+    options = {
+        'bind': f'{host}:{port}',
+        'workers': API_WORKERS,
+        'worker_class': 'gthread',
+        'threads': API_WORKER_THREADS,
+        'timeout': API_TIMEOUT,
+        'graceful_timeout': API_GRACEFUL_TIMEOUT,
+        'max_requests': API_MAX_REQUESTS,
+        'max_requests_jitter': API_MAX_REQUESTS // 10,
+        'preload_app': False,
+        'proc_name': 'vectorize-api',
+        'post_fork': post_fork,
+        'post_worker_init': post_worker_init,
+        'child_exit': child_exit,
+    }
+    if API_PIDFILE:
+        options['pidfile'] = API_PIDFILE
+
+    print(f"Workers: {API_WORKERS} x {API_WORKER_CONCURRENCY} job(s), {API_WORKER_THREADS} threads each")
+    print(f"Graceful reload: kill -HUP {os.getpid()}")
+    VectorizeServer(options).run()
+
 if __name__ == '__main__':
     print("VectorizeAI Flask API Server")
     print("=" * 40)
-    
+
     # Check dependencies
     if not check_dependencies():
         sys.exit(1)
-    
-    # Check Waifu2x
-    if not check_waifu2x():
-        print("Warning: Waifu2x not found. API will fail on requests.")
-    
-    # Create directories
-    create_directories()
-    
+
     # Get configuration from environment
     host = os.environ.get('FLASK_HOST', '0.0.0.0')
     port = int(os.environ.get('FLASK_PORT', 5000))
     debug = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
-    
+
     print(f"Starting server on {host}:{port}")
     print(f"Debug mode: {debug}")
     print("API endpoints:")
@@ -57,7 +161,23 @@ if __name__ == '__main__':
     print("  GET  /download/<filename> - Download SVG files")
     print("  GET  /health - Health check")
     print("\nPress Ctrl+C to stop the server")
-    
+
+    if BaseApplication is not None and not debug:
+        serve(host, port)
+        sys.exit(0)
+
+    if not debug:
+        print("Gunicorn is not available here: falling back to the single-process development server")
+
+    from app import app, create_directories, waifu2x_exe
+
+    # Check Waifu2x
+    if not check_waifu2x(waifu2x_exe):
+        print("Warning: Waifu2x not found. API will fail on requests.")
+
+    # Create directories
+    create_directories()
+
     try:
         app.run(host=host, port=port, debug=debug)
     except KeyboardInterrupt:
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Offline per-stage benchmark of the vectorization pipeline.
+
+Generates a deterministic synthetic corpus (flat logos, line art, gradients and
+photo-like noise at several sizes) and runs every image through the real
+stages: decode (header check, JPEG draft), optimize_large_image, Waifu2x (via
+fake_waifu2x.py unless --waifu2x-cmd is given), VTracer, path simplification and a signed-PUT
+style upload to a local stand-in server. Wall time, peak RSS and output size
+are recorded per stage and written as JSON.
+
+    python benchmark_pipeline.py --output bench.json
+    python benchmark_pipeline.py --output new.json --baseline bench.json
+
+With --baseline the run is compared stage by stage and the exit code is 1 when
+anything got slower (or bigger) than the allowed tolerance.
+"""
+import io
+import os
+import sys
+import json
+import time
+import shlex
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import statistics
+from importlib.metadata import version, PackageNotFoundError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+from PIL import Image, ImageDraw
+
+import memory_trace
+from preprocess import decode_image, optimize_large_image
+from svg_simplify import simplify_svg
+from upscale_planner import plan_upscale, UPSCALE_PIXEL_BUDGET
+from vtracer_presets import resolve_preset
+from image_analysis import analyze_image
+from waifu2x_batcher import Waifu2xBatcher
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+KINDS = ('logo', 'line_art', 'gradient', 'photo')
+STAGES = ('decode', 'optimize', 'waifu2x', 'vtracer', 'simplify', 'upload')
+SEED = 1234
+
+
+# === Synthetic corpus ===
+
+def make_image(kind: str, size: int) -> Image.Image:
+    """Deterministic test image of the given kind and edge length"""
+    rng = np.random.RandomState(SEED + size)
+    if kind == 'logo':
+        img = Image.new('RGB', (size, size), 'white')
+        draw = ImageDraw.Draw(img)
+        palette = ['#E63946', '#1D3557', '#F1C40F', '#2A9D8F']
+        for i, color in enumerate(palette):
+            x, y = rng.randint(0, size // 2, size=2)
+            r = size // (4 + i)
+            shape = draw.ellipse if i % 2 == 0 else draw.rectangle
+            shape((x, y, x + r, y + r), fill=color)
+        return img
+    if kind == 'line_art':
+        img = Image.new('L', (size, size), 255)
+        draw = ImageDraw.Draw(img)
+        for _ in range(24):
+            points = [tuple(p) for p in rng.randint(0, size, size=(4, 2))]
+            draw.line(points, fill=0, width=max(1, size // 128))
+        return img
+    if kind == 'gradient':
+        ramp = np.linspace(0, 255, size, dtype=np.float32)
+        rgb = np.stack([
+            np.tile(ramp, (size, 1)),
+            np.tile(ramp[:, None], (1, size)),
+            np.full((size, size), 128, dtype=np.float32)
+        ], axis=-1)
+        return Image.fromarray(rgb.astype(np.uint8))
+    if kind == 'photo':
+        # Smooth low-frequency structure plus sensor-like noise
+        coarse = rng.randint(0, 256, size=(8, 8, 3)).astype(np.uint8)
+        base = np.asarray(Image.fromarray(coarse).resize((size, size), Image.Resampling.BICUBIC), dtype=np.int16)
+        noise = rng.normal(0, 12, size=(size, size, 3)).astype(np.int16)
+        return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+    raise ValueError(f"Unknown kind: {kind}")
+
+
+def build_corpus(sizes):
+    corpus = []
+    for size in sizes:
+        for kind in KINDS:
+            img = make_image(kind, size)
+            fmt = 'JPEG' if kind == 'photo' else 'PNG'
+            data = memory_trace.encode_png(img) if fmt == 'PNG' else _encode_jpeg(img)
+            corpus.append({"name": f"{kind}_{size}", "kind": kind, "size": size, "data": data})
+    return corpus
+
+
+def _encode_jpeg(img: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+# === Measurement ===
+
+def _current_rss() -> int:
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+class StageMeter:
+    """Times a stage and samples RSS in the background to find its peak"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+
+    def run(self, fn, *args, **kwargs):
+        start_rss = _current_rss()
+        peak = [start_rss]
+        stop = threading.Event()
+
+        def sample():
+            while not stop.is_set():
+                peak[0] = max(peak[0], _current_rss())
+                stop.wait(self.interval)
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            wall = time.perf_counter() - start
+            stop.set()
+            sampler.join()
+        peak[0] = max(peak[0], _current_rss())
+        return result, {
+            "wall_ms": round(wall * 1000, 2),
+            "peak_rss_mb": round(peak[0] / 1e6, 1),
+            "rss_delta_mb": round((peak[0] - start_rss) / 1e6, 1),
+        }
+
+
+class _UploadHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get('Content-Length', '0')))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_upload_server():
+    """Local stand-in for the signed-PUT upload target"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _UploadHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/upload.svg"
+
+
+# === Pipeline ===
+
+def run_case(case, args, batcher, upload_url, session, meter):
+    stages = {}
+    outputs = {}
+
+    img, stages["decode"] = meter.run(decode_image, case["data"], args.max_dimension)
+    analysis = analyze_image(img, (case["size"], case["size"]))
+    preset = resolve_preset(args.preset, analysis)
+
+    def optimize():
+        processed = optimize_large_image(img, args.max_dimension) or img
+        if processed.size == (case["size"], case["size"]):
+            return case["data"], processed.size
+        return memory_trace.encode_png(processed), processed.size
+
+    (image_data, (width, height)), stages["optimize"] = meter.run(optimize)
+
+    plan = plan_upscale(width, height, min(preset["max_scale"], args.max_scale), args.pixel_budget)
+    if plan["scale"] > 1 and batcher is not None:
+        upscaled, stages["waifu2x"] = meter.run(batcher.upscale, image_data, plan["scale"], 3, args.model)
+    else:
+        upscaled, stages["waifu2x"] = image_data, {"wall_ms": 0.0, "peak_rss_mb": 0.0, "rss_delta_mb": 0.0,
+                                                   "skipped": True}
+
+    svg, stages["vtracer"] = meter.run(memory_trace.trace_bytes, upscaled, preset["vtracer"], True)
+    outputs["svg_bytes"] = len(svg.encode('utf-8'))
+
+    (simplified, simplify_stats), stages["simplify"] = meter.run(simplify_svg, svg)
+    outputs["svg_bytes_simplified"] = simplify_stats["bytes_after"]
+
+    def upload():
+        response = session.put(upload_url, data=simplified.encode('utf-8'),
+                               headers={'Content-Type': 'image/svg+xml'})
+        response.raise_for_status()
+
+    _, stages["upload"] = meter.run(upload)
+    img.close()
+
+    return {
+        "name": case["name"],
+        "kind": case["kind"],
+        "size": case["size"],
+        "input_bytes": len(case["data"]),
+        "preset": preset["resolved"],
+        "upscale": plan["scale"],
+        "stages": stages,
+        **outputs,
+    }
+
+
+def _merge_repeats(runs):
+    """Median wall time and max memory across repeated runs of one case"""
+    merged = dict(runs[0])
+    merged["stages"] = {}
+    for stage in runs[0]["stages"]:
+        samples = [run["stages"][stage] for run in runs]
+        merged["stages"][stage] = {
+            **samples[0],
+            "wall_ms": round(statistics.median(s["wall_ms"] for s in samples), 2),
+            "peak_rss_mb": max(s["peak_rss_mb"] for s in samples),
+            "rss_delta_mb": max(s["rss_delta_mb"] for s in samples),
+        }
+    return merged
+
+
+def compare(result, baseline, time_tolerance, size_tolerance, min_ms):
+    """List of regressions of this run against a baseline run"""
+    regressions = []
+    previous = {case["name"]: case for case in baseline.get("cases", [])}
+    for case in result["cases"]:
+        old = previous.get(case["name"])
+        if old is None:
+            continue
+        for stage, stats in case["stages"].items():
+            old_stats = old["stages"].get(stage)
+            if not old_stats:
+                continue
+            limit = old_stats["wall_ms"] * (1 + time_tolerance)
+            if stats["wall_ms"] > limit and stats["wall_ms"] - old_stats["wall_ms"] > min_ms:
+                regressions.append({
+                    "case": case["name"], "stage": stage, "metric": "wall_ms",
+                    "baseline": old_stats["wall_ms"], "current": stats["wall_ms"],
+                })
+        for metric in ("svg_bytes", "svg_bytes_simplified"):
+            if metric in old and case[metric] > old[metric] * (1 + size_tolerance):
+                regressions.append({
+                    "case": case["name"], "stage": None, "metric": metric,
+                    "baseline": old[metric], "current": case[metric],
+                })
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vectorization pipeline per stage")
+    parser.add_argument('--sizes', default='256,1024,2560', help="Comma-separated image edge lengths")
+    parser.add_argument('--kinds', default=','.join(KINDS), help="Comma-separated corpus kinds")
+    parser.add_argument('--preset', default='auto', help="VTracer preset (default: auto)")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per case; wall times are medians")
+    parser.add_argument('--max-dimension', type=int, default=2048)
+    parser.add_argument('--max-scale', type=int, default=4)
+    parser.add_argument('--pixel-budget', type=int, default=UPSCALE_PIXEL_BUDGET)
+    parser.add_argument('--model', default='models-upconv_7_anime_style_art_rgb')
+    parser.add_argument('--waifu2x-cmd', default='', help="Real Waifu2x command (default: fake_waifu2x.py)")
+    parser.add_argument('--no-waifu2x', action='store_true', help="Skip the upscale stage entirely")
+    parser.add_argument('--output', help="Write the JSON result here (default: stdout)")
+    parser.add_argument('--baseline', help="Previous JSON result to compare against")
+    parser.add_argument('--time-tolerance', type=float, default=0.25, help="Allowed slowdown (0.25 = 25%%)")
+    parser.add_argument('--size-tolerance', type=float, default=0.05, help="Allowed SVG growth")
+    parser.add_argument('--min-ms', type=float, default=5.0, help="Ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    kinds = [k for k in args.kinds.split(',') if k]
+    unknown = set(kinds) - set(KINDS)
+    if unknown:
+        parser.error(f"Unknown kinds: {', '.join(sorted(unknown))}")
+
+    work_dir = tempfile.mkdtemp(prefix='vh_bench_')
+    batcher = None
+    if not args.no_waifu2x:
+        if args.waifu2x_cmd:
+            command = shlex.split(args.waifu2x_cmd, posix=os.name != 'nt')
+        else:
+            command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_waifu2x.py')]
+        # A zero window: the benchmark measures single-image launches
+        batcher = Waifu2xBatcher(command, os.path.join(work_dir, 'waifu2x'), window_ms=0)
+
+    server, upload_url = start_upload_server()
+    session = requests.Session()
+    meter = StageMeter()
+
+    corpus = [case for case in build_corpus(sizes) if case["kind"] in kinds]
+    cases = []
+    for case in corpus:
+        runs = [run_case(case, args, batcher, upload_url, session, meter) for _ in range(max(1, args.repeat))]
+        merged = _merge_repeats(runs)
+        cases.append(merged)
+        print(f"{merged['name']:>16}: " + ", ".join(
+            f"{stage} {merged['stages'][stage]['wall_ms']:.0f}ms" for stage in STAGES
+        ) + f", svg {merged['svg_bytes_simplified']} B", file=sys.stderr)
+
+    server.shutdown()
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    try:
+        vtracer_version = version('vtracer')
+    except PackageNotFoundError:
+        vtracer_version = None
+
+    result = {
+        "meta": {
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "vtracer": vtracer_version,
+            "waifu2x": "off" if args.no_waifu2x else (args.waifu2x_cmd or "fake"),
+            "preset": args.preset,
+            "sizes": sizes,
+            "repeat": args.repeat,
+        },
+        "cases": cases,
+        "totals": {
+            stage: round(sum(case["stages"][stage]["wall_ms"] for case in cases), 2) for stage in STAGES
+        },
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.time_tolerance, args.size_tolerance, args.min_ms)
+        result["regressions"] = regressions
+        for item in regressions:
+            where = f"{item['case']}/{item['stage']}" if item['stage'] else item['case']
+            print(f"REGRESSION {where} {item['metric']}: {item['baseline']} -> {item['current']}", file=sys.stderr)
+        exit_code = 1 if regressions else 0
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for an object store that accepts signed PUT uploads.
+
+PUT /<key> stores the body (with its Content-Type and Content-Encoding) and
+GET /<key> serves it back. PUTs carrying "Content-Range: bytes a-b/total"
+follow the GCS resumable-session protocol: each chunk is answered with 308 and
+"Range: bytes=0-<last byte held>" until the final one, and "bytes */total"
+reports progress without sending data. GET /_stats lists the stored objects.
+
+FAKE_STORE_FAIL_RATE makes that fraction of PUTs answer 503; for a resumable
+chunk the store keeps the first half of it before failing, as if the
+connection had dropped mid-transfer, so the runner's resume path is exercised.
+
+Use it by giving jobs an output URL under it, e.g.
+    python ../python/fake_object_store.py --port 9100
+    {"output": {"url": "http://127.0.0.1:9100/results/job.svg", "resumable": true}}
+"""
+import os
+import re
+import json
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_RANGE_RE = re.compile(r'bytes (?:(\d+)-(\d+)|\*)/(\d+|\*)')
+
+_objects = {}
+_sessions = {}
+_stats = {"puts": 0, "chunks": 0, "status_queries": 0, "forced_failures": 0}
+_lock = threading.Lock()
+
+
+class FakeObjectStoreHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', '0')))
+        key = self.path.split('?', 1)[0]
+        meta = {
+            "content_type": self.headers.get('Content-Type', 'application/octet-stream'),
+            "content_encoding": self.headers.get('Content-Encoding'),
+        }
+        content_range = self.headers.get('Content-Range')
+        fail = random.random() < float(os.getenv('FAKE_STORE_FAIL_RATE', '0'))
+
+        with _lock:
+            _stats["puts"] += 1
+            if content_range is None:
+                if fail:
+                    _stats["forced_failures"] += 1
+                    return self._reply(503)
+                _objects[key] = (body, meta)
+                return self._reply(200)
+
+            match = CONTENT_RANGE_RE.fullmatch(content_range)
+            if match is None:
+                return self._reply(400)
+            first, last, total = match.groups()
+            session = _sessions.setdefault(key, bytearray())
+
+            if first is None:
+                # Status query: how much of the upload is held
+                _stats["status_queries"] += 1
+                if key in _objects and total != '*' and len(_objects[key][0]) == int(total):
+                    return self._reply(200)
+                return self._reply_incomplete(len(session))
+
+            _stats["chunks"] += 1
+            first, last = int(first), int(last)
+            if first > len(session) or last - first + 1 != len(body):
+                # A gap or a short body: report what is actually held
+                return self._reply_incomplete(len(session))
+            if fail:
+                _stats["forced_failures"] += 1
+                del session[first:]
+                session.extend(body[:len(body) // 2])
+                return self._reply(503)
+
+            del session[first:]
+            session.extend(body)
+            if total != '*' and len(session) == int(total):
+                _objects[key] = (bytes(session), meta)
+                del _sessions[key]
+                return self._reply(200)
+            return self._reply_incomplete(len(session))
+
+    def do_GET(self):
+        key = self.path.split('?', 1)[0]
+        if key == '/_stats':
+            with _lock:
+                payload = dict(_stats, objects={name: len(data) for name, (data, _) in _objects.items()})
+            body = json.dumps(payload).encode('utf-8')
+            return self._reply(200, body, {'Content-Type': 'application/json'})
+
+        with _lock:
+            stored = _objects.get(key)
+        if stored is None:
+            return self._reply(404)
+        body, meta = stored
+        headers = {'Content-Type': meta["content_type"]}
+        if meta["content_encoding"]:
+            headers['Content-Encoding'] = meta["content_encoding"]
+        self._reply(200, body, headers)
+
+    def _reply_incomplete(self, held: int):
+        self._reply(308, headers={'Range': f'bytes=0-{held - 1}'} if held else {})
+
+    def _reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake object store for result uploads")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), FakeObjectStoreHandler)
+    print(f"Fake object store listening on http://{args.host}:{args.port}/")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
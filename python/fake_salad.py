@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Salad vectorize endpoint.
+
+Answers POST /api/v1/vectorize with {"svg_content": ...} like the real service,
+so api/main.py and its pooled/hedged upstream client can be exercised offline.
+FAKE_SALAD_DELAY_MS adds latency to every call, FAKE_SALAD_SLOW_RATE makes that
+fraction of calls take FAKE_SALAD_SLOW_MS instead (to trigger hedging) and
+FAKE_SALAD_FAIL_RATE makes that fraction return 503 (to trip the breaker).
+
+Use it by pointing SALAD_API_URL at it, e.g.
+    python ../python/fake_salad.py --port 9000
+    SALAD_API_URL=http://127.0.0.1:9000/api/v1/vectorize
+"""
+import os
+import json
+import time
+import random
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SVG = ('<svg xmlns="http://www.w3.org/2000/svg" width="1" height="1">'
+       '<path d="M0 0 L1 0 1 1 Z" fill="#000000"/></svg>')
+
+
+class FakeSaladHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', '0'))
+        self.rfile.read(length)
+
+        delay_ms = int(os.getenv('FAKE_SALAD_DELAY_MS', '0'))
+        if random.random() < float(os.getenv('FAKE_SALAD_SLOW_RATE', '0')):
+            delay_ms = int(os.getenv('FAKE_SALAD_SLOW_MS', '5000'))
+        time.sleep(delay_ms / 1000)
+
+        if random.random() < float(os.getenv('FAKE_SALAD_FAIL_RATE', '0')):
+            self._reply(503, {"error": "fake salad: forced failure"})
+        elif not self.headers.get('Authorization', '').startswith('Bearer '):
+            self._reply(401, {"error": "missing token"})
+        else:
+            self._reply(200, {"svg_content": SVG})
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Salad vectorize service")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), FakeSaladHandler)
+    print(f"Fake Salad listening on http://{args.host}:{args.port}/api/v1/vectorize")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
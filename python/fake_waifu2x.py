@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Stand-in for waifu2x-ncnn-vulkan on machines without a GPU.
+
+Accepts the same -i/-o/-n/-s/-m/-f options (file or directory mode) and
+upscales with Pillow so the rest of the pipeline sees realistically sized
+output. FAKE_WAIFU2X_STARTUP_MS simulates the model load paid per launch and
+FAKE_WAIFU2X_FAIL=1 makes it exit with an error.
+
+Use it by pointing WAIFU2X_CMD at it, e.g.
+    WAIFU2X_CMD="python ../python/fake_waifu2x.py"
+"""
+import os
+import sys
+import time
+import argparse
+
+from PIL import Image
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+def upscale_file(input_path, output_path, scale):
+    with Image.open(input_path) as img:
+        img = img.convert('RGBA') if 'A' in img.getbands() else img.convert('RGB')
+        if scale > 1:
+            img = img.resize((img.width * scale, img.height * scale), Image.Resampling.NEAREST)
+        img.save(output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake waifu2x-ncnn-vulkan")
+    parser.add_argument('-i', dest='input', required=True)
+    parser.add_argument('-o', dest='output', required=True)
+    parser.add_argument('-n', dest='noise', type=int, default=0)
+    parser.add_argument('-s', dest='scale', type=int, default=2)
+    parser.add_argument('-m', dest='model', default='models-cunet')
+    parser.add_argument('-f', dest='format', default='png')
+    args = parser.parse_args()
+
+    time.sleep(int(os.getenv('FAKE_WAIFU2X_STARTUP_MS', '0')) / 1000)
+    if os.getenv('FAKE_WAIFU2X_FAIL') == '1':
+        print("fake waifu2x: forced failure", file=sys.stderr)
+        return 1
+
+    if os.path.isdir(args.input):
+        os.makedirs(args.output, exist_ok=True)
+        for name in sorted(os.listdir(args.input)):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            output_name = f"{os.path.splitext(name)[0]}.{args.format}"
+            upscale_file(os.path.join(args.input, name), os.path.join(args.output, output_name), args.scale)
+    else:
+        upscale_file(args.input, args.output, args.scale)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+Fast image analysis on a downsampled thumbnail.
+
+One nearest-neighbour thumbnail (no blended colours are introduced) is turned
+into a NumPy array and every statistic is computed from it in a single pass:
+strict black-and-white detection, an estimated distinct-colour count, a photo
+vs. flat-art classification, alpha usage and near-blank detection. The result
+drives automatic mode selection instead of looping over full-resolution pixels
+in Python.
+"""
+import io
+import os
+from typing import Any, Dict
+
+import numpy as np
+from PIL import Image
+
+# === CONFIG ===
+ANALYSIS_MAX_SIDE = int(os.getenv('ANALYSIS_MAX_SIDE', '512'))
+
+# Same thresholds as the original strict B&W check
+BLACK_THRESHOLD = 20   # Luminance at or below this counts as black
+WHITE_THRESHOLD = 235  # Luminance at or above this counts as white
+
+# Flat art is dominated by a handful of colours; photos spread over thousands
+TOP_COLORS = 16
+FLAT_COVERAGE = 0.6
+PHOTO_MIN_COLORS = 4096
+
+# A single colour (or transparency) covering this much of the image means there is nothing to trace
+BLANK_COVERAGE = 0.995
+
+
+def _thumbnail(img: Image.Image) -> Image.Image:
+    """Nearest-neighbour RGBA sample of at most ANALYSIS_MAX_SIDE pixels per side"""
+    if img.mode == 'P' and 'transparency' in img.info:
+        img = img.convert('RGBA')
+    ratio = min(1.0, ANALYSIS_MAX_SIDE / max(img.width, img.height))
+    if ratio < 1.0:
+        size = (max(1, round(img.width * ratio)), max(1, round(img.height * ratio)))
+        img = img.resize(size, Image.Resampling.NEAREST)
+    return img.convert('RGBA')
+
+
+def analyze_image(img: Image.Image, original_size=None) -> Dict[str, Any]:
+    """Classify an image for vectorization from a thumbnail of its pixels"""
+    size = list(original_size or img.size)
+    has_alpha = 'A' in img.getbands() or (img.mode == 'P' and 'transparency' in img.info)
+    sample = np.asarray(_thumbnail(img))
+    pixels = sample.reshape(-1, 4)
+
+    alpha = pixels[:, 3]
+    opaque = pixels[alpha > 0]
+    transparent_fraction = 1.0 - len(opaque) / len(pixels)
+
+    if len(opaque) == 0:
+        return {
+            "size": size,
+            "sample_size": [sample.shape[1], sample.shape[0]],
+            "is_black_and_white": False,
+            "has_alpha": has_alpha,
+            "alpha_used": True,
+            "transparent_fraction": 1.0,
+            "distinct_colors": 0,
+            "top_colors_coverage": 1.0,
+            "kind": "blank",
+            "is_photo": False,
+            "near_blank": True,
+            "recommended_mode": "color",
+        }
+
+    rgb = opaque[:, :3].astype(np.uint32)
+
+    # Rec. 601 luma, matching Pillow's convert("L")
+    luma = (rgb[:, 0] * 299 + rgb[:, 1] * 587 + rgb[:, 2] * 114) // 1000
+    is_bw = bool(np.all((luma <= BLACK_THRESHOLD) | (luma >= WHITE_THRESHOLD)))
+
+    # Pack colours into one integer each so counting is a single unique() call
+    packed = (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+    _, counts = np.unique(packed, return_counts=True)
+    distinct_colors = len(counts)
+    top = np.sort(counts)[::-1]
+    top_coverage = float(top[:TOP_COLORS].sum() / len(packed))
+
+    # Transparent pixels count as one more "colour": a solid logo on a clear background is not blank
+    dominant = max(int(top[0]), len(pixels) - len(opaque))
+    near_blank = bool(dominant / len(pixels) >= BLANK_COVERAGE)
+
+    is_photo = not is_bw and distinct_colors >= PHOTO_MIN_COLORS and top_coverage < FLAT_COVERAGE
+    if near_blank:
+        kind = "blank"
+    elif is_bw:
+        kind = "bw"
+    elif is_photo:
+        kind = "photo"
+    else:
+        kind = "flat"
+
+    return {
+        "size": size,
+        "sample_size": [sample.shape[1], sample.shape[0]],
+        "is_black_and_white": is_bw,
+        "has_alpha": has_alpha,
+        "alpha_used": bool(np.any(alpha < 255)),
+        "transparent_fraction": round(transparent_fraction, 4),
+        "distinct_colors": distinct_colors,
+        "top_colors_coverage": round(top_coverage, 4),
+        "kind": kind,
+        "is_photo": is_photo,
+        "near_blank": near_blank,
+        "recommended_mode": "bw" if is_bw and not near_blank else "color",
+    }
+
+
+def analyze_file(fp) -> Dict[str, Any]:
+    """Decode an image file object (reduced on decode where the format allows) and analyze it"""
+    with Image.open(fp) as img:
+        original_size = img.size
+        # JPEG can decode straight at 1/2, 1/4 or 1/8 scale
+        img.draft(None, (ANALYSIS_MAX_SIDE, ANALYSIS_MAX_SIDE))
+        img.load()
+        return analyze_image(img, original_size)
+
+
+def analyze_bytes(data: bytes) -> Dict[str, Any]:
+    """Decode encoded image bytes and analyze them"""
+    return analyze_file(io.BytesIO(data))
@@ -0,0 +1,191 @@
+"""
+Pooled async fetcher for input images.
+
+One long-lived httpx.AsyncClient runs on a private event loop thread so every
+caller (Flask request threads, runner worker threads and async endpoints) shares
+the same keep-alive connections. The byte limit is enforced while streaming and
+the body is sniffed as soon as the first chunk arrives, so oversize or non-image
+responses are abandoned early instead of being downloaded in full. fetch_head()
+asks for just the first bytes (a ranged GET, cut off client-side when the
+server ignores the range), enough to read an image's dimensions.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# === CONFIG ===
+FETCH_TIMEOUT = float(os.getenv('FETCH_TIMEOUT', '30'))
+FETCH_MAX_CONNECTIONS = int(os.getenv('FETCH_MAX_CONNECTIONS', '20'))
+FETCH_MAX_BYTES = int(os.getenv('FETCH_MAX_BYTES', str(20 * 1024 * 1024)))
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+ALLOWED_CONTENT_TYPES = ['image/jpeg', 'image/png', 'image/jpg']
+IMAGE_SIGNATURES = (b'\x89PNG\r\n\x1a\n', b'\xff\xd8\xff')
+
+# Latency samples kept per host for the stats
+LATENCY_WINDOW = 200
+
+
+class FetchError(ValueError):
+    """Raised when an input cannot be fetched or is not an acceptable image"""
+
+
+def _check_signature(head: bytes):
+    if not head.startswith(IMAGE_SIGNATURES):
+        raise FetchError("Response body is not a PNG or JPEG image")
+
+
+class _HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def to_dict(self) -> Dict[str, float]:
+        samples = sorted(self.latencies)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "avg_ms": round(sum(samples) / len(samples), 1) if samples else 0.0,
+            "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 1) if samples else 0.0,
+        }
+
+
+class ImageFetcher:
+    """Shared, connection-pooled image downloader"""
+
+    def __init__(self, timeout: float = FETCH_TIMEOUT, max_connections: int = FETCH_MAX_CONNECTIONS,
+                 max_bytes: int = FETCH_MAX_BYTES):
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_bytes = max_bytes
+        self._stats: Dict[str, _HostStats] = {}
+        self._stats_lock = threading.Lock()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True, name="image-fetcher")
+        self._thread.start()
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Create the pooled client lazily on the fetcher loop"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=True,
+                headers={'User-Agent': USER_AGENT},
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=60
+                )
+            )
+        return self._client
+
+    async def _fetch(self, url: str, max_bytes: int, head_bytes: Optional[int] = None) -> bytes:
+        host = urlsplit(url).netloc
+        start = time.perf_counter()
+        received = 0
+        headers = {'Range': f'bytes=0-{head_bytes - 1}'} if head_bytes else None
+        try:
+            async with self._get_client().stream('GET', url, headers=headers) as response:
+                response.raise_for_status()
+
+                # Check content type
+                content_type = response.headers.get('content-type', '').lower()
+                if not any(img_type in content_type for img_type in ALLOWED_CONTENT_TYPES):
+                    raise FetchError(f"Invalid content type: {content_type}")
+
+                # Check declared size before reading the body
+                content_length = response.headers.get('content-length')
+                if not head_bytes and content_length and int(content_length) > max_bytes:
+                    raise FetchError("File too large")
+
+                chunks = []
+                sniffed = False
+                async for chunk in response.aiter_bytes():
+                    received += len(chunk)
+                    if received > max_bytes and not head_bytes:
+                        raise FetchError("File too large")
+                    chunks.append(chunk)
+
+                    # Give up on the first bytes if this is not an image at all
+                    if not sniffed and received >= 8:
+                        _check_signature(b''.join(chunks))
+                        sniffed = True
+                    if head_bytes and received >= head_bytes:
+                        break
+
+                if not sniffed:
+                    _check_signature(b''.join(chunks))
+
+            self._record(host, start, received, ok=True)
+            body = b''.join(chunks)
+            return body[:head_bytes] if head_bytes else body
+        except httpx.HTTPError as e:
+            self._record(host, start, received, ok=False)
+            raise FetchError(f"Download failed: {e}") from e
+        except Exception:
+            self._record(host, start, received, ok=False)
+            raise
+
+    def _record(self, host: str, start: float, received: int, ok: bool):
+        with self._stats_lock:
+            stats = self._stats.setdefault(host, _HostStats())
+            stats.requests += 1
+            stats.bytes += received
+            if ok:
+                stats.latencies.append((time.perf_counter() - start) * 1000)
+            else:
+                stats.errors += 1
+
+    def fetch(self, url: str, max_bytes: Optional[int] = None) -> bytes:
+        """Download an image from any thread, blocking until it arrives"""
+        future = asyncio.run_coroutine_threadsafe(self._fetch(url, max_bytes or self.max_bytes), self._loop)
+        return future.result()
+
+    def fetch_head(self, url: str, head_bytes: int) -> bytes:
+        """The first head_bytes of an image (fewer if it is smaller), from any thread"""
+        future = asyncio.run_coroutine_threadsafe(self._fetch(url, head_bytes, head_bytes), self._loop)
+        return future.result()
+
+    async def fetch_async(self, url: str, max_bytes: Optional[int] = None) -> bytes:
+        """Download an image from a coroutine running on another event loop"""
+        future = asyncio.run_coroutine_threadsafe(self._fetch(url, max_bytes or self.max_bytes), self._loop)
+        return await asyncio.wrap_future(future)
+
+    def host_stats(self) -> Dict[str, Dict[str, float]]:
+        """Per-host request counts and latency for health/metrics endpoints"""
+        with self._stats_lock:
+            return {host: stats.to_dict() for host, stats in self._stats.items()}
+
+    def close(self):
+        """Close pooled connections and stop the fetcher loop"""
+        if self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result(timeout=5)
+            self._client = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+# Global instance
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_image_fetcher() -> ImageFetcher:
+    """Get or create the global fetcher instance"""
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = ImageFetcher()
+        return _fetcher
@@ -0,0 +1,64 @@
+"""
+In-memory VTracer helpers.
+
+The encoded bytes of a download or upload are handed straight to VTracer's raw
+image API and the SVG comes back as a string, so tracing never touches disk.
+Large rasters are routed through the tile-parallel tracer.
+"""
+import io
+import os
+import logging
+from typing import Dict
+
+import vtracer
+from PIL import Image
+
+import tiled_trace
+
+logger = logging.getLogger(__name__)
+
+# === CONFIG ===
+# zlib level for intermediate PNGs: 0 stores the pixels and encodes about twice as fast as 1
+INTERMEDIATE_PNG_LEVEL = int(os.getenv('INTERMEDIATE_PNG_LEVEL', '0'))
+
+# Pillow format name -> format string understood by VTracer's image decoder
+VTRACER_FORMATS = {
+    'PNG': 'png',
+    'JPEG': 'jpg',
+    'BMP': 'bmp',
+    'GIF': 'gif',
+    'WEBP': 'webp',
+}
+
+
+def encode_png(img: Image.Image) -> bytes:
+    """Encode an intermediate PNG (only read back by us, so speed beats size)"""
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG', compress_level=INTERMEDIATE_PNG_LEVEL)
+    return buffer.getvalue()
+
+
+def trace_bytes(data: bytes, params: Dict, tiling: bool = True) -> str:
+    """Trace encoded image bytes and return the SVG document as a string"""
+    with Image.open(io.BytesIO(data)) as img:
+        width, height = img.size
+        img_format = VTRACER_FORMATS.get(img.format)
+
+        if tiling and tiled_trace.should_tile(width, height):
+            img.load()
+            return tiled_trace.trace_image_tiled(img, params)
+
+        if img_format is None:
+            # Formats VTracer cannot decode itself are re-encoded once
+            img.load()
+            data = encode_png(img)
+            img_format = 'png'
+
+    return vtracer.convert_raw_image_to_svg(data, img_format=img_format, **params)
+
+
+def trace_image(img: Image.Image, params: Dict, tiling: bool = True) -> str:
+    """Trace an already decoded PIL image and return the SVG document as a string"""
+    if tiling and tiled_trace.should_tile(*img.size):
+        return tiled_trace.trace_image_tiled(img, params)
+    return vtracer.convert_raw_image_to_svg(encode_png(img), img_format='png', **params)
@@ -0,0 +1,503 @@
+"""
+Prometheus-style metrics without a client library.
+
+Counters, gauges and histograms write into a per-thread shard, so recording a
+value on the hot path is a dict lookup and a list increment with no lock taken.
+Shards are only summed when /metrics is scraped; shards of threads that have
+exited are folded into one retired shard so per-request threads (Flask's dev
+server) do not accumulate. Gauges can also be backed by a callback (queue
+depth, for example) that is only evaluated at scrape time.
+
+When several worker processes serve one API, METRICS_MULTIPROC_DIR names a
+directory they share. Each worker writes its totals there every
+METRICS_FLUSH_SEC (and when it exits), and a scrape answered by any worker
+adds the other workers' files to its own live values, so /metrics describes
+the whole pool. When a worker exits, the serving master folds its counters and
+histograms into an archive file and drops its gauges, so totals survive
+reloads and recycled workers without counting what the dead worker was doing.
+"""
+import os
+import json
+import time
+import atexit
+import weakref
+import threading
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the single-process development server runs there
+    fcntl = None
+
+# === CONFIG ===
+# Shared by the worker processes of one server; the serving master sets it before forking
+METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR', '')
+METRICS_FLUSH_SEC = float(os.getenv('METRICS_FLUSH_SEC', '2'))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Counters and histograms of workers that have exited
+ARCHIVE_FILE = 'archive.json'
+LOCK_FILE = 'lock'
+
+# Seconds; covers cache hits (ms) up to slow Waifu2x + VTracer runs (minutes)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Input pixels: 256² up to 8192²
+PIXEL_BUCKETS = (65536, 262144, 1048576, 2097152, 4194304, 8388608, 16777216, 33554432, 67108864)
+# SVG bytes: 1KB up to 64MB
+BYTE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class MetricsRegistry:
+    """Holds metric definitions and the per-thread shards they write into
+
+    With a multiproc_dir, this process's totals are also written there for the
+    other workers' scrapes, and its scrapes include theirs.
+    """
+
+    def __init__(self, multiproc_dir: Optional[str] = None):
+        self._metrics: List['_Metric'] = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[Tuple[weakref.ref, Dict]] = []
+        self._retired: Dict = {}
+        self.multiproc_dir = multiproc_dir
+        if multiproc_dir:
+            os.makedirs(multiproc_dir, exist_ok=True)
+            threading.Thread(target=self._flush_loop, daemon=True, name="metrics-flush").start()
+            atexit.register(self.flush)
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> 'Counter':
+        return self._register(Counter(self, name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> 'Gauge':
+        return self._register(Gauge(self, name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> 'Histogram':
+        return self._register(Histogram(self, name, help, labels, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def shard(self) -> Dict:
+        """This thread's private cells, created on first use"""
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._lock:
+                self._retire_dead()
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+        return shard
+
+    def _retire_dead(self):
+        """Fold shards of finished threads into the retired shard (caller holds the lock)"""
+        alive = []
+        for thread_ref, shard in self._shards:
+            thread = thread_ref()
+            if thread is not None and thread.is_alive():
+                alive.append((thread_ref, shard))
+            else:
+                _merge_into(self._retired, shard)
+        self._shards = alive
+
+    def _collect_cells(self) -> Dict:
+        """Sum of every shard's cells"""
+        with self._lock:
+            self._retire_dead()
+            totals: Dict = {}
+            _merge_into(totals, self._retired)
+            for _, shard in self._shards:
+                # dict.copy is atomic, so the owning thread may keep writing meanwhile
+                _merge_into(totals, shard.copy())
+        return totals
+
+    def _function_cells(self) -> Dict:
+        """Current values of the callback gauges that describe this process only"""
+        cells: Dict = {}
+        for metric in self._metrics:
+            if isinstance(metric, Gauge) and metric._function is not None and not metric.pool_wide:
+                cells.update(metric.function_cells())
+        return cells
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_SEC)
+            try:
+                self.flush()
+            except Exception:
+                # A failing gauge callback must not stop the flushes for good
+                pass
+
+    def flush(self):
+        """Write this process's totals where the other workers' scrapes read them"""
+        cells = self._collect_cells()
+        _merge_into(cells, self._function_cells())
+        gauges = [metric.name for metric in self._metrics if isinstance(metric, Gauge)]
+        try:
+            _write_cells(os.path.join(self.multiproc_dir, f'{os.getpid()}.json'), cells, gauges)
+        except OSError:
+            # The next flush tries again
+            pass
+
+    def render(self) -> str:
+        """The Prometheus text exposition of every registered metric"""
+        cells = self._collect_cells()
+        _merge_into(cells, self._function_cells())
+        if self.multiproc_dir:
+            _merge_into(cells, _read_other_processes(self.multiproc_dir))
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.render(cells))
+        return '\n'.join(lines) + '\n'
+
+
+def _merge_into(totals: Dict, shard: Dict):
+    for key, cell in shard.items():
+        if isinstance(cell, list):
+            current = totals.get(key)
+            if current is None:
+                totals[key] = list(cell)
+            else:
+                for index, value in enumerate(list(cell)):
+                    current[index] += value
+        else:
+            totals[key] = totals.get(key, 0) + cell
+
+
+def _write_cells(path: str, cells: Dict, gauges: Sequence[str]):
+    payload = {
+        "gauges": list(gauges),
+        "cells": [[name, list(values), cell] for (name, values), cell in cells.items()],
+    }
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f)
+    # Readers see the old file or the new one, never a partial write
+    os.replace(tmp_path, path)
+
+
+def _read_cells(path: str) -> Tuple[Dict, List[str]]:
+    try:
+        with open(path, encoding='utf-8') as f:
+            payload = json.load(f)
+    except (OSError, ValueError):
+        return {}, []
+    cells = {(name, tuple(values)): cell for name, values, cell in payload.get("cells", [])}
+    return cells, payload.get("gauges", [])
+
+
+class _DirLock:
+    """flock on the directory's lock file: shared for scrapes, exclusive while a dead worker is archived"""
+
+    def __init__(self, multiproc_dir: str, exclusive: bool = False):
+        self._path = os.path.join(multiproc_dir, LOCK_FILE)
+        self._mode = fcntl.LOCK_EX if fcntl and exclusive else (fcntl.LOCK_SH if fcntl else None)
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self._path, 'a')
+        if self._mode is not None:
+            fcntl.flock(self._file, self._mode)
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+
+def _read_other_processes(multiproc_dir: str) -> Dict:
+    """Totals of the other live workers plus the archive of exited ones"""
+    own = f'{os.getpid()}.json'
+    totals: Dict = {}
+    with _DirLock(multiproc_dir):
+        for name in os.listdir(multiproc_dir):
+            if name.endswith('.json') and name != own:
+                _merge_into(totals, _read_cells(os.path.join(multiproc_dir, name))[0])
+    return totals
+
+
+def reset_multiproc_dir(multiproc_dir: str):
+    """Start a server with empty totals: clear what a previous run left in the directory"""
+    os.makedirs(multiproc_dir, exist_ok=True)
+    for name in os.listdir(multiproc_dir):
+        if name.endswith(('.json', '.tmp')):
+            os.remove(os.path.join(multiproc_dir, name))
+
+
+def mark_process_dead(multiproc_dir: str, pid: int):
+    """Fold an exited worker's counters and histograms into the archive; its gauges no longer apply"""
+    path = os.path.join(multiproc_dir, f'{pid}.json')
+    if not os.path.exists(path):
+        return
+    archive_path = os.path.join(multiproc_dir, ARCHIVE_FILE)
+    with _DirLock(multiproc_dir, exclusive=True):
+        cells, gauges = _read_cells(path)
+        archive, _ = _read_cells(archive_path)
+        _merge_into(archive, {key: cell for key, cell in cells.items() if key[0] not in gauges})
+        _write_cells(archive_path, archive, [])
+        os.remove(path)
+
+
+class _Metric:
+    type = 'untyped'
+
+    def __init__(self, registry: MetricsRegistry, name: str, help: str, labels: Sequence[str]):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children: Dict[LabelValues, '_Child'] = {}
+        if not self.label_names:
+            self._default = self.labels()
+
+    def labels(self, *values: str, **kwargs: str):
+        """The child for one combination of label values"""
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.label_names)
+        else:
+            values = tuple(str(value) for value in values)
+        if len(values) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}")
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, self._child_class((self.name, values), self))
+        return child
+
+    def _keys(self, cells: Dict) -> List[LabelValues]:
+        """Every label combination that has been used, in a stable order"""
+        seen = set(self._children)
+        seen.update(values for name, values in cells if name == self.name)
+        return sorted(seen)
+
+
+class _Child:
+    def __init__(self, key: Tuple[str, LabelValues], metric: _Metric):
+        self._key = key
+        self._metric = metric
+        self._shard = metric.registry.shard
+
+
+class _CounterChild(_Child):
+    def inc(self, amount: float = 1):
+        shard = self._shard()
+        shard[self._key] = shard.get(self._key, 0) + amount
+
+
+class Counter(_Metric):
+    """Monotonic count, e.g. errors by type"""
+    type = 'counter'
+    _child_class = _CounterChild
+
+    def inc(self, amount: float = 1):
+        self._default.inc(amount)
+
+    def render(self, cells: Dict) -> List[str]:
+        return [f'{self.name}{_label_text(self.label_names, values)} {_format_value(cells.get((self.name, values), 0))}'
+                for values in self._keys(cells)]
+
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def track(self) -> '_InFlight':
+        """Context manager that counts the block as in flight"""
+        return _InFlight(self)
+
+
+class _InFlight:
+    __slots__ = ('_gauge',)
+
+    def __init__(self, gauge: _GaugeChild):
+        self._gauge = gauge
+
+    def __enter__(self):
+        self._gauge.inc()
+        return self
+
+    def __exit__(self, *exc):
+        self._gauge.dec()
+
+
+class Gauge(_Metric):
+    """Value that goes up and down: inc/dec from any thread, or a callback read at scrape time"""
+    type = 'gauge'
+    _child_class = _GaugeChild
+
+    def __init__(self, *args):
+        self._function: Optional[Callable[[], float]] = None
+        self.pool_wide = False
+        super().__init__(*args)
+
+    def inc(self, amount: float = 1):
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._default.dec(amount)
+
+    def track(self) -> _InFlight:
+        return self._default.track()
+
+    def set_function(self, function: Callable[[], Any], pool_wide: bool = False):
+        """Report function() instead of the inc/dec total
+
+        Labelled gauges take a function returning {label value (or tuple of values): value}.
+        Values are summed across worker processes unless pool_wide says the function
+        already reports the whole pool (e.g. from shared memory).
+        """
+        self._function = function
+        self.pool_wide = pool_wide
+
+    def function_cells(self) -> Dict:
+        result = self._function()
+        if not self.label_names:
+            return {(self.name, ()): result}
+        return {(self.name, tuple(str(value) for value in (key if isinstance(key, tuple) else (key,)))): value
+                for key, value in result.items()}
+
+    def render(self, cells: Dict) -> List[str]:
+        if self._function is not None and self.pool_wide:
+            cells = self.function_cells()
+        return [f'{self.name}{_label_text(self.label_names, values)} {_format_value(cells.get((self.name, values), 0))}'
+                for values in self._keys(cells)]
+
+
+class _HistogramChild(_Child):
+    def __init__(self, key, metric: 'Histogram'):
+        super().__init__(key, metric)
+        self._bounds = metric.buckets
+        # One slot per bucket plus +Inf, then the running sum
+        self._size = len(self._bounds) + 2
+
+    def observe(self, value: float):
+        shard = self._shard()
+        cell = shard.get(self._key)
+        if cell is None:
+            cell = shard[self._key] = [0] * self._size
+        cell[bisect_left(self._bounds, value)] += 1
+        cell[-1] += value
+
+    def time(self) -> '_Timer':
+        """Context manager that observes the block's duration in seconds"""
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ('_histogram', '_start')
+
+    def __init__(self, histogram: _HistogramChild):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start)
+
+
+class Histogram(_Metric):
+    """Bucketed distribution with sum and count"""
+    type = 'histogram'
+    _child_class = _HistogramChild
+
+    def __init__(self, registry, name, help, labels, buckets: Sequence[float]):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(registry, name, help, labels)
+
+    def observe(self, value: float):
+        self._default.observe(value)
+
+    def time(self) -> _Timer:
+        return self._default.time()
+
+    def render(self, cells: Dict) -> List[str]:
+        lines = []
+        bounds = self.buckets + (float('inf'),)
+        for values in self._keys(cells):
+            cell = cells.get((self.name, values)) or [0] * (len(bounds) + 1)
+            cumulative = 0
+            for bound, count in zip(bounds, cell):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_label_text(self.label_names, values, le)} {cumulative}')
+            labels = _label_text(self.label_names, values)
+            lines.append(f'{self.name}_sum{labels} {_format_value(cell[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class PipelineMetrics:
+    """The metrics every vectorization entry point reports, under shared names"""
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        self.registry = registry or MetricsRegistry(METRICS_MULTIPROC_DIR or None)
+        self.stage_seconds = self.registry.histogram(
+            'vectorizer_stage_seconds',
+            "Time spent per pipeline stage: queue, download (fetch or receive the input), verify, "
+            "admission (wait for memory/CPU budget), optimize, upscale, trace, simplify, upload (store or upload the SVG)",
+            ('stage',)
+        )
+        self.jobs_in_flight = self.registry.gauge('vectorizer_jobs_in_flight', "Jobs currently being processed")
+        self.jobs_queued = self.registry.gauge('vectorizer_jobs_queued', "Jobs waiting for a worker")
+        self.jobs = self.registry.counter('vectorizer_jobs_total', "Finished jobs by outcome", ('outcome',))
+        self.input_pixels = self.registry.histogram(
+            'vectorizer_input_pixels', "Decoded input size in pixels", buckets=PIXEL_BUCKETS
+        )
+        self.output_bytes = self.registry.histogram(
+            'vectorizer_output_bytes', "Size of the SVG returned to the client", buckets=BYTE_BUCKETS
+        )
+        self.waifu2x_fallbacks = self.registry.counter(
+            'vectorizer_waifu2x_fallbacks_total',
+            "Images traced without upscaling because Waifu2x was missing or failed",
+            ('reason',)
+        )
+        self.errors = self.registry.counter('vectorizer_errors_total', "Failed requests and jobs by error type",
+                                            ('type',))
+
+    def stage(self, name: str) -> _Timer:
+        """Time a block as one pipeline stage"""
+        return self.stage_seconds.labels(name).time()
+
+    def error(self, error):
+        """Count an error by its exception class (or a given name)"""
+        self.errors.labels(error if isinstance(error, str) else type(error).__name__).inc()
+
+    def render(self) -> str:
+        return self.registry.render()
+
+
+_pipeline_metrics: Optional[PipelineMetrics] = None
+
+
+def get_metrics() -> PipelineMetrics:
+    """Get or create the process-wide pipeline metrics"""
+    global _pipeline_metrics
+    if _pipeline_metrics is None:
+        _pipeline_metrics = PipelineMetrics()
+    return _pipeline_metrics
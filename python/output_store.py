@@ -0,0 +1,317 @@
+"""
+Sharded on-disk store for finished SVGs, and the janitor that keeps disks bounded.
+
+Outputs are content-addressed (the name is a hash of the SVG bytes, so the same
+result is stored once) and spread over <name[:2]>/<name[2:4]>/ directories so
+no directory grows large enough to slow down lookups, send_file or backups.
+Each object keeps its precompressed sidecars next to it. The index of size and
+last access lives in memory and is rebuilt from the files themselves (mtime is
+the last-access time, refreshed on download), so several server processes can
+share one store and the janitor's periodic rescan picks up their writes.
+
+The janitor thread expires objects past OUTPUT_TTL_HOURS, evicts the least
+recently used ones while the store is over OUTPUT_MAX_MB, removes per-job work
+directories once their job is over, and sweeps leftover temporary files
+(*_optimized.* from the PHP image optimizer, *.tmp from interrupted writes).
+"""
+import os
+import time
+import shutil
+import fnmatch
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Sequence
+
+from precompress import write_precompressed, remove_precompressed, ENCODINGS
+
+logger = logging.getLogger(__name__)
+
+# === CONFIG ===
+OUTPUT_MAX_MB = int(os.getenv('OUTPUT_MAX_MB', '2048'))
+# Objects not downloaded for this long are deleted (0 keeps them until the quota needs the space)
+OUTPUT_TTL_HOURS = float(os.getenv('OUTPUT_TTL_HOURS', '168'))
+JANITOR_ENABLED = os.getenv('JANITOR_ENABLED', 'true').lower() == 'true'
+JANITOR_INTERVAL_SEC = int(os.getenv('JANITOR_INTERVAL_SEC', '600'))
+TEMP_FILE_TTL_HOURS = float(os.getenv('TEMP_FILE_TTL_HOURS', '1'))
+# Extra directories to sweep for temp files, separated by os.pathsep (e.g. the PHP uploads folder)
+JANITOR_TEMP_DIRS = [d for d in os.getenv('JANITOR_TEMP_DIRS', '').split(os.pathsep) if d]
+
+# Downloads refresh an object's last access at most this often, to keep writes off the hot path
+TOUCH_INTERVAL_SEC = 3600
+TEMP_PATTERNS = ('*_optimized.*', '*.tmp')
+SIDECAR_SUFFIXES = tuple(suffix for _, suffix in ENCODINGS)
+
+
+def object_name(data: bytes) -> str:
+    """Content-addressed name for an SVG"""
+    return hashlib.sha256(data).hexdigest()[:32] + '.svg'
+
+
+def _disk_size(path: str) -> int:
+    """Size of a file plus its precompressed sidecars"""
+    total = 0
+    for candidate in (path,) + tuple(path + suffix for suffix in SIDECAR_SUFFIXES):
+        try:
+            total += os.path.getsize(candidate)
+        except OSError:
+            pass
+    return total
+
+
+class OutputStore:
+    """Content-addressed SVG files sharded by hash prefix, with an LRU index of size and last access"""
+
+    def __init__(self, root: str, max_bytes: int, ttl_seconds: float):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.expired = 0
+        self.evictions = 0
+        # name -> [bytes on disk, last access], least recently used first
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.root, exist_ok=True)
+        self.refresh()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name[:2], name[2:4], name)
+
+    def locate(self, name: str) -> Optional[str]:
+        """Path of a stored object, including files from before sharding, or None"""
+        for path in (self.path(name), os.path.join(self.root, name)):
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def put(self, data: bytes) -> str:
+        """Store an SVG with its sidecars and return its name (an existing copy is reused)"""
+        name = object_name(data)
+        path = self.path(name)
+        if os.path.exists(path):
+            self.touch(name, force=True)
+            return name
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        write_precompressed(tmp_path, data)
+        # Sidecars first, so the object never appears without them
+        for suffix in SIDECAR_SUFFIXES:
+            if os.path.exists(tmp_path + suffix):
+                os.replace(tmp_path + suffix, path + suffix)
+        os.replace(tmp_path, path)
+        self._register(name, _disk_size(path), time.time())
+        return name
+
+    def touch(self, name: str, force: bool = False):
+        """Record a download (or a repeat put) as the object's last access"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or (not force and now - entry[1] < TOUCH_INTERVAL_SEC):
+                return
+            entry[1] = now
+            self._entries.move_to_end(name)
+        path = self.locate(name)
+        if path:
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+
+    def refresh(self):
+        """Rebuild the index from the files on disk (also picks up other processes' writes)"""
+        found = []
+        for root, _, files in os.walk(self.root):
+            for file_name in files:
+                if not file_name.endswith('.svg'):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    mtime = os.stat(path).st_mtime
+                except OSError:
+                    continue
+                found.append((mtime, file_name, _disk_size(path)))
+
+        entries = OrderedDict((name, [size, mtime]) for mtime, name, size in sorted(found))
+        with self._lock:
+            self._entries = entries
+            self._total_bytes = sum(size for size, _ in entries.values())
+
+    def expire(self) -> int:
+        """Delete objects not accessed within the TTL"""
+        if self.ttl_seconds <= 0:
+            return 0
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            stale = [name for name, (_, last_access) in self._entries.items() if last_access < cutoff]
+        removed = sum(1 for name in stale if self._remove_if_unused(name, cutoff))
+        self.expired += removed
+        return removed
+
+    def enforce_quota(self) -> int:
+        """Evict least recently used objects until the store fits its quota"""
+        removed = 0
+        for _ in range(len(self._entries)):
+            with self._lock:
+                if self._total_bytes <= self.max_bytes or not self._entries:
+                    break
+                name, (_, last_access) = next(iter(self._entries.items()))
+            if self._remove_if_unused(name, last_access + 1e-3):
+                removed += 1
+        self.evictions += removed
+        return removed
+
+    def _remove_if_unused(self, name: str, cutoff: float) -> bool:
+        """Delete an object unless it was accessed at or after cutoff (possibly by another process)"""
+        path = self.locate(name)
+        try:
+            mtime = os.stat(path).st_mtime if path else None
+        except OSError:
+            mtime = None
+
+        if mtime is not None and mtime >= cutoff:
+            # Touched since the index was built: keep it and move it to the recent end
+            self._register(name, _disk_size(path), mtime)
+            return False
+        if path:
+            remove_precompressed(path)
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            if entry:
+                self._total_bytes -= entry[0]
+        return mtime is not None
+
+    def _register(self, name: str, size: int, last_access: float):
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            if entry:
+                self._total_bytes -= entry[0]
+            self._entries[name] = [size, last_access]
+            self._total_bytes += size
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "objects": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
+
+
+class Janitor:
+    """Background sweeps: store TTL and quota, finished job directories and stale temp files"""
+
+    def __init__(self, store: Optional[OutputStore] = None, job_root: Optional[str] = None,
+                 job_dir_ttl: float = 3600, keep_job: Optional[Callable[[str], bool]] = None,
+                 temp_dirs: Sequence[str] = (), temp_ttl: float = TEMP_FILE_TTL_HOURS * 3600,
+                 interval: float = JANITOR_INTERVAL_SEC, leader: Optional[Callable[[], bool]] = None):
+        self.store = store
+        self.job_root = job_root
+        self.job_dir_ttl = job_dir_ttl
+        self.keep_job = keep_job or (lambda job_id: False)
+        self.temp_dirs = [d for d in list(temp_dirs) + JANITOR_TEMP_DIRS if d]
+        self.temp_ttl = temp_ttl
+        self.interval = interval
+        # With several processes sharing one store, only the one this returns True in sweeps
+        self.leader = leader or (lambda: True)
+        self.sweeps = 0
+        self.removed = {"expired": 0, "evicted": 0, "job_dirs": 0, "temp_files": 0}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, daemon=True, name="janitor")
+        self._thread.start()
+        logger.info(f"Janitor started (every {self.interval}s)")
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.leader():
+                    self.sweep()
+            except Exception as e:
+                logger.error(f"Janitor sweep failed: {e}")
+            self._stop.wait(self.interval)
+
+    def sweep(self) -> Dict[str, int]:
+        """One pass over everything the janitor looks after"""
+        removed = {"expired": 0, "evicted": 0, "job_dirs": 0, "temp_files": 0}
+        if self.store:
+            self.store.refresh()
+            removed["expired"] = self.store.expire()
+            removed["evicted"] = self.store.enforce_quota()
+        if self.job_root:
+            removed["job_dirs"] = self._sweep_job_dirs()
+        removed["temp_files"] = self._sweep_temp_files()
+
+        self.sweeps += 1
+        for key, count in removed.items():
+            self.removed[key] += count
+        if any(removed.values()):
+            logger.info(f"Janitor removed {removed}")
+        return removed
+
+    def _sweep_job_dirs(self) -> int:
+        """Work directories of jobs that finished more than job_dir_ttl ago"""
+        cutoff = time.time() - self.job_dir_ttl
+        removed = 0
+        try:
+            entries = list(os.scandir(self.job_root))
+        except OSError:
+            return 0
+        for entry in entries:
+            # Underscore directories (e.g. _waifu2x) belong to the runner itself
+            if not entry.is_dir() or entry.name.startswith('_') or self.keep_job(entry.name):
+                continue
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+            except OSError:
+                continue
+            shutil.rmtree(entry.path, ignore_errors=True)
+            removed += 1
+        return removed
+
+    def _sweep_temp_files(self) -> int:
+        cutoff = time.time() - self.temp_ttl
+        roots = list(self.temp_dirs) + ([self.store.root] if self.store else [])
+        removed = 0
+        for top in roots:
+            for root, _, files in os.walk(top):
+                for file_name in files:
+                    if not any(fnmatch.fnmatch(file_name, pattern) for pattern in TEMP_PATTERNS):
+                        continue
+                    path = os.path.join(root, file_name)
+                    try:
+                        if os.stat(path).st_mtime < cutoff:
+                            os.remove(path)
+                            removed += 1
+                    except OSError:
+                        pass
+        return removed
+
+    def stats(self) -> Dict[str, object]:
+        return {"sweeps": self.sweeps, "removed": dict(self.removed)}
+
+
+_output_store: Optional[OutputStore] = None
+
+
+def get_output_store(root: str) -> OutputStore:
+    """Get or create the process-wide output store"""
+    global _output_store
+    if _output_store is None:
+        _output_store = OutputStore(root, OUTPUT_MAX_MB * 1024 * 1024, OUTPUT_TTL_HOURS * 3600)
+    return _output_store
@@ -0,0 +1,105 @@
+"""
+Precompressed static output files.
+
+SVG results never change once written, so they are compressed a single time at
+creation: next to output.svg sit output.svg.gz and (when the brotli package is
+installed) output.svg.br. Download handlers pick the best sidecar the client
+accepts instead of compressing per request, and use a content hash as a strong
+ETag for conditional requests.
+"""
+import os
+import gzip
+import hashlib
+import logging
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# === CONFIG ===
+GZIP_LEVEL = int(os.getenv('PRECOMPRESS_GZIP_LEVEL', '9'))
+BROTLI_QUALITY = int(os.getenv('PRECOMPRESS_BROTLI_QUALITY', '11'))
+
+# Content-Encoding -> sidecar suffix, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def write_precompressed(path: str, data: bytes) -> List[str]:
+    """Write data to path plus compressed sidecars, returning the encodings written"""
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    encodings = []
+    variants = [('gzip', '.gz', lambda d: gzip.compress(d, compresslevel=GZIP_LEVEL, mtime=0))]
+    if brotli is not None:
+        variants.insert(0, ('br', '.br', lambda d: brotli.compress(d, quality=BROTLI_QUALITY)))
+
+    for encoding, suffix, compress in variants:
+        compressed = compress(data)
+        # Tiny files can grow when compressed; serve those as-is
+        if len(compressed) >= len(data):
+            continue
+        with open(path + suffix, 'wb') as f:
+            f.write(compressed)
+        encodings.append(encoding)
+    return encodings
+
+
+def remove_precompressed(path: str):
+    """Delete a file together with its compressed sidecars"""
+    for candidate in [path] + [path + suffix for _, suffix in ENCODINGS]:
+        try:
+            os.remove(candidate)
+        except FileNotFoundError:
+            pass
+
+
+def _accepted_encodings(accept_encoding: str) -> List[str]:
+    """Content codings the client accepts (q=0 entries excluded)"""
+    accepted = []
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.append(coding)
+    return accepted
+
+
+def select_variant(path: str, accept_encoding: Optional[str]) -> Tuple[str, Optional[str]]:
+    """Pick the file to serve for an Accept-Encoding header: (path, content_encoding)"""
+    accepted = _accepted_encodings(accept_encoding or '')
+    for encoding, suffix in ENCODINGS:
+        if (encoding in accepted or '*' in accepted) and os.path.exists(path + suffix):
+            return path + suffix, encoding
+    return path, None
+
+
+@lru_cache(maxsize=4096)
+def _content_hash(path: str, mtime_ns: int, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+def strong_etag(path: str, encoding: Optional[str] = None) -> str:
+    """Content-hash ETag for a file; each encoding is a distinct representation"""
+    st = os.stat(path)
+    etag = _content_hash(path, st.st_mtime_ns, st.st_size)
+    return f"{etag}-{encoding}" if encoding else etag
@@ -0,0 +1,84 @@
+"""
+Cheap image preprocessing ahead of the expensive stages.
+
+Image.open only parses the header, so the pixel count is checked before any
+pixel memory is allocated and oversized (or decompression-bomb) inputs are
+rejected up front. JPEGs that are going to be shrunk anyway are decoded
+straight at 1/2, 1/4 or 1/8 scale through Pillow's draft mode, so the LANCZOS
+pass that follows starts from a much smaller image. Only Pillow is needed, so
+the API proxy can use it without VTracer installed.
+"""
+import io
+import os
+import logging
+from typing import Optional, Tuple, Union, BinaryIO
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# === CONFIG ===
+# Inputs with more pixels than this are rejected from the header alone
+MAX_INPUT_PIXELS = int(os.getenv('MAX_INPUT_PIXELS', str(8192 * 8192)))
+
+
+class ImageTooLarge(ValueError):
+    """The image header declares more pixels than allowed"""
+
+
+def open_header(source: Union[bytes, BinaryIO], max_pixels: int = MAX_INPUT_PIXELS) -> Image.Image:
+    """Open an image without decoding it, rejecting it if it has too many pixels"""
+    fp = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+    try:
+        img = Image.open(fp)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(str(e))
+
+    width, height = img.size
+    if width * height > max_pixels:
+        img.close()
+        raise ImageTooLarge(f"Image is {width}x{height} ({width * height} pixels), the limit is {max_pixels} pixels")
+    return img
+
+
+def fit_size(width: int, height: int, max_dimension: int) -> Tuple[int, int]:
+    """The size that fits within max_dimension on both sides, keeping the aspect ratio"""
+    if width > height:
+        return max_dimension, max(1, int((height * max_dimension) / width))
+    return max(1, int((width * max_dimension) / height)), max_dimension
+
+
+def load_image(img: Image.Image, max_dimension: Optional[int] = None) -> Image.Image:
+    """Decode an opened image, letting JPEG decode at a reduced scale when it will be shrunk anyway"""
+    width, height = img.size
+    if max_dimension and max(width, height) > max_dimension and img.format == 'JPEG':
+        # draft never goes below the requested size, so the final resize still has full detail
+        img.draft(img.mode, fit_size(width, height, max_dimension))
+        if img.size != (width, height):
+            logger.info(f"Decoding JPEG at reduced scale: {width}x{height} -> {img.size[0]}x{img.size[1]}")
+    img.load()
+    return img
+
+
+def decode_image(source: Union[bytes, BinaryIO], max_dimension: Optional[int] = None,
+                 max_pixels: int = MAX_INPUT_PIXELS) -> Image.Image:
+    """Header check, pixel limit and a single (possibly reduced) decode"""
+    return load_image(open_header(source, max_pixels), max_dimension)
+
+
+def optimize_large_image(img: Image.Image, max_dimension: int = 2048) -> Optional[Image.Image]:
+    """Downscale large images before processing to prevent timeouts (returns None if not needed)"""
+    width, height = img.size
+    logger.info(f"Original image size: {width}x{height}")
+
+    # If image is too large, resize it
+    if width > max_dimension or height > max_dimension:
+        logger.info(f"Image is large, resizing to max dimension: {max_dimension}")
+
+        # Calculate new size maintaining aspect ratio
+        new_width, new_height = fit_size(width, height, max_dimension)
+        resized_img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        logger.info(f"Image resized to {new_width}x{new_height}")
+        return resized_img
+
+    return None
@@ -0,0 +1,169 @@
+"""
+Content-addressed SVG result cache.
+
+Results are keyed by a hash of the decoded input pixels plus every parameter
+that affects the output (mode, Waifu2x settings, VTracer options), so the same
+logo uploaded twice under different names is only traced once. Entries live on
+disk as <key[:2]>/<key>.svg and the total size is bounded with LRU eviction.
+"""
+import os
+import json
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# === CONFIG ===
+SVG_CACHE_ENABLED = os.getenv('SVG_CACHE_ENABLED', 'true').lower() == 'true'
+SVG_CACHE_DIR = os.getenv('SVG_CACHE_DIR', os.path.abspath('svg_cache'))
+SVG_CACHE_MAX_MB = int(os.getenv('SVG_CACHE_MAX_MB', '512'))
+
+
+def make_cache_key(img, params: Dict[str, Any]) -> str:
+    """Hash the decoded pixels of a PIL image together with the effective parameters"""
+    digest = hashlib.sha256()
+    digest.update(f"{img.mode}:{img.size[0]}x{img.size[1]}".encode())
+    digest.update(img.tobytes())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class SVGCache:
+    """Size-bounded LRU cache of SVG results on disk"""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.svg")
+
+    def _load_index(self):
+        """Rebuild the LRU order from the files already on disk (oldest access first)"""
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.svg'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, name[:-4], stat.st_size))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+
+        if found:
+            logger.info(f"SVG cache loaded {len(found)} entries ({self._total_bytes} bytes)")
+
+    def get_path(self, key: str) -> Optional[str]:
+        """Return the cached SVG path for a key, or None on a miss"""
+        path = self._path(key)
+        with self._lock:
+            if key in self._entries and os.path.exists(path):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                try:
+                    # mtime doubles as last-access time when the index is rebuilt
+                    os.utime(path, None)
+                except OSError:
+                    pass
+                return path
+
+            if key in self._entries:
+                # Removed behind our back (another process evicted it)
+                self._total_bytes -= self._entries.pop(key)
+            self.misses += 1
+            return None
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached SVG content for a key, or None on a miss"""
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put_file(self, key: str, svg_path: str):
+        """Store an SVG file produced by the pipeline"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(svg_path, tmp_path)
+        os.replace(tmp_path, path)
+        self._register(key, os.path.getsize(path))
+
+    def put(self, key: str, svg_content: str):
+        """Store SVG content produced by the pipeline"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(svg_content)
+        os.replace(tmp_path, path)
+        self._register(key, os.path.getsize(path))
+
+    def _register(self, key: str, size: int):
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits (caller holds the lock)"""
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            logger.info(f"SVG cache evicted {key} ({size} bytes)")
+
+    def stats(self) -> Dict[str, int]:
+        """Hit, miss and eviction counters for health/metrics endpoints"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Global instance
+_cache = None
+
+
+def get_svg_cache(cache_dir: Optional[str] = None) -> Optional[SVGCache]:
+    """Get or create the global cache instance (None when caching is disabled)"""
+    global _cache
+    if not SVG_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = SVGCache(cache_dir or SVG_CACHE_DIR, SVG_CACHE_MAX_MB * 1024 * 1024)
+    return _cache
@@ -0,0 +1,273 @@
+"""
+Geometric post-processing for VTracer output.
+
+Spline traces of 4x-upscaled rasters carry far more nodes than the shapes need.
+Each path is parsed into one NumPy array of on-curve points (plus the control
+points of its cubics) and then, for all subpaths at once:
+  * cubic segments whose control points lie within the tolerance of their chord
+    become straight lines,
+  * runs of straight segments are simplified with Ramer-Douglas-Peucker,
+  * the per-path translate() is folded into the coordinates and every number is
+    rounded to the coarsest precision the tolerance allows,
+  * consecutive sibling paths with the same fill are merged into one element.
+Paths using commands VTracer never emits are left untouched.
+"""
+import re
+import math
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_TOLERANCE = 0.5
+
+_PATH_RUN_RE = re.compile(r'(?:<path\b[^>]*/>\s*)+')
+_PATH_RE = re.compile(r'<path\b([^>]*)/>')
+_ATTR_RE = re.compile(r'([\w:-]+)="([^"]*)"')
+_TOKEN_RE = re.compile(r'[MLCZmlcz]|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_TRANSLATE_RE = re.compile(r'^\s*translate\(\s*([-+\d.eE]+)[\s,]+([-+\d.eE]+)\s*\)\s*$')
+_ANY_COMMAND_RE = re.compile(r'[A-Za-z]')
+# Whole numbers come out of repr() as "12.0"
+_WHOLE_RE = re.compile(r'\.0(?= |$)')
+
+_COMMANDS = ('M', 'L', 'C', 'Z')
+
+
+class _Path(NamedTuple):
+    """One path's vertices: every on-curve point, in drawing order across its subpaths
+
+    For a vertex that ends a cubic, c1 and c2 hold its control points.
+    """
+    points: np.ndarray  # (n, 2)
+    c1: np.ndarray  # (n, 2)
+    c2: np.ndarray  # (n, 2)
+    curve: np.ndarray  # (n,) the segment ending at this vertex is a cubic
+    start: np.ndarray  # (n,) the vertex starts a subpath (M)
+    closed: np.ndarray  # (subpaths,) the subpath ends with Z
+
+
+def _parse_path(d: str) -> Optional[_Path]:
+    """Parse absolute M/L/C/Z path data, returning None for anything else"""
+    if set(_ANY_COMMAND_RE.findall(d)) - set(_COMMANDS):
+        return None
+    tokens = np.array(_TOKEN_RE.findall(d))
+    if tokens.size == 0:
+        return None
+
+    is_command = np.isin(tokens, _COMMANDS)
+    command_at = np.flatnonzero(is_command)
+    if command_at.size == 0 or command_at[0] != 0:
+        return None
+    commands = tokens[command_at]
+    try:
+        numbers = tokens[~is_command].astype(np.float64)
+    except ValueError:
+        return None
+
+    # Numbers following each command, and how many came before it
+    counts = np.diff(np.append(command_at, tokens.size)) - 1
+    offsets = command_at - np.arange(command_at.size)
+    is_move = commands == 'M'
+    is_close = commands == 'Z'
+    stride = np.select([commands == 'C', is_close], [6, 0], 2)
+    if (commands[0] != 'M' or np.any(counts[is_move] < 2) or np.any(counts[is_close] != 0)
+            or np.any(counts[~is_close] % np.maximum(stride[~is_close], 1))):
+        return None
+    # Z must end its subpath: what follows is a new M or the end of the path
+    after_close = np.flatnonzero(is_close) + 1
+    if np.any(~is_move[after_close[after_close < commands.size]]):
+        return None
+
+    # One vertex per coordinate group (extra pairs after M are line-tos)
+    per_command = np.where(is_close, 0, counts // np.maximum(stride, 1))
+    owner = np.repeat(np.arange(commands.size), per_command)
+    index = np.arange(owner.size) - np.repeat(np.cumsum(per_command) - per_command, per_command)
+    base = offsets[owner] + index * stride[owner]
+    curve = commands[owner] == 'C'
+    start = is_move[owner] & (index == 0)
+    end = base + np.where(curve, 4, 0)
+
+    subpath = np.cumsum(is_move) - 1
+    closed = np.zeros(int(is_move.sum()), dtype=bool)
+    closed[subpath[is_close]] = True
+
+    pairs = numbers.reshape(-1, 2)
+    points = pairs[end // 2]
+    c1 = np.where(curve[:, None], pairs[np.where(curve, base // 2, 0)], np.nan)
+    c2 = np.where(curve[:, None], pairs[np.where(curve, base // 2 + 1, 0)], np.nan)
+    return _Path(points, c1, c2, curve, start, closed)
+
+
+def _distance_to_segments(points: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Distance from each point to its own segment a-b (all arrays (n, 2))"""
+    ab = b - a
+    length_sq = np.einsum('ij,ij->i', ab, ab)
+    projected = np.einsum('ij,ij->i', points - a, ab)
+    t = np.clip(np.divide(projected, length_sq, out=np.zeros_like(projected), where=length_sq > 0), 0.0, 1.0)
+    return np.linalg.norm(points - (a + t[:, None] * ab), axis=1)
+
+
+def _rdp(points: np.ndarray, keep: np.ndarray, first: np.ndarray, last: np.ndarray, tolerance: float):
+    """Ramer-Douglas-Peucker over many polylines points[first..last] at once, marking kept vertices
+
+    Every round finds the farthest interior vertex of each open interval and splits
+    the intervals where it lies outside the tolerance.
+    """
+    open_ = last - first >= 2
+    first, last = first[open_], last[open_]
+    while first.size:
+        counts = last - first - 1
+        owner = np.repeat(np.arange(first.size), counts)
+        starts = np.cumsum(counts) - counts
+        inner = np.arange(owner.size) - starts[owner] + first[owner] + 1
+        distances = _distance_to_segments(points[inner], points[first[owner]], points[last[owner]])
+        farthest = np.maximum.reduceat(distances, starts)
+        # First vertex reaching each interval's maximum
+        hits = np.flatnonzero(distances == farthest[owner])
+        split_at = hits[np.searchsorted(owner[hits], np.arange(first.size))]
+
+        split = farthest > tolerance
+        middle = inner[split_at[split]]
+        keep[middle] = True
+        first = np.concatenate((first[split], middle))
+        last = np.concatenate((middle, last[split]))
+        open_ = last - first >= 2
+        first, last = first[open_], last[open_]
+
+
+def _simplify_path(path: _Path, tolerance: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Which vertices survive, and which of them still end a cubic"""
+    points, start = path.points, path.start
+    curve = path.curve.copy()
+
+    # Flat cubics become lines: check both control points of every cubic against its chord
+    cubic = np.flatnonzero(curve)
+    if cubic.size:
+        a, b = points[cubic - 1], points[cubic]
+        deviation = np.maximum(_distance_to_segments(path.c1[cubic], a, b),
+                               _distance_to_segments(path.c2[cubic], a, b))
+        curve[cubic[deviation <= tolerance]] = False
+
+    # Simplify each run of consecutive line segments as one polyline
+    line = ~start & ~curve
+    edges = np.diff(np.concatenate(([0], line.astype(np.int8), [0])))
+    run_first = np.flatnonzero(edges == 1) - 1
+    run_last = np.flatnonzero(edges == -1) - 1
+    keep = ~line
+    keep[run_last] = True
+    _rdp(points, keep, run_first, run_last, tolerance)
+
+    # Z already draws the closing line back to the start point
+    subpath = np.cumsum(start) - 1
+    kept = np.flatnonzero(keep)
+    segments = np.bincount(subpath[kept], minlength=path.closed.size) - 1
+    last_kept = kept[np.append(np.flatnonzero(np.diff(subpath[kept])), kept.size - 1)]
+    first_vertex = np.flatnonzero(start)
+    closing = (path.closed & (segments > 2) & ~curve[last_kept]
+               & (np.linalg.norm(points[last_kept] - points[first_vertex], axis=1) <= tolerance))
+    keep[last_kept[closing]] = False
+    segments[closing] -= 1
+
+    # Keep shapes from collapsing below two segments: such subpaths stay as they were
+    collapsed = segments < 2
+    if collapsed.any():
+        restore = collapsed[subpath]
+        keep[restore] = True
+        curve[restore] = path.curve[restore]
+    return keep, curve
+
+
+def _format_path(path: _Path, keep: np.ndarray, curve: np.ndarray, offset: np.ndarray, precision: int) -> str:
+    kept = np.flatnonzero(keep)
+    start, curve = path.start[kept], curve[kept]
+    # Six numbers for a cubic (both controls, then the end point), two otherwise
+    values = np.hstack((path.c1[kept], path.c2[kept], path.points[kept]))
+    values[~curve, 0:2] = values[~curve, 4:6]
+    values += np.tile(offset, 3)
+    width = np.where(curve, 6, 2)
+    values = values[np.arange(6) < width[:, None]]
+    # + 0.0 turns -0.0 into 0.0
+    text = list(map(repr, (np.round(values, precision) + 0.0).tolist()))
+
+    # Command letters only where the command changes, as VTracer's own repeats are implicit
+    command = np.where(start, 0, np.where(curve, 2, 1))
+    first_number = np.cumsum(width) - width
+    changed = start | (command != np.concatenate(([0], command[:-1])))
+    letters = np.array(['M', 'L', 'C'])[command]
+    for i in np.flatnonzero(changed).tolist():
+        text[first_number[i]] = letters[i] + text[first_number[i]]
+
+    subpath = np.cumsum(start) - 1
+    last_number = np.cumsum(width) - 1
+    for i in np.flatnonzero(path.closed[subpath] & np.append(start[1:], True)).tolist():
+        text[last_number[i]] += ' Z'
+    return _WHOLE_RE.sub('', ' '.join(text))
+
+
+def auto_precision(tolerance: float) -> int:
+    """Decimal places whose rounding error stays within half the tolerance"""
+    if tolerance <= 0:
+        return 3
+    return max(0, math.ceil(-math.log10(tolerance / 2)))
+
+
+def simplify_svg(svg: str, tolerance: float = DEFAULT_TOLERANCE, precision: Optional[int] = None,
+                 merge_fills: bool = True) -> Tuple[str, Dict[str, Any]]:
+    """Simplify and compact every path in a VTracer SVG, returning (svg, stats)"""
+    if precision is None:
+        precision = auto_precision(tolerance)
+
+    stats = {
+        "tolerance": tolerance,
+        "precision": precision,
+        "bytes_before": len(svg.encode('utf-8')),
+        "nodes_before": 0,
+        "nodes_after": 0,
+        "paths_before": 0,
+        "paths_after": 0,
+    }
+
+    def rewrite_run(match) -> str:
+        elements = []
+        for path_match in _PATH_RE.finditer(match.group(0)):
+            attrs = dict(_ATTR_RE.findall(path_match.group(1)))
+            stats["paths_before"] += 1
+            path = _parse_path(attrs.get('d', ''))
+            translate = _TRANSLATE_RE.match(attrs.get('transform', 'translate(0,0)'))
+            if path is None or translate is None:
+                # Unknown path syntax or transform: pass through unchanged
+                elements.append((None, attrs, path_match.group(0)))
+                continue
+
+            offset = np.array([float(translate.group(1)), float(translate.group(2))])
+            if tolerance > 0:
+                keep, curve = _simplify_path(path, tolerance)
+            else:
+                keep, curve = np.ones(len(path.points), dtype=bool), path.curve
+            stats["nodes_before"] += len(path.points)
+            stats["nodes_after"] += int(keep.sum())
+            attrs.pop('transform', None)
+            elements.append((_format_path(path, keep, curve, offset, precision), attrs, None))
+
+        # Merge consecutive siblings that paint with the same fill
+        output = []
+        for d, attrs, original in elements:
+            other_attrs = {k: v for k, v in attrs.items() if k != 'd'}
+            if (merge_fills and d is not None and output and output[-1][0] is not None
+                    and output[-1][1] == other_attrs):
+                output[-1][0] += ' ' + d
+            else:
+                output.append([d, other_attrs, original])
+
+        lines = []
+        for d, other_attrs, original in output:
+            if d is None:
+                lines.append(original)
+                continue
+            extra = ''.join(f' {k}="{v}"' for k, v in other_attrs.items())
+            lines.append(f'<path d="{d}"{extra}/>')
+        stats["paths_after"] += len(lines)
+        return '\n'.join(lines) + '\n'
+
+    result = _PATH_RUN_RE.sub(rewrite_run, svg)
+    stats["bytes_after"] = len(result.encode('utf-8'))
+    return result, stats
@@ -0,0 +1,6 @@
+"""The modules under test and the offline fakes live one directory up (the serve fixture is in the root conftest)"""
+import os
+import sys
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PYTHON_DIR)
@@ -0,0 +1,107 @@
+import os
+import multiprocessing
+
+import pytest
+
+from metrics import MetricsRegistry, mark_process_dead, reset_multiproc_dir
+
+
+def make_registry(multiproc_dir=None):
+    registry = MetricsRegistry(multiproc_dir)
+    jobs = registry.counter('jobs_total', "Jobs", ['outcome'])
+    in_flight = registry.gauge('in_flight', "Jobs running")
+    seconds = registry.histogram('seconds', "Durations", buckets=(1, 10))
+    return registry, jobs, in_flight, seconds
+
+
+def worker_process(multiproc_dir, done, busy):
+    """A stand-in API worker: records a few values, flushes and exits"""
+    registry, jobs, in_flight, seconds = make_registry(multiproc_dir)
+    jobs.labels('done').inc(done)
+    in_flight.inc(busy)
+    seconds.observe(5)
+    registry.flush()
+
+
+def add_callback_gauges(registry):
+    budget = registry.gauge('budget_bytes', "Budget of this worker", ['state'])
+    budget.set_function(lambda: {'budget': 100})
+    # Read from shared memory in the real app: every worker reports the same pool-wide value
+    workers = registry.gauge('workers', "Worker processes")
+    workers.set_function(lambda: 2, pool_wide=True)
+
+
+def callback_worker_process(multiproc_dir, done, busy):
+    registry = MetricsRegistry(multiproc_dir)
+    add_callback_gauges(registry)
+    registry.flush()
+
+
+def run_worker(multiproc_dir, done, busy, target=worker_process) -> int:
+    process = multiprocessing.get_context('fork').Process(target=target, args=(multiproc_dir, done, busy))
+    process.start()
+    process.join(timeout=30)
+    assert process.exitcode == 0
+    return process.pid
+
+
+def sample(text, series):
+    for line in text.splitlines():
+        if line.startswith(series + ' '):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+
+@pytest.fixture
+def multiproc_dir(tmp_path):
+    reset_multiproc_dir(str(tmp_path))
+    return str(tmp_path)
+
+
+def test_single_process_registry_renders_its_own_values():
+    registry, jobs, in_flight, seconds = make_registry()
+    jobs.labels('done').inc(2)
+    in_flight.set_function(lambda: 3)
+
+    text = registry.render()
+
+    assert sample(text, 'jobs_total{outcome="done"}') == 2
+    assert sample(text, 'in_flight') == 3
+
+
+def test_scrape_sums_every_worker(multiproc_dir):
+    run_worker(multiproc_dir, done=2, busy=1)
+    run_worker(multiproc_dir, done=3, busy=1)
+    registry, jobs, in_flight, seconds = make_registry(multiproc_dir)
+    jobs.labels('done').inc()
+
+    text = registry.render()
+
+    assert sample(text, 'jobs_total{outcome="done"}') == 6
+    assert sample(text, 'in_flight') == 2
+    assert sample(text, 'seconds_count') == 2
+    assert sample(text, 'seconds_bucket{le="10"}') == 2
+
+
+def test_exited_worker_keeps_its_counts_but_not_its_gauges(multiproc_dir):
+    pid = run_worker(multiproc_dir, done=4, busy=1)
+    mark_process_dead(multiproc_dir, pid)
+    registry, jobs, in_flight, seconds = make_registry(multiproc_dir)
+
+    text = registry.render()
+
+    assert not os.path.exists(os.path.join(multiproc_dir, f'{pid}.json'))
+    assert sample(text, 'jobs_total{outcome="done"}') == 4
+    assert sample(text, 'seconds_sum') == 5
+    assert sample(text, 'in_flight') == 0
+
+
+def test_callback_gauges_are_summed_unless_pool_wide(multiproc_dir):
+    run_worker(multiproc_dir, done=0, busy=0, target=callback_worker_process)
+    registry = MetricsRegistry(multiproc_dir)
+    add_callback_gauges(registry)
+
+    text = registry.render()
+
+    assert sample(text, 'budget_bytes{state="budget"}') == 200
+    assert sample(text, 'workers') == 2
@@ -0,0 +1,196 @@
+import time
+import asyncio
+
+import pytest
+
+import fake_salad
+import upstream_client
+from upstream_client import CircuitBreaker, HedgedUpstreamClient, UpstreamError, UpstreamUnavailable
+
+
+class ScriptedRandom:
+    """Replaces the fake's random draws: the given values first, then ones that never trigger"""
+
+    def __init__(self, *values):
+        self.values = list(values)
+
+    def random(self):
+        return self.values.pop(0) if self.values else 0.99
+
+
+class NoSvgHandler(fake_salad.FakeSaladHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', '0')))
+        self._reply(200, {"status": "ok"})
+
+
+def make_files():
+    return {'file': ('input.png', b'\x89PNG fake', 'image/png')}
+
+
+async def local_svg():
+    return "<svg>local</svg>"
+
+
+@pytest.fixture
+def salad(serve):
+    return serve(fake_salad.FakeSaladHandler) + "/api/v1/vectorize"
+
+
+@pytest.fixture
+def hedge_after_200ms(monkeypatch):
+    monkeypatch.setattr(upstream_client, 'UPSTREAM_HEDGE_DEFAULT_MS', 200)
+    monkeypatch.setattr(upstream_client, 'UPSTREAM_HEDGE_MIN_MS', 50)
+
+
+def make_client(url, hedge='off', failures=2, reset=0.3):
+    client = HedgedUpstreamClient(url, headers={'Authorization': 'Bearer test'}, timeout=10, hedge=hedge)
+    client.breaker = CircuitBreaker(failure_threshold=failures, reset_timeout=reset)
+    return client
+
+
+def run(scenario, client):
+    async def main():
+        try:
+            return await scenario(client)
+        finally:
+            await client.close()
+    return asyncio.run(main())
+
+
+def test_success_goes_upstream(salad):
+    async def scenario(client):
+        return await client.vectorize(make_files)
+
+    client = make_client(salad)
+    svg, source = run(scenario, client)
+
+    assert source == "upstream"
+    assert svg == fake_salad.SVG
+    assert client.stats()["upstream_ok"] == 1
+    assert client.breaker.state == "closed"
+
+
+def test_rejected_request_does_not_trip_the_breaker(salad):
+    async def scenario(client):
+        for _ in range(3):
+            with pytest.raises(UpstreamError) as error:
+                await client.vectorize(make_files, local_svg)
+            assert error.value.status_code == 401
+
+    client = make_client(salad)
+    client.headers = {}
+    run(scenario, client)
+
+    assert client.breaker.state == "closed"
+    assert client.stats()["fallbacks"] == 0
+
+
+def test_breaker_opens_half_opens_and_closes(salad, monkeypatch):
+    monkeypatch.setenv('FAKE_SALAD_FAIL_RATE', '1')
+
+    async def scenario(client):
+        for _ in range(2):
+            assert await client.vectorize(make_files, local_svg) == ("<svg>local</svg>", "local")
+        assert client.breaker.state == "open"
+
+        # Open: no request reaches the upstream
+        requests_before = client.stats()["upstream_errors"]
+        with pytest.raises(UpstreamUnavailable):
+            await client.vectorize(make_files)
+        assert client.stats()["upstream_errors"] == requests_before
+        assert client.stats()["short_circuited"] == 1
+
+        # Half-open: a failing probe opens it again for another cool-down
+        await asyncio.sleep(0.35)
+        assert client.breaker.state == "half_open"
+        await client.vectorize(make_files, local_svg)
+        assert client.breaker.state == "open"
+
+        # The next probe succeeds and closes it
+        monkeypatch.setenv('FAKE_SALAD_FAIL_RATE', '0')
+        await asyncio.sleep(0.35)
+        assert await client.vectorize(make_files) == (fake_salad.SVG, "upstream")
+        assert client.breaker.state == "closed"
+        assert client.breaker.failures == 0
+
+    run(scenario, make_client(salad))
+
+
+def test_unusable_reply_does_not_wedge_the_half_open_probe(serve):
+    url = serve(NoSvgHandler) + "/api/v1/vectorize"
+
+    async def scenario(client):
+        for _ in range(2):
+            await client.vectorize(make_files, local_svg)
+        assert client.breaker.state == "open"
+
+        # Each cool-down lets exactly one probe through, even when it gets no SVG back
+        for _ in range(2):
+            await asyncio.sleep(0.35)
+            errors = client.stats()["upstream_errors"]
+            assert await client.vectorize(make_files, local_svg) == ("<svg>local</svg>", "local")
+            assert client.stats()["upstream_errors"] == errors + 1
+            assert client.breaker.state == "open"
+
+    run(scenario, make_client(url))
+
+
+def test_slow_call_is_hedged_with_a_second_attempt(salad, hedge_after_200ms, monkeypatch):
+    monkeypatch.setenv('FAKE_SALAD_SLOW_RATE', '0.5')
+    monkeypatch.setenv('FAKE_SALAD_SLOW_MS', '3000')
+    # The first call is slow, the hedge is not
+    monkeypatch.setattr(fake_salad, 'random', ScriptedRandom(0.0))
+
+    async def scenario(client):
+        start = time.monotonic()
+        result = await client.vectorize(make_files)
+        elapsed = time.monotonic() - start
+        # Let the losing attempt see its cancellation
+        await asyncio.sleep(0.05)
+        return result, elapsed
+
+    client = make_client(salad, hedge='retry')
+    (svg, source), elapsed = run(scenario, client)
+
+    assert (svg, source) == (fake_salad.SVG, "hedge")
+    assert 0.2 <= elapsed < 1.5
+    stats = client.stats()
+    assert stats["hedges"] == 1 and stats["hedge_wins"] == 1
+    # The cancelled attempt counts with the time it had run, not only the fast winner
+    assert len(client._latencies) == 2
+    assert max(client._latencies) >= 200
+
+
+def test_fast_call_is_not_hedged(salad, hedge_after_200ms):
+    async def scenario(client):
+        return await client.vectorize(make_files, local_svg)
+
+    client = make_client(salad, hedge='local')
+    assert run(scenario, client) == (fake_salad.SVG, "upstream")
+    assert client.stats()["hedges"] == 0
+
+
+def test_probe_that_loses_a_local_hedge_releases_the_breaker(salad, hedge_after_200ms, monkeypatch):
+    monkeypatch.setenv('FAKE_SALAD_SLOW_MS', '3000')
+
+    async def scenario(client):
+        monkeypatch.setenv('FAKE_SALAD_FAIL_RATE', '1')
+        for _ in range(2):
+            await client.vectorize(make_files, local_svg)
+        assert client.breaker.state == "open"
+        monkeypatch.setenv('FAKE_SALAD_FAIL_RATE', '0')
+
+        # The probe is slow, so the local fallback wins and the probe is cancelled
+        monkeypatch.setenv('FAKE_SALAD_SLOW_RATE', '0.5')
+        monkeypatch.setattr(fake_salad, 'random', ScriptedRandom(0.0))
+        await asyncio.sleep(0.35)
+        assert await client.vectorize(make_files, local_svg) == ("<svg>local</svg>", "local")
+        await asyncio.sleep(0.05)
+
+        # The breaker is still half-open and lets the next probe through
+        assert client.breaker.state == "half_open"
+        assert await client.vectorize(make_files, local_svg) == (fake_salad.SVG, "upstream")
+        assert client.breaker.state == "closed"
+
+    run(scenario, make_client(salad, hedge='local'))
@@ -0,0 +1,113 @@
+import io
+import os
+import sys
+import time
+import threading
+
+import pytest
+from PIL import Image
+
+from waifu2x_batcher import Waifu2xBatcher
+
+FAKE_WAIFU2X = [sys.executable, os.path.join(os.path.dirname(__file__), '..', 'fake_waifu2x.py')]
+
+
+def make_png(width: int, height: int, color=(200, 40, 40)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def upscale_concurrently(batcher, images, scale=2, noise=0, model='models-cunet'):
+    results = [None] * len(images)
+
+    def run(index):
+        results[index] = batcher.upscale(images[index], scale, noise, model)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(images))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+    return results
+
+
+@pytest.fixture
+def batcher(tmp_path):
+    return Waifu2xBatcher(FAKE_WAIFU2X, str(tmp_path), window_ms=300, max_batch=16, timeout=60)
+
+
+def test_concurrent_requests_share_one_launch(batcher):
+    images = [make_png(8 + i, 8, (i * 30, 0, 0)) for i in range(4)]
+
+    results = upscale_concurrently(batcher, images)
+
+    assert batcher.stats()["launches"] == 1
+    assert batcher.stats()["images"] == 4
+    assert batcher.stats()["fallbacks"] == 0
+    # Each caller gets its own image back, upscaled
+    for i, result in enumerate(results):
+        with Image.open(io.BytesIO(result)) as img:
+            assert img.size == ((8 + i) * 2, 16)
+            assert img.getpixel((0, 0))[:3] == (i * 30, 0, 0)
+
+
+def test_different_settings_are_not_coalesced(batcher):
+    image = make_png(8, 8)
+    results = [None, None]
+
+    def run(index, scale):
+        results[index] = batcher.upscale(image, scale, 0, 'models-cunet')
+
+    threads = [threading.Thread(target=run, args=(0, 2)), threading.Thread(target=run, args=(1, 4))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+
+    assert batcher.stats()["launches"] == 2
+    assert [Image.open(io.BytesIO(result)).size for result in results] == [(16, 16), (32, 32)]
+
+
+def test_full_batch_runs_without_waiting_for_the_window(tmp_path):
+    batcher = Waifu2xBatcher(FAKE_WAIFU2X, str(tmp_path), window_ms=60000, max_batch=2, timeout=60)
+
+    results = upscale_concurrently(batcher, [make_png(8, 8), make_png(8, 8)])
+
+    assert all(result is not None for result in results)
+    assert batcher.stats()["launches"] == 1
+
+
+def test_batch_after_a_full_one_waits_its_own_window(tmp_path):
+    batcher = Waifu2xBatcher(FAKE_WAIFU2X, str(tmp_path), window_ms=2000, max_batch=2, timeout=60)
+    started = time.monotonic()
+    # Fills at once; the window timer armed by its first request must not flush the next batch
+    first_batch = threading.Thread(target=upscale_concurrently, args=(batcher, [make_png(8, 8), make_png(8, 8)]))
+    first_batch.start()
+    time.sleep(max(0.0, started + 1.2 - time.monotonic()))
+
+    submitted = time.monotonic()
+    batcher.upscale(make_png(8, 8), 2, 0, 'models-cunet')
+    waited = time.monotonic() - submitted
+    first_batch.join(timeout=60)
+
+    assert waited >= 1.9
+    assert batcher.stats()["launches"] == 2
+
+
+def test_failed_launch_returns_the_original_bytes(batcher, monkeypatch):
+    monkeypatch.setenv('FAKE_WAIFU2X_FAIL', '1')
+    images = [make_png(8, 8), make_png(9, 9)]
+
+    results = upscale_concurrently(batcher, images)
+
+    assert results == images
+    assert batcher.stats()["fallbacks"] == 2
+
+
+def test_missing_binary_returns_the_original_bytes(tmp_path):
+    batcher = Waifu2xBatcher([str(tmp_path / "no-such-waifu2x")], str(tmp_path / "work"), window_ms=10)
+    image = make_png(8, 8)
+
+    assert batcher.upscale(image, 2, 0, 'models-cunet') is image
+    assert batcher.stats()["fallbacks"] == 1
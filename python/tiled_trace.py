@@ -0,0 +1,156 @@
+"""
+Tile-parallel VTracer tracing for large rasters.
+
+A 4x Waifu2x upscale of a 2048 px image is far too large to trace on one core,
+so the raster is split into overlapping tiles that are traced in a process pool.
+Each tile is traced with some surrounding context (the overlap) and then clipped
+back to its own region when the paths are stitched into a single SVG document,
+which keeps shapes that cross a tile edge continuous.
+"""
+import io
+import os
+import re
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import vtracer
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# === CONFIG ===
+TILE_SIZE = int(os.getenv('VTRACER_TILE_SIZE', '1024'))
+TILE_OVERLAP = int(os.getenv('VTRACER_TILE_OVERLAP', '32'))
+TILE_MIN_PIXELS = int(os.getenv('VTRACER_TILE_MIN_PIXELS', str(2048 * 2048)))
+TILE_WORKERS = int(os.getenv('VTRACER_TILE_WORKERS', '0')) or (os.cpu_count() or 1)
+
+# Extra coverage given to each clip rect so neighbouring tiles meet without hairline gaps
+SEAM_BLEED = 0.5
+
+_PATH_RE = re.compile(r'<path\b[^>]*/>')
+
+_executor = None
+
+Box = Tuple[int, int, int, int]
+
+
+def should_tile(width: int, height: int) -> bool:
+    """Return True when the raster is big enough for tiling to pay off"""
+    return TILE_WORKERS > 1 and width * height >= TILE_MIN_PIXELS
+
+
+def plan_tiles(width: int, height: int, tile_size: int = TILE_SIZE,
+               overlap: int = TILE_OVERLAP) -> List[Tuple[Box, Box]]:
+    """Split the raster into tiles, returning (core box, padded box) pairs"""
+    tiles = []
+    for top in range(0, height, tile_size):
+        for left in range(0, width, tile_size):
+            core = (left, top, min(left + tile_size, width), min(top + tile_size, height))
+            padded = (
+                max(core[0] - overlap, 0),
+                max(core[1] - overlap, 0),
+                min(core[2] + overlap, width),
+                min(core[3] + overlap, height),
+            )
+            tiles.append((core, padded))
+    return tiles
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """Get or create the shared tracing process pool"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=TILE_WORKERS)
+        logger.info(f"Tile tracing pool started ({TILE_WORKERS} processes)")
+    return _executor
+
+
+def warm_pool() -> int:
+    """Start the pool's worker processes (and their imports) ahead of the first large trace"""
+    if TILE_WORKERS <= 1:
+        return 0
+    executor = _get_executor()
+    # One task per worker makes the pool spawn all of them now rather than on first use
+    return len(set(executor.map(_worker_pid, range(TILE_WORKERS))))
+
+
+def _worker_pid(_: int) -> int:
+    # Hold the worker briefly so each task lands on a different process
+    time.sleep(0.1)
+    return os.getpid()
+
+
+def _trace_tile(png_bytes: bytes, params: Dict) -> List[str]:
+    """Trace one tile and return its <path/> elements (runs in a worker process)"""
+    svg = vtracer.convert_raw_image_to_svg(png_bytes, img_format='png', **params)
+    return _PATH_RE.findall(svg)
+
+
+def _encode_tile(img: Image.Image, box: Box) -> bytes:
+    """Crop a tile and encode it as a quickly-written PNG"""
+    buffer = io.BytesIO()
+    img.crop(box).save(buffer, format='PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+def stitch_tiles(width: int, height: int, tiles: List[Tuple[Box, Box]],
+                 tile_paths: List[List[str]]) -> str:
+    """Assemble per-tile paths into one SVG, clipping each tile to its core region"""
+    defs = []
+    groups = []
+    for index, ((core, padded), paths) in enumerate(zip(tiles, tile_paths)):
+        if not paths:
+            continue
+
+        x0 = max(core[0] - SEAM_BLEED, 0)
+        y0 = max(core[1] - SEAM_BLEED, 0)
+        x1 = min(core[2] + SEAM_BLEED, width)
+        y1 = min(core[3] + SEAM_BLEED, height)
+        defs.append(
+            f'<clipPath id="tile{index}"><rect x="{x0:g}" y="{y0:g}" '
+            f'width="{x1 - x0:g}" height="{y1 - y0:g}"/></clipPath>'
+        )
+        groups.append(
+            f'<g clip-path="url(#tile{index})"><g transform="translate({padded[0]},{padded[1]})">\n'
+            + '\n'.join(paths)
+            + '\n</g></g>'
+        )
+
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<svg version="1.1" xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">\n'
+        '<defs>' + ''.join(defs) + '</defs>\n'
+        + '\n'.join(groups)
+        + '\n</svg>\n'
+    )
+
+
+def trace_image_tiled(img: Image.Image, params: Dict, tile_size: int = TILE_SIZE,
+                      overlap: int = TILE_OVERLAP) -> str:
+    """Trace a PIL image tile by tile in parallel and return the stitched SVG"""
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA')
+
+    width, height = img.size
+    tiles = plan_tiles(width, height, tile_size, overlap)
+    logger.info(f"Tiled tracing {width}x{height} as {len(tiles)} tiles ({tile_size}px, {overlap}px overlap)")
+
+    executor = _get_executor()
+    futures = [executor.submit(_trace_tile, _encode_tile(img, padded), params) for _, padded in tiles]
+    tile_paths = [future.result() for future in futures]
+
+    return stitch_tiles(width, height, tiles, tile_paths)
+
+
+def convert_image_to_svg_tiled(input_path: str, output_path: str,
+                               tile_size: Optional[int] = None, **params) -> bool:
+    """Drop-in replacement for vtracer.convert_image_to_svg_py that traces in tiles"""
+    with Image.open(input_path) as img:
+        img.load()
+        svg = trace_image_tiled(img, params, tile_size or TILE_SIZE)
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write(svg)
+    return True
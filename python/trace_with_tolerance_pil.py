@@ -10,6 +10,8 @@ except ImportError:
 
 from PIL import Image
 
+from vtracer_presets import get_preset
+
 # === CONFIG ===
 waifu2x_dir = r"C:\waifu2x-ncnn-vulkan-20230413-win64"  # <-- Update to your waifu2x folder!
 waifu2x_exe = os.path.join(waifu2x_dir, "waifu2x-ncnn-vulkan.exe" if os.name == "nt" else "waifu2x-ncnn-vulkan")
@@ -49,20 +51,7 @@ def main():
     # Step 2: Vectorize with VTracer (cartoon/clean settings)
     out_svg = os.path.splitext(inp)[0] + "_svg.svg"
     print("\n[VTracer] Vectorizing with ultra-smooth settings...")
-    vtracer.convert_image_to_svg_py(
-        upscaled,
-        out_svg,
-        colormode="color",
-        mode="spline",
-        filter_speckle=12,
-        color_precision=8,
-        layer_difference=16,
-        corner_threshold=55,
-        length_threshold=3.0,
-        max_iterations=15,
-        splice_threshold=55,
-        path_precision=3
-    )
+    vtracer.convert_image_to_svg_py(upscaled, out_svg, **get_preset("illustration")["vtracer"])
     print(f"\n✅ DONE! SVG saved at: {out_svg}")
 
     # Clean up: Delete the upscaled PNG after vectorization
@@ -0,0 +1,180 @@
+"""
+Streaming multipart upload ingestion.
+
+The request body is fed chunk by chunk through python-multipart's push parser
+and the wanted file field is written into one SpooledTemporaryFile (memory
+first, disk past UPLOAD_SPOOL_MEMORY_BYTES). The size limit is enforced as the
+bytes arrive, so an oversize upload is rejected without being received in
+full. Consumers (image analysis, upstream requests, local fallback) each get
+an independent reader over that single buffer instead of their own copy.
+"""
+import os
+import io
+import tempfile
+import threading
+from typing import AsyncIterator, Dict, Optional
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# === CONFIG ===
+UPLOAD_SPOOL_MEMORY_BYTES = int(os.getenv('UPLOAD_SPOOL_MEMORY_BYTES', str(1024 * 1024)))
+
+# Room for multipart boundaries, part headers and small form fields
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadError(ValueError):
+    """The request body is not a usable multipart upload"""
+
+
+class UploadTooLarge(UploadError):
+    """The upload exceeded the size limit while streaming"""
+
+
+class SpooledUpload:
+    """One uploaded file held in a spooled buffer, readable by several consumers"""
+
+    def __init__(self, filename: str, content_type: str, max_bytes: int):
+        self.filename = filename
+        self.content_type = content_type
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MEMORY_BYTES)
+        self._lock = threading.Lock()
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {self.max_bytes} bytes")
+        with self._lock:
+            self._file.write(data)
+
+    def read_at(self, offset: int, size: int = -1) -> bytes:
+        """Positional read; safe to call from several readers and threads"""
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(size)
+
+    def reader(self) -> '_UploadReader':
+        """A new file-like view with its own position over the shared buffer"""
+        return _UploadReader(self)
+
+    def read_bytes(self) -> bytes:
+        """The whole upload as bytes, for consumers that cannot take a file"""
+        return self.read_at(0)
+
+    def close(self):
+        self._file.close()
+
+
+class _UploadReader(io.RawIOBase):
+    def __init__(self, upload: SpooledUpload):
+        self._upload = upload
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self._upload.size - self._position
+        data = self._upload.read_at(self._position, size)
+        self._position += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._upload.size
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+async def ingest_upload(stream: AsyncIterator[bytes], content_type: Optional[str], field: str,
+                        max_bytes: int) -> SpooledUpload:
+    """Stream a multipart body into a SpooledUpload for the given file field"""
+    mime, options = parse_options_header(content_type or '')
+    boundary = options.get(b'boundary')
+    if mime != b'multipart/form-data' or not boundary:
+        raise UploadError("Expected a multipart/form-data upload")
+
+    state: Dict = {"headers": {}, "header_field": b"", "header_value": b"", "target": None, "upload": None}
+
+    def on_part_begin():
+        state["headers"] = {}
+        state["target"] = None
+
+    def on_header_field(data, start, end):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["header_field"].lower()] = state["header_value"]
+        state["header_field"] = b""
+        state["header_value"] = b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(state["headers"].get(b'content-disposition', b''))
+        if disposition.get(b'name', b'').decode('latin-1') == field and state["upload"] is None:
+            state["upload"] = SpooledUpload(
+                disposition.get(b'filename', b'').decode('utf-8', 'replace'),
+                state["headers"].get(b'content-type', b'application/octet-stream').decode('latin-1'),
+                max_bytes
+            )
+            state["target"] = state["upload"]
+
+    def on_part_data(data, start, end):
+        if state["target"] is not None:
+            state["target"].write(data[start:end])
+
+    def on_part_end():
+        state["target"] = None
+
+    parser = MultipartParser(boundary, {
+        'on_part_begin': on_part_begin,
+        'on_header_field': on_header_field,
+        'on_header_value': on_header_value,
+        'on_header_end': on_header_end,
+        'on_headers_finished': on_headers_finished,
+        'on_part_data': on_part_data,
+        'on_part_end': on_part_end,
+    })
+
+    received = 0
+    try:
+        async for chunk in stream:
+            received += len(chunk)
+            # Other fields must not be a way around the limit either
+            if received > max_bytes + MULTIPART_OVERHEAD_BYTES:
+                raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+            parser.write(chunk)
+        parser.finalize()
+    except UploadError:
+        if state["upload"] is not None:
+            state["upload"].close()
+        raise
+    except Exception as e:
+        if state["upload"] is not None:
+            state["upload"].close()
+        raise UploadError(f"Malformed multipart body: {e}")
+
+    if state["upload"] is None:
+        raise UploadError(f"No '{field}' file in the upload")
+    return state["upload"]
@@ -0,0 +1,43 @@
+"""
+Adaptive Waifu2x upscale planning.
+
+Instead of a fixed 4x for every input, the scale is picked per image so that the
+upscaled raster stays within a pixel budget: a small icon still gets the full
+4x, a large photo gets 2x or is passed to VTracer as-is.
+"""
+import os
+from typing import Any, Dict
+
+# === CONFIG ===
+# Default budget: a 4096x4096 raster (what a 1024 px image becomes at 4x)
+UPSCALE_PIXEL_BUDGET = int(os.getenv('UPSCALE_PIXEL_BUDGET', str(4096 * 4096)))
+
+# Scales waifu2x-ncnn-vulkan is asked for, largest first
+CANDIDATE_SCALES = (4, 2, 1)
+
+
+def plan_upscale(width: int, height: int, max_scale: int = 4,
+                 pixel_budget: int = UPSCALE_PIXEL_BUDGET) -> Dict[str, Any]:
+    """Pick the largest scale (4, 2 or 1) whose output fits the pixel budget"""
+    input_pixels = width * height
+    scale = 1
+    for candidate in CANDIDATE_SCALES:
+        if candidate <= max_scale and input_pixels * candidate * candidate <= pixel_budget:
+            scale = candidate
+            break
+
+    if scale == 1:
+        reason = "disabled" if max_scale <= 1 else "input already fills the pixel budget"
+    elif scale < max_scale:
+        reason = "reduced to fit the pixel budget"
+    else:
+        reason = "full scale fits the pixel budget"
+
+    return {
+        "scale": scale,
+        "skip_waifu2x": scale == 1,
+        "reason": reason,
+        "input_size": [width, height],
+        "output_size": [width * scale, height * scale],
+        "pixel_budget": pixel_budget,
+    }
@@ -0,0 +1,267 @@
+"""
+Pooled, hedged client for the upstream vectorization service.
+
+One long-lived httpx.AsyncClient keeps connections to the upstream warm
+(HTTP/2 when the h2 package is installed). Every call is guarded by a circuit
+breaker, and a call that runs past the recent p95 latency is hedged: either a
+backup upstream attempt or a local fallback races the original and the first
+success wins. While the breaker is open, calls go straight to the fallback (or
+fail fast when there is none).
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+
+try:
+    import h2  # noqa: F401  (presence enables HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# === CONFIG ===
+UPSTREAM_TIMEOUT = float(os.getenv('UPSTREAM_TIMEOUT', '30'))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv('UPSTREAM_MAX_CONNECTIONS', '20'))
+# 'retry' fires a second upstream attempt, 'local' races the local fallback, 'off' disables hedging
+UPSTREAM_HEDGE = os.getenv('UPSTREAM_HEDGE', 'retry').lower()
+UPSTREAM_HEDGE_MIN_MS = int(os.getenv('UPSTREAM_HEDGE_MIN_MS', '500'))
+# Hedge delay used until enough latencies have been observed
+UPSTREAM_HEDGE_DEFAULT_MS = int(os.getenv('UPSTREAM_HEDGE_DEFAULT_MS', '10000'))
+UPSTREAM_BREAKER_FAILURES = int(os.getenv('UPSTREAM_BREAKER_FAILURES', '5'))
+UPSTREAM_BREAKER_RESET_SEC = float(os.getenv('UPSTREAM_BREAKER_RESET_SEC', '30'))
+
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+
+LocalFallback = Callable[[], Awaitable[str]]
+# Builds the multipart files for one attempt (each attempt needs its own readers)
+FilesFactory = Callable[[], Dict[str, Any]]
+
+
+class UpstreamError(Exception):
+    """The upstream answered, but not with a usable result"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(f"{status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+class UpstreamUnavailable(Exception):
+    """The circuit breaker is open and no fallback is configured"""
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures, lets one probe through after a cool-down"""
+
+    def __init__(self, failure_threshold: int = UPSTREAM_BREAKER_FAILURES,
+                 reset_timeout: float = UPSTREAM_BREAKER_RESET_SEC):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Whether a request may go upstream right now"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def release(self):
+        """Give up a probe that ended without telling anything about the upstream"""
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning(f"Upstream circuit opened after {self.failures} consecutive failures")
+            self.opened_at = time.monotonic()
+
+
+class HedgedUpstreamClient:
+    """POSTs multipart uploads to one upstream URL with pooling, breaker and hedging"""
+
+    def __init__(self, url: str, headers: Optional[Dict[str, str]] = None, timeout: float = UPSTREAM_TIMEOUT,
+                 max_connections: int = UPSTREAM_MAX_CONNECTIONS, hedge: str = UPSTREAM_HEDGE):
+        self.url = url
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.hedge = hedge
+        self.breaker = CircuitBreaker()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._counters = {
+            "requests": 0,
+            "upstream_ok": 0,
+            "upstream_errors": 0,
+            "hedges": 0,
+            "hedge_wins": 0,
+            "fallbacks": 0,
+            "short_circuited": 0,
+        }
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=60
+                ),
+                headers=self.headers
+            )
+        return self._client
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait before hedging: the recent p95, or a default until warmed up"""
+        if len(self._latencies) < MIN_LATENCY_SAMPLES:
+            delay_ms = UPSTREAM_HEDGE_DEFAULT_MS
+        else:
+            samples = sorted(self._latencies)
+            delay_ms = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return max(UPSTREAM_HEDGE_MIN_MS, delay_ms) / 1000
+
+    async def _attempt(self, make_files: FilesFactory) -> str:
+        """One upstream call; 5xx, transport errors and unusable replies count against the breaker"""
+        start = time.monotonic()
+        outcome = "failure"
+        try:
+            response = await self._get_client().post(self.url, files=make_files())
+            if response.status_code >= 500:
+                raise UpstreamError(response.status_code, response.text)
+            if response.status_code != 200:
+                # The upstream is healthy, the request itself was rejected
+                outcome = "success"
+                raise UpstreamError(response.status_code, response.text)
+
+            try:
+                result = response.json()
+            except ValueError:
+                raise UpstreamError(502, "Upstream returned invalid JSON")
+            if not isinstance(result, dict) or 'svg_content' not in result:
+                raise UpstreamError(502, "Upstream did not return SVG content")
+            outcome = "success"
+            self._latencies.append((time.monotonic() - start) * 1000)
+            self._counters["upstream_ok"] += 1
+            return result['svg_content']
+        except asyncio.CancelledError:
+            # Lost a hedge race (or the caller went away): it took at least this long,
+            # and leaving it out would bias the p95 towards the fast calls
+            outcome = "cancelled"
+            self._latencies.append((time.monotonic() - start) * 1000)
+            raise
+        finally:
+            if outcome == "success":
+                self.breaker.record_success()
+            elif outcome == "cancelled":
+                self.breaker.release()
+            else:
+                self._counters["upstream_errors"] += 1
+                self.breaker.record_failure()
+
+    async def _fallback(self, local_fallback: LocalFallback) -> str:
+        self._counters["fallbacks"] += 1
+        return await local_fallback()
+
+    async def vectorize(self, make_files: FilesFactory,
+                        local_fallback: Optional[LocalFallback] = None) -> Tuple[str, str]:
+        """Return (svg_content, source) where source is 'upstream', 'hedge' or 'local'"""
+        self._counters["requests"] += 1
+        try:
+            return await self._vectorize(make_files, local_fallback)
+        except (httpx.RequestError, UpstreamError) as e:
+            # Rejected requests (4xx) are the caller's problem; outages fall back locally
+            if local_fallback is None or (isinstance(e, UpstreamError) and e.status_code < 500):
+                raise
+            logger.warning(f"Upstream failed ({e}), using local fallback")
+            return await self._fallback(local_fallback), "local"
+
+    async def _vectorize(self, make_files: FilesFactory,
+                         local_fallback: Optional[LocalFallback]) -> Tuple[str, str]:
+        if not self.breaker.allow():
+            self._counters["short_circuited"] += 1
+            if local_fallback is None:
+                raise UpstreamUnavailable("Vectorization service is temporarily unavailable")
+            logger.info("Upstream circuit open, using local fallback")
+            return await self._fallback(local_fallback), "local"
+
+        primary = asyncio.create_task(self._attempt(make_files))
+        hedge_kind = self.hedge if self.hedge != 'local' or local_fallback else 'off'
+        if hedge_kind == 'off':
+            return await primary, "upstream"
+
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay())
+        if done:
+            return primary.result(), "upstream"
+
+        # Primary is slower than usual: race a backup against it
+        self._counters["hedges"] += 1
+        logger.info(f"Upstream slower than {self.hedge_delay():.2f}s, hedging with {hedge_kind}")
+        if hedge_kind == 'local':
+            backup = asyncio.create_task(self._fallback(local_fallback))
+        else:
+            backup = asyncio.create_task(self._attempt(make_files))
+        sources = {primary: "upstream", backup: "local" if hedge_kind == 'local' else "hedge"}
+
+        pending = {primary, backup}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self._counters["hedge_wins"] += 1
+                        return task.result(), sources[task]
+                    # Prefer reporting the original call's error
+                    if error is None or task is primary:
+                        error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters, latency and breaker state for health endpoints"""
+        samples = sorted(self._latencies)
+        return {
+            **self._counters,
+            "breaker": self.breaker.state,
+            "http2": HTTP2_AVAILABLE,
+            "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 1) if samples else 0.0,
+            "hedge_delay_ms": round(self.hedge_delay() * 1000),
+        }
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
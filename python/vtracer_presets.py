@@ -0,0 +1,154 @@
+"""
+Named VTracer parameter presets.
+
+Every entry point (runner, Flask API, API proxy fallback and the CLI script)
+reads its tracing settings from here instead of carrying its own copy.
+`illustration` is the original anime-art tuning. `auto` picks a preset from the
+cheap thumbnail statistics of image_analysis, steering photos and very large
+inputs to coarser settings so trace time and SVG size stay bounded.
+"""
+import os
+import copy
+from typing import Any, Dict, Optional, Tuple
+
+# === CONFIG ===
+# Photos (or many-colour art) above this many input pixels are traced with the fast preset
+AUTO_FAST_PIXELS = int(os.getenv('AUTO_FAST_PIXELS', str(2048 * 2048)))
+# Flat art with at most this many colours is treated as a logo
+AUTO_LOGO_MAX_COLORS = int(os.getenv('AUTO_LOGO_MAX_COLORS', '16'))
+
+DEFAULT_PRESET = 'illustration'
+
+# max_scale caps the Waifu2x upscale (the anime models only help drawn content)
+PRESETS: Dict[str, Dict[str, Any]] = {
+    'illustration': {
+        'description': "Anime/cartoon art: smooth curves, fine colour layers",
+        'max_scale': 4,
+        'vtracer': dict(
+            colormode="color",
+            mode="spline",
+            filter_speckle=12,
+            color_precision=8,
+            layer_difference=16,
+            corner_threshold=55,
+            length_threshold=3.0,
+            max_iterations=15,
+            splice_threshold=55,
+            path_precision=3
+        ),
+    },
+    'logo': {
+        'description': "Flat colour logos and icons: few colours, crisp corners",
+        'max_scale': 4,
+        'vtracer': dict(
+            colormode="color",
+            mode="spline",
+            filter_speckle=8,
+            color_precision=6,
+            layer_difference=32,
+            corner_threshold=60,
+            length_threshold=4.0,
+            max_iterations=10,
+            splice_threshold=45,
+            path_precision=2
+        ),
+    },
+    'line-art': {
+        'description': "Black and white drawings, scans and text",
+        'max_scale': 4,
+        'vtracer': dict(
+            colormode="binary",
+            mode="spline",
+            filter_speckle=4,
+            corner_threshold=60,
+            length_threshold=4.0,
+            max_iterations=10,
+            splice_threshold=45,
+            path_precision=2
+        ),
+    },
+    'photo': {
+        'description': "Photographs: coarse colour layers, no upscaling",
+        'max_scale': 1,
+        'vtracer': dict(
+            colormode="color",
+            mode="spline",
+            filter_speckle=16,
+            color_precision=6,
+            layer_difference=48,
+            corner_threshold=60,
+            length_threshold=4.0,
+            max_iterations=10,
+            splice_threshold=45,
+            path_precision=2
+        ),
+    },
+    'fast': {
+        'description': "Quick low-detail trace: polygons, few layers",
+        'max_scale': 1,
+        'vtracer': dict(
+            colormode="color",
+            mode="polygon",
+            filter_speckle=16,
+            color_precision=5,
+            layer_difference=64,
+            corner_threshold=60,
+            length_threshold=4.0,
+            max_iterations=5,
+            splice_threshold=45,
+            path_precision=1
+        ),
+    },
+}
+
+PRESET_NAMES = tuple(PRESETS) + ('auto',)
+
+# Legacy job modes map onto presets
+MODE_PRESETS = {'bw': 'line-art', 'color': 'illustration', 'auto': 'auto'}
+
+
+def get_preset(name: str) -> Dict[str, Any]:
+    """A copy of a concrete preset, raising ValueError for unknown names"""
+    if name not in PRESETS:
+        raise ValueError(f"Unknown preset '{name}'. Must be one of: {', '.join(PRESET_NAMES)}")
+    return copy.deepcopy(PRESETS[name])
+
+
+def choose_preset(analysis: Dict[str, Any]) -> Tuple[str, str]:
+    """Pick a concrete preset from image statistics, returning (name, reason)"""
+    width, height = analysis["size"]
+    pixels = width * height
+
+    if analysis["near_blank"]:
+        return 'fast', "image is nearly blank"
+    if analysis["is_black_and_white"]:
+        return 'line-art', "strictly black and white"
+    if analysis["is_photo"]:
+        if pixels > AUTO_FAST_PIXELS:
+            return 'fast', "large photo"
+        return 'photo', "photographic colour distribution"
+    if analysis["distinct_colors"] <= AUTO_LOGO_MAX_COLORS:
+        return 'logo', f"{analysis['distinct_colors']} flat colours"
+    if pixels > AUTO_FAST_PIXELS and analysis["top_colors_coverage"] < 0.8:
+        return 'fast', "large image with many colours"
+    return 'illustration', "flat art with shading"
+
+
+def resolve_preset(name: Optional[str], analysis: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Turn a requested preset (or 'auto') into concrete settings plus what was chosen and why"""
+    name = name or DEFAULT_PRESET
+    if name == 'auto':
+        if analysis is None:
+            raise ValueError("The auto preset needs image analysis")
+        resolved, reason = choose_preset(analysis)
+    else:
+        resolved, reason = name, "requested"
+
+    preset = get_preset(resolved)
+    return {
+        "name": name,
+        "resolved": resolved,
+        "reason": reason,
+        "max_scale": preset["max_scale"],
+        "vtracer": preset["vtracer"],
+    }
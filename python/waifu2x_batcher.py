@@ -0,0 +1,155 @@
+"""
+Coalescing Waifu2x scheduler.
+
+Every waifu2x-ncnn-vulkan launch pays for model loading and GPU initialisation
+before any pixels are processed. Images that need the same scale/noise/model are
+collected for a short window and upscaled together by a single directory-mode
+invocation, then each output is routed back to the caller that submitted it.
+If a batch fails, its callers get their original image back (the same fallback
+the single-image path used).
+"""
+import os
+import uuid
+import shutil
+import logging
+import subprocess
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# === CONFIG ===
+WAIFU2X_BATCH_WINDOW_MS = int(os.getenv('WAIFU2X_BATCH_WINDOW_MS', '50'))
+WAIFU2X_BATCH_MAX = int(os.getenv('WAIFU2X_BATCH_MAX', '16'))
+WAIFU2X_TIMEOUT = int(os.getenv('WAIFU2X_TIMEOUT', '600'))
+
+BatchKey = Tuple[int, int, str]
+
+
+@dataclass
+class _UpscaleRequest:
+    image_data: bytes
+    done: threading.Event = field(default_factory=threading.Event)
+    result: Optional[bytes] = None
+
+
+@dataclass
+class _PendingBatch:
+    requests: List[_UpscaleRequest] = field(default_factory=list)
+    # Closes the batching window; cancelled if the batch fills up first
+    timer: Optional[threading.Timer] = None
+
+
+class Waifu2xBatcher:
+    """Groups concurrent upscale requests into shared Waifu2x invocations"""
+
+    def __init__(self, command: List[str], work_dir: str, window_ms: int = WAIFU2X_BATCH_WINDOW_MS,
+                 max_batch: int = WAIFU2X_BATCH_MAX, timeout: int = WAIFU2X_TIMEOUT):
+        self.command = command
+        self.work_dir = work_dir
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self.timeout = timeout
+        self.launches = 0
+        self.images = 0
+        self.fallbacks = 0
+        self._pending: Dict[BatchKey, _PendingBatch] = {}
+        self._lock = threading.Lock()
+        # One Waifu2x process at a time: they all share the same GPU
+        self._gpu = threading.Lock()
+
+        os.makedirs(self.work_dir, exist_ok=True)
+
+    def upscale(self, image_data: bytes, scale: int, noise: int, model: str) -> bytes:
+        """Upscale one image, blocking until the batch it joined has finished"""
+        key = (scale, noise, model)
+        request = _UpscaleRequest(image_data)
+
+        with self._lock:
+            batch = self._pending.setdefault(key, _PendingBatch())
+            batch.requests.append(request)
+            full = len(batch.requests) >= self.max_batch
+            if full:
+                del self._pending[key]
+                if batch.timer is not None:
+                    batch.timer.cancel()
+            elif batch.timer is None:
+                # Armed for this batch only, so it cannot cut short the window of a later one
+                batch.timer = threading.Timer(self.window, self._flush, args=(key, batch))
+                batch.timer.daemon = True
+                batch.timer.start()
+
+        if full:
+            self._run_batch(key, batch.requests)
+
+        request.done.wait()
+        return request.result
+
+    def _flush(self, key: BatchKey, batch: _PendingBatch):
+        """Run the batch this timer was armed for once its window closes (unless it already ran)"""
+        with self._lock:
+            if self._pending.get(key) is not batch:
+                return
+            del self._pending[key]
+        self._run_batch(key, batch.requests)
+
+    def _run_batch(self, key: BatchKey, batch: List[_UpscaleRequest]):
+        scale, noise, model = key
+        batch_dir = os.path.join(self.work_dir, f"batch_{uuid.uuid4().hex}")
+        input_dir = os.path.join(batch_dir, "in")
+        output_dir = os.path.join(batch_dir, "out")
+
+        try:
+            os.makedirs(input_dir)
+            os.makedirs(output_dir)
+            for index, request in enumerate(batch):
+                ext = 'jpg' if request.image_data.startswith(b'\xff\xd8\xff') else 'png'
+                with open(os.path.join(input_dir, f"{index}.{ext}"), 'wb') as f:
+                    f.write(request.image_data)
+
+            cmd = self.command + [
+                "-i", input_dir,
+                "-o", output_dir,
+                "-n", str(noise),
+                "-s", str(scale),
+                "-m", model,
+                "-f", "png"
+            ]
+
+            with self._gpu:
+                logger.info(f"Running Waifu2x on {len(batch)} image(s): {' '.join(cmd)}")
+                self.launches += 1
+                self.images += len(batch)
+                try:
+                    result = subprocess.run(cmd, capture_output=True, text=True, timeout=self.timeout)
+                    if result.returncode != 0:
+                        error_msg = result.stderr or result.stdout or "Unknown Waifu2x error"
+                        logger.error(f"Waifu2x failed: {error_msg}")
+                except subprocess.TimeoutExpired:
+                    logger.error("Waifu2x process timed out, using fallback")
+                except Exception as e:
+                    logger.error(f"Waifu2x execution error: {e}, using fallback")
+
+            for index, request in enumerate(batch):
+                output_path = os.path.join(output_dir, f"{index}.png")
+                if os.path.exists(output_path):
+                    with open(output_path, 'rb') as f:
+                        request.result = f.read()
+        finally:
+            for request in batch:
+                if request.result is None:
+                    # Fallback: use the original image instead of upscaling
+                    self.fallbacks += 1
+                    request.result = request.image_data
+                request.done.set()
+            shutil.rmtree(batch_dir, ignore_errors=True)
+
+    def stats(self) -> Dict[str, float]:
+        """Launch and coalescing counters for health/metrics endpoints"""
+        return {
+            "launches": self.launches,
+            "images": self.images,
+            "images_per_launch": round(self.images / self.launches, 2) if self.launches else 0.0,
+            "fallbacks": self.fallbacks,
+        }
@@ -0,0 +1,118 @@
+"""
+Pool-wide view of which API worker processes are busy.
+
+The serving master creates the table before forking, so every worker inherits
+the same shared memory. Each worker claims a slot for its pid and counts the
+jobs it is running there; the master frees the slot when the worker exits
+(including crashes and the old generation after a graceful reload), so a
+dead worker can never be left marked busy. Any worker can then answer "how
+many of the N workers are busy" for /health and /metrics.
+
+Without a serving master (the development server) a one-slot table is made on
+first use, which reports the single process.
+"""
+import os
+import multiprocessing
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Per slot: pid (0 = free), jobs running now, jobs finished
+_FIELDS = 3
+_PID, _ACTIVE, _DONE = range(_FIELDS)
+
+
+class WorkerSlots:
+    """Fixed-size table in shared memory with one row per live worker process"""
+
+    def __init__(self, size: int, workers: int = 1):
+        self.size = max(1, size)
+        # How many workers the pool is meant to run, for splitting per-machine budgets between them
+        self.workers = max(1, workers)
+        self._cells = multiprocessing.RawArray('q', self.size * _FIELDS)
+        self._lock = multiprocessing.Lock()
+        self.slot: Optional[int] = None
+
+    def claim(self, pid: Optional[int] = None) -> Optional[int]:
+        """Take a free slot for this process (None when the table is full)"""
+        pid = pid or os.getpid()
+        with self._lock:
+            for index in range(self.size):
+                base = index * _FIELDS
+                if self._cells[base + _PID] in (0, pid):
+                    self._cells[base + _PID] = pid
+                    self._cells[base + _ACTIVE] = 0
+                    self._cells[base + _DONE] = 0
+                    self.slot = index
+                    return index
+        return None
+
+    def release(self, pid: int):
+        """Free the slot of a worker that has exited"""
+        with self._lock:
+            for index in range(self.size):
+                base = index * _FIELDS
+                if self._cells[base + _PID] == pid:
+                    self._cells[base + _PID] = 0
+                    self._cells[base + _ACTIVE] = 0
+
+    def job_started(self):
+        self._add(_ACTIVE, 1)
+
+    def job_finished(self):
+        self._add(_ACTIVE, -1)
+        self._add(_DONE, 1)
+
+    @contextmanager
+    def job(self):
+        """Count the block as a job running in this worker"""
+        self.job_started()
+        try:
+            yield
+        finally:
+            self.job_finished()
+
+    def _add(self, field: int, amount: int):
+        if self.slot is None:
+            return
+        with self._lock:
+            self._cells[self.slot * _FIELDS + field] += amount
+
+    def is_leader(self) -> bool:
+        """True in the live worker with the lowest slot, for work only one process should do"""
+        if self.slot is None:
+            return False
+        with self._lock:
+            for index in range(self.slot):
+                if self._cells[index * _FIELDS + _PID]:
+                    return False
+        return True
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            rows = [tuple(self._cells[index * _FIELDS:(index + 1) * _FIELDS]) for index in range(self.size)]
+        live = [row for row in rows if row[_PID]]
+        return {
+            "workers": len(live),
+            "busy": sum(1 for row in live if row[_ACTIVE] > 0),
+            "active_jobs": sum(row[_ACTIVE] for row in live),
+            "jobs": sum(row[_DONE] for row in live),
+        }
+
+
+_worker_slots: Optional[WorkerSlots] = None
+
+
+def create_worker_slots(size: int, workers: int) -> WorkerSlots:
+    """Make the shared table in the serving master, before any worker is forked"""
+    global _worker_slots
+    _worker_slots = WorkerSlots(size, workers)
+    return _worker_slots
+
+
+def get_worker_slots() -> WorkerSlots:
+    """The inherited table, or a single-process one claimed by this process"""
+    global _worker_slots
+    if _worker_slots is None:
+        _worker_slots = WorkerSlots(1)
+        _worker_slots.claim()
+    return _worker_slots
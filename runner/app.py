@@ -1,26 +1,39 @@
 import os
 import sys
-import uuid
+import json
 import time
-import subprocess
-import requests
-import shutil
+import shlex
+import asyncio
 import logging
 from pathlib import Path
-from typing import Optional, Dict, Any
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 
+# Imported before anything heavy so the import phase is part of the startup timings
+from startup import get_startup_tracker, make_prewarm_image, RUNNER_PREWARM
+
 from fastapi import FastAPI, HTTPException, Depends, Header
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, HttpUrl
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, HttpUrl, Field
 from dotenv import load_dotenv
 
 # Add parent directory to path to import existing vectorization modules
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'python'))
 
 try:
-    import vtracer
-    from PIL import Image
+    import memory_trace
+    import tiled_trace
+    from svg_cache import get_svg_cache, make_cache_key
+    from image_fetcher import get_image_fetcher
+    from waifu2x_batcher import Waifu2xBatcher
+    from upscale_planner import plan_upscale
+    from preprocess import decode_image, open_header, load_image
+    from vtracer_presets import resolve_preset, get_preset, PRESET_NAMES, MODE_PRESETS
+    from metrics import get_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+    from output_store import Janitor, JANITOR_ENABLED
+    from admission import get_admission_controller, estimate_cost
 except ImportError as e:
     print(f"Missing required dependencies: {e}")
     print("Install with: pip install vtracer Pillow")
@@ -36,8 +49,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Import idle guard
-from idle_guard import get_idle_guard
+# Import idle guard and job queue
+from idle_guard import get_idle_guard, RUNNER_DRAIN_TIMEOUT_SEC
+from job_queue import JobQueue, Job, QueueFullError, QueueClosedError
+from job_profiler import JobProfiler
+from job_scheduler import FairScheduler
+from cost_model import get_cost_model
+from result_uploader import get_result_uploader, COMPRESSIONS
+
+# Process start -> imports -> init -> startup -> prewarm -> ready
+startup_tracker = get_startup_tracker()
+startup_tracker.mark('imports')
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -47,10 +69,30 @@ app = FastAPI(
 )
 
 # Pydantic models
+class SimplifyOptions(BaseModel):
+    enabled: bool = True
+    tolerance: float = Field(0.5, ge=0, le=10)  # Max deviation in output pixels
+    precision: Optional[int] = Field(None, ge=0, le=6)  # Decimal places, derived from tolerance if unset
+    merge_fills: bool = True
+
+class OutputTarget(BaseModel):
+    url: HttpUrl  # Signed PUT URL, or a resumable session URI when resumable is set
+    headers: Dict[str, str] = Field(default_factory=dict)  # Sent with every PUT, e.g. headers the signature covers
+    resumable: bool = False  # Upload in Content-Range chunks and resume after failures
+    compression: Optional[str] = None  # 'gzip' or 'none', RESULT_UPLOAD_COMPRESSION if unset
+
 class VectorizeRequest(BaseModel):
     input_url: HttpUrl
-    mode: str  # 'bw' or 'color'
+    mode: str  # 'bw', 'color' or 'auto' (picked from image analysis)
     filename: Optional[str] = None
+    preset: Optional[str] = None  # Overrides the mode: logo, line-art, illustration, photo, fast or auto
+    simplify: Optional[SimplifyOptions] = None
+    output: Optional[OutputTarget] = None  # Where to PUT the SVG; the job directory if unset
+    tier: Optional[str] = None  # Plan tier (free, pro, ultimate) that sets the job's scheduling weight
+    user: Optional[str] = None  # Jobs of one user share that user's fair share of the workers
+
+class BatchVectorizeRequest(BaseModel):
+    items: List[VectorizeRequest] = Field(..., min_length=1)
 
 class VectorizeResponse(BaseModel):
     job_id: str
@@ -58,6 +100,17 @@ class VectorizeResponse(BaseModel):
     output: Dict[str, str]
     duration_ms: int
 
+class ProfilingSettings(BaseModel):
+    enabled: Optional[bool] = None
+    sample_rate: Optional[float] = Field(None, ge=0, le=1)
+    slow_job_sec: Optional[float] = Field(None, ge=0)  # 0 disables slow-job capture
+
+class JobAcceptedResponse(BaseModel):
+    job_id: str
+    status: str
+    queued: bool
+    status_url: str
+
 # Configuration
 RUNNER_PORT = int(os.getenv('RUNNER_PORT', '8787'))
 WORK_DIR = Path(os.getenv('WORK_DIR', 'C:/vh_runner/tmp'))
@@ -66,17 +119,78 @@ RESULT_UPLOAD_MODE = os.getenv('RESULT_UPLOAD_MODE', 'local_path')
 RESULT_UPLOAD_SIGNED_PUT_URL = os.getenv('RESULT_UPLOAD_SIGNED_PUT_URL', '')
 RESULT_NAMING = os.getenv('RESULT_NAMING', '{uuid}.svg')
 RUNNER_SHARED_TOKEN = os.getenv('RUNNER_SHARED_TOKEN', 'change-me-to-strong-secret-key')
+MAX_INPUT_BYTES = int(os.getenv('MAX_INPUT_MB', '20')) * 1024 * 1024
+
+# Tile-parallel tracing for large upscaled rasters
+VTRACER_TILING = os.getenv('VTRACER_TILING', 'true').lower() == 'true'
+
+# SVG post-processing defaults (overridable per job via the "simplify" field)
+# Off by default: on the detailed traces that have the most to gain it still costs a sizeable share of the trace
+SVG_SIMPLIFY = os.getenv('SVG_SIMPLIFY', 'false').lower() == 'true'
+SVG_SIMPLIFY_TOLERANCE = float(os.getenv('SVG_SIMPLIFY_TOLERANCE', '0.5'))
+SVG_MERGE_FILLS = os.getenv('SVG_MERGE_FILLS', 'true').lower() == 'true'
+
+# Job queue configuration
+RUNNER_WORKERS = int(os.getenv('RUNNER_WORKERS', '2'))
+RUNNER_MAX_QUEUE = int(os.getenv('RUNNER_MAX_QUEUE', '100'))
+JOB_RETENTION_SEC = int(os.getenv('JOB_RETENTION_SEC', '3600'))
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '50'))
+# Queued inputs' headers are read ahead, so the scheduler knows each job's predicted cost
+COST_PREFETCH_WORKERS = int(os.getenv('COST_PREFETCH_WORKERS', '0')) or RUNNER_WORKERS * 2
+# Leading bytes of a queued input fetched to read its dimensions; the full body is downloaded at dequeue
+COST_HEAD_BYTES = int(os.getenv('COST_HEAD_BYTES', str(64 * 1024)))
 
 # Waifu2x configuration
 WAIFU2X_DIR = os.getenv('WAIFU2X_DIR', 'C:/waifu2x-ncnn-vulkan-20230413-win64')
 WAIFU2X_SCALE = int(os.getenv('WAIFU2X_SCALE', '4'))
 WAIFU2X_NOISE = int(os.getenv('WAIFU2X_NOISE', '3'))
 WAIFU2X_MODEL = os.getenv('WAIFU2X_MODEL', 'models-upconv_7_anime_style_art_rgb')
+# Upscaled rasters are kept under this many pixels (WAIFU2X_SCALE is the maximum scale)
+UPSCALE_PIXEL_BUDGET = int(os.getenv('UPSCALE_PIXEL_BUDGET', str(4096 * 4096)))
+# Optional command override, e.g. "python ../python/fake_waifu2x.py" on machines without a GPU
+WAIFU2X_CMD = os.getenv('WAIFU2X_CMD', '')
 
 # Create work directory
 WORK_DIR.mkdir(parents=True, exist_ok=True)
 logger.info(f"Work directory: {WORK_DIR}")
 
+# Content-addressed result cache, kept next to (not inside) the work directory
+SVG_CACHE_DIR = os.getenv('SVG_CACHE_DIR', str(WORK_DIR.parent / 'svg_cache'))
+svg_cache = get_svg_cache(SVG_CACHE_DIR)
+
+# Shared keep-alive connection pool for input downloads
+image_fetcher = get_image_fetcher()
+
+# Stage timings, queue depth and error counts served on /metrics
+metrics = get_metrics()
+
+# Jobs start decoding only once their estimated memory and CPU fit the budget; the bounded
+# job queue (429 when full) is where everything else waits
+admission = get_admission_controller(max_waiting=0)
+admission.export_metrics(metrics)
+
+# Learns compute time per job from finished jobs; samples persist across scale-to-zero restarts
+cost_model = get_cost_model(WORK_DIR / "_cost_model" / "samples.jsonl")
+cost_model.export_metrics(metrics)
+queue_wait_seconds = metrics.registry.histogram(
+    'vectorizer_queue_wait_seconds', "Time from submit to start, by plan tier", ('tier',)
+)
+
+def create_waifu2x_batcher() -> Optional[Waifu2xBatcher]:
+    """Build the coalescing Waifu2x scheduler, or None when Waifu2x is not installed"""
+    if WAIFU2X_CMD:
+        command = shlex.split(WAIFU2X_CMD, posix=os.name != 'nt')
+    else:
+        waifu2x_exe = Path(WAIFU2X_DIR) / "waifu2x-ncnn-vulkan.exe"
+        if not waifu2x_exe.exists():
+            logger.warning(f"Waifu2x not found at {waifu2x_exe}, images will not be upscaled")
+            return None
+        command = [str(waifu2x_exe)]
+    
+    return Waifu2xBatcher(command, str(WORK_DIR / "_waifu2x"))
+
+waifu2x_batcher = create_waifu2x_batcher()
+
 def verify_token(authorization: str = Header(None)) -> bool:
     """Verify the authorization token"""
     if not authorization:
@@ -91,93 +205,134 @@ def verify_token(authorization: str = Header(None)) -> bool:
     
     return True
 
-def download_image(url: str, save_path: Path) -> bool:
-    """Download image from URL"""
+def reject_if_draining():
+    """503 for new work once the runner has decided to shut down"""
+    if get_idle_guard().draining:
+        raise HTTPException(status_code=503, detail="Runner is shutting down")
+
+def download_image(url: str) -> bytes:
+    """Download image from URL into memory through the pooled fetcher"""
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=30, stream=True)
-        response.raise_for_status()
-        
-        # Check content type
-        content_type = response.headers.get('content-type', '').lower()
-        if not any(img_type in content_type for img_type in ['image/jpeg', 'image/png', 'image/jpg']):
-            raise ValueError(f"Invalid content type: {content_type}")
-        
-        with open(save_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        
-        return True
+        return image_fetcher.fetch(url, max_bytes=MAX_INPUT_BYTES)
     except Exception as e:
         logger.error(f"Failed to download image: {e}")
         raise
 
-def run_waifu2x(input_path: Path, output_path: Path) -> bool:
-    """Run Waifu2x upscaling"""
-    waifu2x_exe = Path(WAIFU2X_DIR) / "waifu2x-ncnn-vulkan.exe"
-    
-    if not waifu2x_exe.exists():
-        logger.warning(f"Waifu2x not found at {waifu2x_exe}, copying original file")
-        shutil.copy2(input_path, output_path)
-        return True
-    
-    cmd = [
-        str(waifu2x_exe),
-        "-i", str(input_path),
-        "-o", str(output_path),
-        "-n", str(WAIFU2X_NOISE),
-        "-s", str(WAIFU2X_SCALE),
-        "-m", WAIFU2X_MODEL
-    ]
-    
-    logger.info(f"Running Waifu2x: {' '.join(cmd)}")
-    
+def validate_request(request: VectorizeRequest):
+    """Reject unknown modes and presets before a job is queued"""
+    if request.mode not in MODE_PRESETS:
+        raise HTTPException(status_code=400, detail="Invalid mode. Must be 'bw', 'color' or 'auto'")
+    if request.preset is not None and request.preset not in PRESET_NAMES:
+        raise HTTPException(status_code=400, detail=f"Invalid preset. Must be one of: {', '.join(PRESET_NAMES)}")
+    if request.output and request.output.compression not in (None,) + COMPRESSIONS:
+        raise HTTPException(status_code=400, detail=f"Invalid compression. Must be one of: {', '.join(COMPRESSIONS)}")
+
+def upload_target(request: VectorizeRequest) -> Optional[OutputTarget]:
+    """The job's own upload target, else the global signed PUT URL when that mode is configured"""
+    if request.output:
+        return request.output
+    if RESULT_UPLOAD_MODE == 'signed_put' and RESULT_UPLOAD_SIGNED_PUT_URL:
+        # The raw SVG, as this mode always sent it, so the configured URL's signature still matches
+        return OutputTarget(url=RESULT_UPLOAD_SIGNED_PUT_URL, compression='none')
+    return None
+
+def job_preset(request: VectorizeRequest, analysis: Dict[str, Any]) -> Dict[str, Any]:
+    """Resolve the job's preset (explicit, or derived from the legacy mode)"""
+    preset = resolve_preset(request.preset or MODE_PRESETS[request.mode], analysis)
+    # Presets can lower the upscale, never raise it above the configured scale
+    preset["max_scale"] = min(preset["max_scale"], WAIFU2X_SCALE)
+    return preset
+
+def planned_scale(request: VectorizeRequest, width: int, height: int) -> int:
+    """The upscale a job will get, known from the header before its preset is resolved"""
+    preset_name = request.preset or MODE_PRESETS[request.mode]
+    # 'auto' is only resolved after decoding, so assume the largest scale
+    max_scale = WAIFU2X_SCALE if preset_name == 'auto' else min(get_preset(preset_name)["max_scale"], WAIFU2X_SCALE)
+    return plan_upscale(width, height, max_scale, UPSCALE_PIXEL_BUDGET)["scale"] if waifu2x_batcher else 1
+
+def estimate_job_cost(request: VectorizeRequest, width: int, height: int):
+    """Peak memory and cores of a job, from the header size and the upscale it will get"""
+    return estimate_cost(width, height, planned_scale(request, width, height), VTRACER_TILING)
+
+def cost_features(request: VectorizeRequest, width: int, height: int) -> Dict[str, Any]:
+    """What the cost model predicts a job's compute time from: only what the header tells"""
+    scale = planned_scale(request, width, height)
+    return {
+        "source_pixels": width * height,
+        "traced_pixels": width * height * scale * scale,
+        # The colour count needs a decode, which queued jobs do not get
+        "colors": None,
+        "preset": request.preset or MODE_PRESETS[request.mode],
+    }
+
+def predict_job(job: Job):
+    """Predict a queued job's compute seconds from its input's header"""
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
-        if result.returncode != 0:
-            error_msg = result.stderr or result.stdout or "Unknown Waifu2x error"
-            logger.error(f"Waifu2x failed: {error_msg}")
-            # Fallback: copy original file
-            shutil.copy2(input_path, output_path)
-            logger.info("Fallback: copied original file instead of upscaling")
-        
-        return True
-    except subprocess.TimeoutExpired:
-        logger.error("Waifu2x process timed out, using fallback")
-        shutil.copy2(input_path, output_path)
-        return True
+        # Batch items arrive with their input; everything else only has its first bytes fetched
+        head = job.context.get('image_data') or image_fetcher.fetch_head(str(job.payload.input_url), COST_HEAD_BYTES)
+        with open_header(head) as header:
+            width, height = header.size
+        job.context['predicted_seconds'] = cost_model.predict(cost_features(job.payload, width, height))
     except Exception as e:
-        logger.error(f"Waifu2x execution error: {e}, using fallback")
-        shutil.copy2(input_path, output_path)
-        return True
+        # An unreadable input fails in process_job as usual; until then it is scheduled at the default cost
+        logger.warning(f"Could not predict the cost of job {job.job_id}: {e}")
 
-def run_vtracer(input_path: Path, output_path: Path, mode: str = 'color') -> bool:
-    """Run VTracer vectorization"""
+def start_prefetch(job: Job):
+    job.context['prefetch'] = prefetch_pool.submit(predict_job, job)
+
+@contextmanager
+def job_stage(job: Job, name: str):
+    """Time a block as a pipeline stage, also adding it to the job's own stage timings"""
+    started = time.perf_counter()
     try:
-        logger.info(f"Running VTracer: {input_path} -> {output_path} (mode: {mode})")
-        
-        # Determine color mode based on input mode
-        colormode = "bw" if mode == "bw" else "color"
+        with metrics.stage(name):
+            yield
+    finally:
+        stages = job.context.setdefault('stages', {})
+        stages[name] = stages.get(name, 0.0) + time.perf_counter() - started
+
+def queue_retry_after() -> int:
+    """Seconds until the jobs ahead should have drained, from how fast jobs have been finishing"""
+    stats = job_queue.stats()
+    return admission.retry_after(stats["queued"] + stats["running"])
+
+def cache_params(preset: Dict[str, Any]) -> Dict[str, Any]:
+    """Every setting that affects the SVG output, used for the result cache key"""
+    return {
+        "preset": preset["resolved"],
+        "max_scale": preset["max_scale"],
+        "pixel_budget": UPSCALE_PIXEL_BUDGET,
+        "noise": WAIFU2X_NOISE,
+        "model": WAIFU2X_MODEL,
+        "vtracer": preset["vtracer"]
+    }
+
+def upscale_image_bytes(image_data: bytes, scale: int) -> bytes:
+    """Upscale image bytes with Waifu2x, sharing one launch with other queued images"""
+    if scale <= 1:
+        logger.info("Upscale plan is 1x, skipping Waifu2x")
+        return image_data
+    
+    if waifu2x_batcher is None:
+        logger.warning(f"Waifu2x not found at {WAIFU2X_DIR}, using original image")
+        metrics.waifu2x_fallbacks.labels('unavailable').inc()
+        return image_data
+    
+    upscaled = waifu2x_batcher.upscale(image_data, scale, WAIFU2X_NOISE, WAIFU2X_MODEL)
+    if upscaled is image_data:
+        # The batcher hands back the original bytes when Waifu2x failed
+        metrics.waifu2x_fallbacks.labels('failed').inc()
+    return upscaled
+
+def run_vtracer(image_data: bytes, preset: Dict[str, Any]) -> str:
+    """Run VTracer vectorization in memory, returning the SVG document"""
+    try:
+        logger.info(f"Running VTracer on {len(image_data)} bytes (preset: {preset['resolved']})")
         
-        vtracer.convert_image_to_svg_py(
-            str(input_path),
-            str(output_path),
-            colormode=colormode,
-            mode="spline",
-            filter_speckle=12,
-            color_precision=8,
-            layer_difference=16,
-            corner_threshold=55,
-            length_threshold=3.0,
-            max_iterations=15,
-            splice_threshold=55,
-            path_precision=3
-        )
+        svg = memory_trace.trace_bytes(image_data, preset["vtracer"], tiling=VTRACER_TILING)
         
-        logger.info(f"VTracer completed successfully: {output_path}")
-        return True
+        logger.info(f"VTracer completed successfully ({len(svg)} bytes of SVG)")
+        return svg
     except Exception as e:
         logger.error(f"VTracer error: {e}")
         raise RuntimeError(f"VTracer failed: {e}")
@@ -191,15 +346,247 @@ def cleanup_file(file_path: Path):
     except Exception as e:
         logger.warning(f"Failed to cleanup file {file_path}: {e}")
 
+def process_job(job: Job) -> Dict[str, Any]:
+    """Run the full download -> Waifu2x -> VTracer pipeline for a queued job"""
+    request: VectorizeRequest = job.payload
+    job_id = job.job_id
+    start_time = time.time()
+    
+    logger.info(f"Starting vectorization job {job_id}")
+    logger.info(f"Input URL: {request.input_url}")
+    logger.info(f"Mode: {request.mode}")
+    queue_seconds = max(0.0, (job.started_at or start_time) - job.created_at)
+    metrics.stage_seconds.labels('queue').observe(queue_seconds)
+    queue_wait_seconds.labels(job_scheduler.tier_of(job)).observe(queue_seconds)
+    
+    output_file = None
+    share = None
+    
+    try:
+        # Only the header was read while queued; a prediction still in flight is no longer needed
+        job.context.pop('prefetch').cancel()
+        image_data = job.context.pop('image_data', None)
+        if image_data is None:
+            with job_stage(job, 'download'):
+                image_data = download_image(str(request.input_url))
+        
+        # numpy-backed stages, loaded by the prewarm rather than at import time
+        from image_analysis import analyze_image
+        from svg_simplify import simplify_svg
+        
+        # Pixel limit and cost estimate from the header, then wait for budget before decoding
+        with job_stage(job, 'verify'):
+            header = open_header(image_data)
+        cost = estimate_job_cost(request, header.width, header.height)
+        with job_stage(job, 'admission'):
+            share = admission.acquire(cost)
+        
+        # Decode once: verifies the image, classifies it and fingerprints its pixels
+        cache_key = None
+        with job_stage(job, 'verify'), load_image(header) as img:
+            logger.info(f"Image dimensions: {img.size}")
+            metrics.input_pixels.observe(img.width * img.height)
+            analysis = analyze_image(img)
+            preset = job_preset(request, analysis)
+            logger.info(f"Image kind: {analysis['kind']}, preset: {preset['resolved']} ({preset['reason']})")
+            upscale_plan = plan_upscale(img.width, img.height, preset["max_scale"], UPSCALE_PIXEL_BUDGET)
+            if svg_cache:
+                cache_key = make_cache_key(img, cache_params(preset))
+        
+        svg = svg_cache.get(cache_key) if cache_key else None
+        cached = svg is not None
+        if cached:
+            logger.info(f"Cache hit for job {job_id} ({cache_key[:12]})")
+        else:
+            # Step 1: Run Waifu2x upscaling at the planned scale
+            logger.info(f"Starting Waifu2x upscaling ({upscale_plan['scale']}x: {upscale_plan['reason']})...")
+            with job_stage(job, 'upscale'):
+                upscaled_data = upscale_image_bytes(image_data, upscale_plan['scale'])
+            
+            # Step 2: Run VTracer vectorization
+            logger.info("Starting VTracer vectorization...")
+            with job_stage(job, 'trace'):
+                svg = run_vtracer(upscaled_data, preset)
+            
+            # A trace of the original bytes after a Waifu2x fallback does not match the key's scale
+            upscale_fell_back = upscale_plan['scale'] > 1 and upscaled_data is image_data
+            if cache_key and not upscale_fell_back:
+                svg_cache.put(cache_key, svg)
+        
+        # Step 3: Simplify paths (the cache keeps the raw trace so options can differ per job)
+        simplify = request.simplify or SimplifyOptions(
+            enabled=SVG_SIMPLIFY,
+            tolerance=SVG_SIMPLIFY_TOLERANCE,
+            merge_fills=SVG_MERGE_FILLS
+        )
+        simplify_stats = None
+        if simplify.enabled:
+            with job_stage(job, 'simplify'):
+                svg, simplify_stats = simplify_svg(svg, simplify.tolerance, simplify.precision, simplify.merge_fills)
+            logger.info(f"Simplified SVG: {simplify_stats['bytes_before']} -> {simplify_stats['bytes_after']} bytes, "
+                        f"{simplify_stats['nodes_before']} -> {simplify_stats['nodes_after']} nodes")
+        
+        # Learn from what the job actually cost (cache hits skip the expensive stages and would skew it)
+        predicted = job.context.get('predicted_seconds')
+        stages = job.context.get('stages', {})
+        actual = None
+        if not cached:
+            # The same header-only features the prediction had, so the model learns what it can use
+            actual = cost_model.observe(cost_features(request, header.width, header.height), stages, predicted)
+        
+        # Prepare response
+        svg_bytes = svg.encode('utf-8')
+        metrics.output_bytes.observe(len(svg_bytes))
+        outcome = 'cached' if cached else 'done'
+        target = upload_target(request)
+        if target:
+            # Hand the SVG to the upload pool; the job stays "uploading" while this worker moves on
+            upload = result_uploader.submit(job_id, svg_bytes, str(target.url), target.headers,
+                                            target.resumable, target.compression)
+            upload.add_done_callback(
+                lambda future: metrics.jobs.labels('failed' if future.exception() else outcome).inc()
+            )
+            job.context['upload'] = upload
+            output_info = {}
+        else:
+            with job_stage(job, 'upload'):
+                # Write the final SVG into the job directory and return its local path
+                job_dir = WORK_DIR / job_id
+                job_dir.mkdir(parents=True, exist_ok=True)
+                output_file = job_dir / RESULT_NAMING.format(uuid=job_id)
+                output_file.write_bytes(svg_bytes)
+                output_info = {"local_path": str(output_file)}
+            metrics.jobs.labels(outcome).inc()
+        
+        duration_ms = int((time.time() - start_time) * 1000)
+        logger.info(f"Vectorization job {job_id} completed successfully in {duration_ms}ms"
+                    f"{' (upload continues in the background)' if target else ''}")
+        
+        return {
+            "output": output_info,
+            "cached": cached,
+            "preset": {key: preset[key] for key in ("name", "resolved", "reason")},
+            "analysis": analysis,
+            "upscale": upscale_plan,
+            "simplify": simplify_stats,
+            "cost": {
+                "predicted_seconds": round(predicted, 3) if predicted is not None else None,
+                "actual_seconds": round(actual, 3) if actual is not None else None,
+                "stages_ms": {name: int(seconds * 1000) for name, seconds in stages.items()}
+            }
+        }
+        
+    except Exception as e:
+        # Cleanup on error
+        if output_file:
+            cleanup_file(output_file)
+        
+        logger.error(f"Vectorization job {job_id} failed: {e}")
+        metrics.jobs.labels('failed').inc()
+        metrics.error(e)
+        raise
+    finally:
+        if share is not None:
+            admission.release(share)
+
+# Uploads to per-job targets run here, off the job workers
+result_uploader = get_result_uploader()
+
+# cProfile/tracemalloc for opted-in jobs, sampled stacks for slow ones
+job_profiler = JobProfiler(WORK_DIR)
+
+# Fetches inputs of queued jobs and predicts their cost
+prefetch_pool = ThreadPoolExecutor(max_workers=COST_PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+# Cheapest predicted job first, weighted fair between users and plan tiers
+job_scheduler = FairScheduler()
+
+# Global job queue
+job_queue = JobQueue(
+    job_profiler.wrap(process_job),
+    workers=RUNNER_WORKERS,
+    max_queued=RUNNER_MAX_QUEUE,
+    retention_seconds=JOB_RETENTION_SEC,
+    scheduler=job_scheduler,
+    prepare=start_prefetch
+)
+metrics.jobs_queued.set_function(lambda: job_queue.stats()["queued"])
+metrics.jobs_in_flight.set_function(lambda: job_queue.stats()["running"])
+
+def job_in_progress(job_id: str) -> bool:
+    job = job_queue.get(job_id)
+    return job is not None and job.finished_at is None
+
+# Job directories (SVG, profiles) outlive their job by the status retention window, then get swept
+janitor = Janitor(
+    job_root=str(WORK_DIR),
+    job_dir_ttl=JOB_RETENTION_SEC,
+    keep_job=job_in_progress,
+    temp_dirs=[str(WORK_DIR), SVG_CACHE_DIR]
+)
+
+def pending_jobs() -> int:
+    stats = job_queue.stats()
+    return stats["queued"] + stats["running"] + stats["uploading"]
+
+# Queued and running jobs keep the runner alive past the idle timeout
+get_idle_guard().set_pending_probe(pending_jobs)
+idle_timeout_seconds = metrics.registry.gauge(
+    'vectorizer_idle_timeout_seconds', "Current idle timeout after adapting to recent traffic"
+)
+idle_timeout_seconds.set_function(lambda: get_idle_guard().current_timeout())
+
+startup_seconds = metrics.registry.gauge(
+    'vectorizer_startup_seconds', "Duration of each startup phase; total is process start to ready", ('phase',)
+)
+startup_seconds.set_function(lambda: startup_tracker.phases)
+runner_ready = metrics.registry.gauge('vectorizer_ready', "1 once startup and prewarm have finished")
+runner_ready.set_function(lambda: int(startup_tracker.ready))
+
+def prewarm_pipeline():
+    """Push a tiny image through every stage so the first real job does not pay for loading them"""
+    from image_analysis import analyze_image
+    from svg_simplify import simplify_svg
+    
+    image_data = make_prewarm_image()
+    with decode_image(image_data) as img:
+        preset = resolve_preset(MODE_PRESETS['color'], analyze_image(img))
+    
+    if waifu2x_batcher is not None:
+        # First launch after boot compiles shaders and pulls the model into the file cache
+        started = time.perf_counter()
+        image_data = waifu2x_batcher.upscale(image_data, 2, WAIFU2X_NOISE, WAIFU2X_MODEL)
+        logger.info(f"Prewarm: Waifu2x upscale took {time.perf_counter() - started:.2f}s")
+    
+    svg = run_vtracer(image_data, preset)
+    if SVG_SIMPLIFY:
+        simplify_svg(svg, SVG_SIMPLIFY_TOLERANCE, None, SVG_MERGE_FILLS)
+    
+    if VTRACER_TILING:
+        started = time.perf_counter()
+        workers = tiled_trace.warm_pool()
+        logger.info(f"Prewarm: {workers} tile tracing processes started in {time.perf_counter() - started:.2f}s")
+
+startup_tracker.mark('init')
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize the runner on startup"""
     logger.info("Starting GPU Vectorization Runner...")
-    logger.info(f"Runner will auto-shutdown after {os.getenv('IDLE_EXIT_MIN', '8')} minutes of inactivity")
+    
+    # Start job workers
+    job_queue.start()
     
     # Start idle monitoring
     idle_guard = get_idle_guard()
     idle_guard.start_monitoring()
+    
+    if JANITOR_ENABLED:
+        janitor.start()
+    
+    # Jobs are accepted straight away; /ready reports when the warm-up behind them is done
+    startup_tracker.mark('startup')
+    startup_tracker.start_prewarm(prewarm_pipeline if RUNNER_PREWARM else None)
 
 @app.on_event("shutdown")
 async def shutdown_event():
@@ -207,109 +594,177 @@ async def shutdown_event():
     logger.info("Shutting down GPU Vectorization Runner...")
     idle_guard = get_idle_guard()
     idle_guard.stop_monitoring()
+    janitor.stop()
+    
+    # Let queued and running jobs finish instead of dropping them with the process
+    await asyncio.to_thread(job_queue.drain, RUNNER_DRAIN_TIMEOUT_SEC)
+    job_queue.stop()
+    prefetch_pool.shutdown(wait=False)
+    result_uploader.shutdown()
 
-@app.post("/run", response_model=VectorizeResponse)
+@app.post("/run", response_model=JobAcceptedResponse, status_code=202)
 async def run_vectorization(
     request: VectorizeRequest,
-    _: bool = Depends(verify_token)
+    _: bool = Depends(verify_token),
+    x_profile: Optional[str] = Header(None)
 ):
-    """Main vectorization endpoint"""
-    start_time = time.time()
-    job_id = str(uuid.uuid4())
+    """Queue a vectorization job and return immediately"""
+    # Update idle guard
+    idle_guard = get_idle_guard()
+    idle_guard.update_request_time()
     
+    # Validate mode and preset
+    validate_request(request)
+    reject_if_draining()
+    
+    try:
+        job = job_queue.submit(request, context={
+            "profile": job_profiler.choose(x_profile),
+            "tier": request.tier,
+            "user": request.user
+        })
+    except QueueFullError as e:
+        logger.warning(f"Rejecting job: {e}")
+        metrics.error(e)
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(queue_retry_after())})
+    except QueueClosedError as e:
+        logger.warning(f"Rejecting job: {e}")
+        metrics.error(e)
+        raise HTTPException(status_code=503, detail=str(e))
+    
+    return JobAcceptedResponse(
+        job_id=job.job_id,
+        status=job.status,
+        queued=True,
+        status_url=f"/status/{job.job_id}"
+    )
+
+@app.post("/run/batch")
+async def run_batch_vectorization(
+    batch: BatchVectorizeRequest,
+    _: bool = Depends(verify_token),
+    x_profile: Optional[str] = Header(None)
+):
+    """Vectorize many inputs, streaming one NDJSON line per item as it finishes"""
     # Update idle guard
     idle_guard = get_idle_guard()
     idle_guard.update_request_time()
     
-    logger.info(f"Starting vectorization job {job_id}")
-    logger.info(f"Input URL: {request.input_url}")
-    logger.info(f"Mode: {request.mode}")
+    if len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Too many items. Maximum is {BATCH_MAX_ITEMS}")
     
-    # Validate mode
-    if request.mode not in ['bw', 'color']:
-        raise HTTPException(status_code=400, detail="Invalid mode. Must be 'bw' or 'color'")
+    for item in batch.items:
+        validate_request(item)
+    reject_if_draining()
     
-    # Create job directory
-    job_dir = WORK_DIR / job_id
-    job_dir.mkdir(parents=True, exist_ok=True)
+    loop = asyncio.get_running_loop()
+    finished: asyncio.Queue = asyncio.Queue()
     
-    input_file = None
-    upscaled_file = None
-    output_file = None
+    async def start_item(index: int, item: VectorizeRequest):
+        """Download one input concurrently with the others, then hand it to the pool"""
+        base = {"index": index, "input_url": str(item.input_url), "filename": item.filename}
+        try:
+            with metrics.stage('download'):
+                image_data = await image_fetcher.fetch_async(str(item.input_url), max_bytes=MAX_INPUT_BYTES)
+            job = job_queue.submit(
+                item,
+                context={
+                    "image_data": image_data,
+                    "profile": job_profiler.choose(x_profile),
+                    "tier": item.tier,
+                    "user": item.user
+                },
+                on_done=lambda job: loop.call_soon_threadsafe(
+                    finished.put_nowait, base | job.to_dict()
+                )
+            )
+            logger.info(f"Batch item {index} queued as job {job.job_id}")
+        except QueueFullError as e:
+            metrics.error(e)
+            finished.put_nowait(base | {"status": "failed", "error": str(e), "retry_after": queue_retry_after()})
+        except Exception as e:
+            metrics.error(e)
+            finished.put_nowait(base | {"status": "failed", "error": str(e)})
     
-    try:
-        # Download input image
-        input_filename = request.filename or f"input_{job_id}.png"
-        input_file = job_dir / input_filename
-        download_image(str(request.input_url), input_file)
-        
-        # Verify it's a valid image
-        with Image.open(input_file) as img:
-            logger.info(f"Image dimensions: {img.size}")
-        
-        # Generate output paths
-        upscaled_file = job_dir / f"upscaled_{job_id}.png"
-        output_filename = RESULT_NAMING.format(uuid=job_id)
-        output_file = job_dir / output_filename
-        
-        # Step 1: Run Waifu2x upscaling
-        logger.info("Starting Waifu2x upscaling...")
-        run_waifu2x(input_file, upscaled_file)
-        
-        # Step 2: Run VTracer vectorization
-        logger.info("Starting VTracer vectorization...")
-        run_vtracer(upscaled_file, output_file, request.mode)
-        
-        # Verify output was created
-        if not output_file.exists():
-            raise RuntimeError("Vectorization failed - no SVG output")
-        
-        # Calculate duration
-        duration_ms = int((time.time() - start_time) * 1000)
-        
-        # Prepare response
-        if RESULT_UPLOAD_MODE == 'signed_put' and RESULT_UPLOAD_SIGNED_PUT_URL:
-            # Upload to signed URL
-            with open(output_file, 'rb') as f:
-                upload_response = requests.put(RESULT_UPLOAD_SIGNED_PUT_URL, data=f)
-                upload_response.raise_for_status()
-            
-            output_info = {"uploaded_url": RESULT_UPLOAD_SIGNED_PUT_URL}
-        else:
-            # Return local path
-            output_info = {"local_path": str(output_file)}
-        
-        logger.info(f"Vectorization completed successfully in {duration_ms}ms")
-        
-        return VectorizeResponse(
-            job_id=job_id,
-            status="done",
-            output=output_info,
-            duration_ms=duration_ms
-        )
-        
-    except Exception as e:
-        # Cleanup on error
-        cleanup_file(input_file)
-        cleanup_file(upscaled_file)
-        cleanup_file(output_file)
-        
-        error_msg = str(e)
-        logger.error(f"Vectorization failed: {error_msg}")
-        
-        raise HTTPException(status_code=500, detail=error_msg)
+    tasks = [asyncio.create_task(start_item(i, item)) for i, item in enumerate(batch.items)]
+    
+    async def stream_results():
+        try:
+            for _ in range(len(tasks)):
+                line = await finished.get()
+                yield json.dumps(line) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.get("/status/{job_id}")
+async def job_status(
+    job_id: str,
+    _: bool = Depends(verify_token)
+):
+    """Report the state of a queued job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return job.to_dict()
+
+@app.get("/live")
+async def liveness_check():
+    """Liveness: the process is up and serving (jobs are accepted from here on)"""
+    return {"status": "alive"}
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 503 until startup and the prewarm have finished"""
+    state = startup_tracker.state()
+    if not state["ready"]:
+        return JSONResponse(status_code=503, content={"status": "starting", **state})
+    return {"status": "ready", **state}
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
+        "ready": startup_tracker.ready,
+        "startup": startup_tracker.state(),
         "timestamp": datetime.now().isoformat(),
-        "waifu2x_available": Path(WAIFU2X_DIR).exists(),
+        "waifu2x_available": waifu2x_batcher is not None,
+        "waifu2x": waifu2x_batcher.stats() if waifu2x_batcher else None,
         "work_dir": str(WORK_DIR),
-        "work_dir_exists": WORK_DIR.exists()
+        "work_dir_exists": WORK_DIR.exists(),
+        "queue": job_queue.stats(),
+        "admission": admission.stats(),
+        "scheduler": job_scheduler.stats(),
+        "cost_model": cost_model.stats(),
+        "uploads": result_uploader.stats(),
+        "janitor": janitor.stats(),
+        "idle": get_idle_guard().stats(),
+        "cache": svg_cache.stats() if svg_cache else None,
+        "fetch": image_fetcher.host_stats()
     }
 
+@app.get("/admin/profiling")
+async def get_profiling(_: bool = Depends(verify_token)):
+    """Current profiling settings and counters"""
+    return job_profiler.settings()
+
+@app.post("/admin/profiling")
+async def update_profiling(
+    settings: ProfilingSettings,
+    _: bool = Depends(verify_token)
+):
+    """Switch sampled profiling on or off and tune the sample rate and slow-job threshold"""
+    return job_profiler.update(settings.enabled, settings.sample_rate, settings.slow_job_sec)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/")
 async def root():
     """Root endpoint"""
@@ -318,7 +773,12 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "health": "/health",
-            "vectorize": "/run"
+            "live": "/live",
+            "ready": "/ready",
+            "vectorize": "/run",
+            "batch": "/run/batch",
+            "status": "/status/{job_id}",
+            "metrics": "/metrics"
         }
     }
 
@@ -0,0 +1,207 @@
+"""
+Learned per-job cost model for scheduling.
+
+Every finished job leaves a sample: the features known before it ran (source
+and traced pixel counts, the colour count when known, the preset) and
+how long each pipeline stage actually took. The model is a weighted ridge
+regression of compute time (verify, upscale, trace, simplify) on those
+features, refitted every few samples. Weights of 1/(seconds + 1) keep the many
+small jobs from being drowned out by a few huge ones, which matters because
+the scheduler mostly has to tell small jobs apart. Until enough samples
+exist, predictions come from a prior built on the measured VTracer throughput.
+
+Samples are appended to a JSONL file under the work directory, so the model
+survives the scale-to-zero restarts instead of relearning after every cold
+start. Prediction error (actual vs. predicted, recorded at schedule time) is
+exported as metrics.
+"""
+import os
+import json
+import math
+import time
+import threading
+import logging
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from vtracer_presets import PRESET_NAMES
+
+logger = logging.getLogger(__name__)
+
+# === CONFIG ===
+COST_MODEL_MIN_SAMPLES = int(os.getenv('COST_MODEL_MIN_SAMPLES', '20'))
+COST_MODEL_MAX_SAMPLES = int(os.getenv('COST_MODEL_MAX_SAMPLES', '2000'))
+COST_MODEL_REFIT_EVERY = int(os.getenv('COST_MODEL_REFIT_EVERY', '10'))
+
+# Stages whose time depends on the image; download, admission and upload are scheduling or I/O
+COMPUTE_STAGES = ('verify', 'upscale', 'trace', 'simplify')
+# Prior: measured VTracer throughput of ~3 Mpx/s, plus decode/analysis of the source
+PRIOR_TRACE_MPX_PER_SEC = 3.0
+PRIOR_SOURCE_SEC_PER_MPX = 0.05
+PRIOR_BASE_SEC = 0.05
+# Colour count assumed when the input could not be analyzed before running
+DEFAULT_COLORS = 256
+MIN_PREDICTION_SEC = 0.05
+RIDGE = 1e-3
+ERROR_WINDOW = 200
+
+
+def features_vector(features: Dict[str, Any]) -> List[float]:
+    """Design row: bias, pixel terms, a colour-complexity term and one indicator per preset"""
+    source_mpx = features.get("source_pixels", 0) / 1e6
+    traced_mpx = features.get("traced_pixels", 0) / 1e6
+    colors = features.get("colors") or DEFAULT_COLORS
+    row = [1.0, source_mpx, traced_mpx, traced_mpx * math.log2(1 + colors) / 8]
+    row.extend(1.0 if features.get("preset") == name else 0.0 for name in PRESET_NAMES)
+    return row
+
+
+def prior_seconds(features: Dict[str, Any]) -> float:
+    return (PRIOR_BASE_SEC
+            + features.get("source_pixels", 0) / 1e6 * PRIOR_SOURCE_SEC_PER_MPX
+            + features.get("traced_pixels", 0) / 1e6 / PRIOR_TRACE_MPX_PER_SEC)
+
+
+class CostModel:
+    """Predicts a job's compute seconds from its features and learns from finished jobs"""
+
+    def __init__(self, sample_path: Optional[Path] = None, min_samples: int = COST_MODEL_MIN_SAMPLES,
+                 max_samples: int = COST_MODEL_MAX_SAMPLES, refit_every: int = COST_MODEL_REFIT_EVERY):
+        self.sample_path = sample_path
+        self.min_samples = min_samples
+        self.refit_every = max(1, refit_every)
+        self.fits = 0
+        self._samples = deque(maxlen=max_samples)
+        self._coef: Optional[np.ndarray] = None
+        self._since_fit = 0
+        # Recent (predicted, actual) pairs for the error metrics
+        self._errors = deque(maxlen=ERROR_WINDOW)
+        self.error_ratio = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.sample_path or not self.sample_path.exists():
+            return
+        try:
+            with open(self.sample_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self._samples.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError as e:
+            logger.warning(f"Could not read cost samples from {self.sample_path}: {e}")
+            return
+        if self._samples:
+            # Keep the file from growing without bound across restarts
+            self._rewrite()
+            self._fit()
+            logger.info(f"Cost model loaded {len(self._samples)} samples from {self.sample_path}")
+
+    def _rewrite(self):
+        tmp_path = self.sample_path.with_suffix('.tmp')
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps(sample) + "\n" for sample in self._samples)
+            os.replace(tmp_path, self.sample_path)
+        except OSError as e:
+            logger.warning(f"Could not compact cost samples: {e}")
+
+    def predict(self, features: Dict[str, Any]) -> float:
+        """Expected compute seconds for a job with these features"""
+        with self._lock:
+            coef = self._coef
+        if coef is None:
+            return prior_seconds(features)
+        return max(MIN_PREDICTION_SEC, float(np.dot(coef, features_vector(features))))
+
+    def observe(self, features: Dict[str, Any], stages: Dict[str, float],
+                predicted: Optional[float] = None) -> float:
+        """Record a finished job's stage durations; returns its compute seconds"""
+        actual = sum(stages.get(stage, 0.0) for stage in COMPUTE_STAGES)
+        sample = {"features": features, "stages": {k: round(v, 4) for k, v in stages.items()},
+                  "seconds": round(actual, 4), "at": round(time.time(), 1)}
+        with self._lock:
+            self._samples.append(sample)
+            if predicted is not None:
+                self._errors.append((predicted, actual))
+            self._since_fit += 1
+            refit = self._since_fit >= self.refit_every
+        if predicted and self.error_ratio is not None:
+            self.error_ratio.observe(actual / predicted)
+        if self.sample_path:
+            try:
+                with open(self.sample_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(sample) + "\n")
+            except OSError as e:
+                logger.warning(f"Could not append cost sample: {e}")
+        if refit:
+            self._fit()
+        return actual
+
+    def _fit(self):
+        with self._lock:
+            samples = list(self._samples)
+            self._since_fit = 0
+        if len(samples) < self.min_samples:
+            return
+
+        x = np.array([features_vector(sample["features"]) for sample in samples])
+        y = np.array([sample["seconds"] for sample in samples])
+        weights = np.sqrt(1.0 / (y + 1.0))
+        xw = x * weights[:, None]
+        yw = y * weights
+        # Ridge keeps presets that are rarely seen from getting wild coefficients
+        coef = np.linalg.solve(xw.T @ xw + RIDGE * len(samples) * np.eye(x.shape[1]), xw.T @ yw)
+        with self._lock:
+            self._coef = coef
+            self.fits += 1
+
+    def error_stats(self) -> Dict[str, float]:
+        """Mean absolute and mean absolute percentage error over recent jobs"""
+        with self._lock:
+            pairs = list(self._errors)
+        if not pairs:
+            return {"jobs": 0, "mae_seconds": 0.0, "mape": 0.0}
+        absolute = [abs(actual - predicted) for predicted, actual in pairs]
+        relative = [abs(actual - predicted) / max(actual, MIN_PREDICTION_SEC) for predicted, actual in pairs]
+        return {
+            "jobs": len(pairs),
+            "mae_seconds": round(sum(absolute) / len(pairs), 3),
+            "mape": round(sum(relative) / len(pairs), 3),
+        }
+
+    def export_metrics(self, metrics):
+        """Prediction error as a histogram of actual/predicted plus rolling MAE/MAPE gauges"""
+        self.error_ratio = metrics.registry.histogram(
+            'vectorizer_cost_prediction_ratio', "Actual compute time divided by the predicted time",
+            buckets=(0.25, 0.5, 0.67, 0.8, 0.9, 1.1, 1.25, 1.5, 2, 4)
+        )
+        error = metrics.registry.gauge('vectorizer_cost_prediction_error',
+                                       "Cost model error over recent jobs", ['measure'])
+        error.set_function(lambda: {k: v for k, v in self.error_stats().items() if k != "jobs"})
+        samples = metrics.registry.gauge('vectorizer_cost_model_samples', "Finished jobs the cost model learns from")
+        samples.set_function(lambda: len(self._samples))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = len(self._samples)
+            fitted = self._coef is not None
+        return {"samples": samples, "fitted": fitted, "fits": self.fits, **self.error_stats()}
+
+
+_cost_model: Optional[CostModel] = None
+
+
+def get_cost_model(sample_path: Optional[Path] = None) -> CostModel:
+    """Get or create the process-wide cost model"""
+    global _cost_model
+    if _cost_model is None:
+        if sample_path:
+            sample_path.parent.mkdir(parents=True, exist_ok=True)
+        _cost_model = CostModel(sample_path)
+    return _cost_model
@@ -1,38 +1,145 @@
+"""
+Idle shutdown for the scale-to-zero runner.
+
+The guard treats the runner as busy while any job is queued or running (read
+through a probe, normally the job queue), so a long Waifu2x job is never cut
+off; the idle clock only starts once the last job has finished. The timeout
+adapts to recent traffic: when requests arrive in bursts separated by gaps a
+little longer than IDLE_EXIT_MIN, staying up through the gap (up to
+IDLE_MAX_MIN) is cheaper than a cold start per burst. Shutdown goes through
+the server's normal signal handling so the queue is drained first.
+"""
 import os
 import time
+import signal
 import threading
-from datetime import datetime, timedelta
 import logging
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
 
 logger = logging.getLogger(__name__)
 
+# === CONFIG ===
+# Minutes without requests or jobs before exiting (0 disables). RUNNER_IDLE_TIMEOUT (seconds) is
+# still read when IDLE_EXIT_MIN is unset.
+if os.getenv('IDLE_EXIT_MIN'):
+    IDLE_EXIT_SEC = float(os.getenv('IDLE_EXIT_MIN')) * 60
+else:
+    IDLE_EXIT_SEC = float(os.getenv('RUNNER_IDLE_TIMEOUT', '480') or '480')
+# Upper bound for the adaptive timeout
+IDLE_MAX_SEC = float(os.getenv('IDLE_MAX_MIN', '30')) * 60
+IDLE_ADAPTIVE = os.getenv('IDLE_ADAPTIVE', 'true').lower() == 'true'
+# How far back arrivals are remembered for the adaptive timeout
+IDLE_RATE_WINDOW_SEC = float(os.getenv('IDLE_RATE_WINDOW_MIN', '120')) * 60
+IDLE_CHECK_SEC = float(os.getenv('IDLE_CHECK_SEC', '15'))
+# How long shutdown waits for queued and running jobs
+RUNNER_DRAIN_TIMEOUT_SEC = float(os.getenv('RUNNER_DRAIN_TIMEOUT_SEC', '600'))
+
+# Gaps shorter than this are part of a burst, not an idle period the timeout has to bridge
+MIN_IDLE_GAP_SEC = 60
+# The adaptive timeout covers this multiple of the typical gap between bursts
+GAP_MARGIN = 1.25
+
+
 class IdleGuard:
-    """Tracks last request time and auto-shuts down after idle timeout"""
-    
-    def __init__(self, idle_minutes=8):
-        self.idle_minutes = idle_minutes
+    """Tracks request arrivals and outstanding work, and shuts the runner down when idle"""
+
+    def __init__(self, timeout_seconds: float = IDLE_EXIT_SEC, max_timeout_seconds: float = IDLE_MAX_SEC,
+                 adaptive: bool = IDLE_ADAPTIVE, check_interval: float = IDLE_CHECK_SEC,
+                 drain_timeout: float = RUNNER_DRAIN_TIMEOUT_SEC):
+        self.timeout_seconds = timeout_seconds
+        self.max_timeout_seconds = max(max_timeout_seconds, timeout_seconds)
+        self.adaptive = adaptive
+        self.check_interval = check_interval
+        self.drain_timeout = drain_timeout
         self.last_request_time = time.time()
+        self.last_activity_time = self.last_request_time
+        self.draining = False
+        self._arrivals = deque(maxlen=1000)
+        self._pending_probe: Optional[Callable[[], int]] = None
         self._lock = threading.Lock()
         self._shutdown_event = threading.Event()
         self._monitor_thread = None
         self._running = False
-        
+
+    @property
+    def idle_minutes(self) -> float:
+        return self.timeout_seconds / 60
+
+    def set_pending_probe(self, probe: Callable[[], int]):
+        """Count of queued + running jobs; the runner never exits while it is non-zero"""
+        self._pending_probe = probe
+
     def update_request_time(self):
-        """Update the last request time"""
+        """Record a request arrival"""
+        with self._lock:
+            now = time.time()
+            self.last_request_time = now
+            self.last_activity_time = now
+            self._arrivals.append(now)
+            logger.debug(f"Updated last request time: {datetime.fromtimestamp(now)}")
+
+    def pending_work(self) -> int:
+        return self._pending_probe() if self._pending_probe else 0
+
+    def seconds_idle(self) -> float:
+        """Seconds since the last request arrived or the last job finished"""
+        if self.pending_work():
+            return 0.0
+        with self._lock:
+            return time.time() - self.last_activity_time
+
+    def current_timeout(self) -> float:
+        """The idle timeout adapted to the gaps between recent bursts of requests"""
+        base = self.timeout_seconds
+        if not self.adaptive or base <= 0:
+            return base
+
         with self._lock:
-            self.last_request_time = time.time()
-            logger.debug(f"Updated last request time: {datetime.fromtimestamp(self.last_request_time)}")
-    
+            cutoff = time.time() - IDLE_RATE_WINDOW_SEC
+            while self._arrivals and self._arrivals[0] < cutoff:
+                self._arrivals.popleft()
+            arrivals = list(self._arrivals)
+
+        gaps = sorted(later - earlier for earlier, later in zip(arrivals, arrivals[1:])
+                      if later - earlier >= MIN_IDLE_GAP_SEC)
+        if len(gaps) < 2:
+            return base
+
+        # Bridge the typical gap when that is affordable; gaps beyond the cap are left to a cold start
+        target = gaps[(len(gaps) * 3) // 4] * GAP_MARGIN
+        if base < target <= self.max_timeout_seconds:
+            return target
+        return base
+
+    def is_idle(self) -> bool:
+        timeout = self.current_timeout()
+        return timeout > 0 and self.seconds_idle() >= timeout
+
+    def stats(self) -> Dict[str, Any]:
+        """Idle state for the health endpoint"""
+        return {
+            "idle_seconds": round(self.seconds_idle(), 1),
+            "timeout_seconds": round(self.current_timeout(), 1),
+            "base_timeout_seconds": self.timeout_seconds,
+            "pending_jobs": self.pending_work(),
+            "recent_arrivals": len(self._arrivals),
+            "draining": self.draining,
+        }
+
     def start_monitoring(self):
         """Start the idle monitoring thread"""
-        if self._running:
+        if self._running or self.timeout_seconds <= 0:
             return
-            
+
         self._running = True
-        self._monitor_thread = threading.Thread(target=self._monitor_loop, daemon=True)
+        self._shutdown_event.clear()
+        self._monitor_thread = threading.Thread(target=self._monitor_loop, daemon=True, name="idle-guard")
         self._monitor_thread.start()
-        logger.info(f"Idle monitoring started (timeout: {self.idle_minutes} minutes)")
-    
+        logger.info(f"Idle monitoring started (timeout: {self.idle_minutes:g} minutes"
+                    f"{f', adaptive up to {self.max_timeout_seconds / 60:g}' if self.adaptive else ''})")
+
     def stop_monitoring(self):
         """Stop the idle monitoring"""
         self._running = False
@@ -40,37 +147,49 @@ class IdleGuard:
         if self._monitor_thread:
             self._monitor_thread.join(timeout=5)
         logger.info("Idle monitoring stopped")
-    
+
     def _monitor_loop(self):
-        """Main monitoring loop - checks every 30 seconds"""
+        """Main monitoring loop"""
         while self._running and not self._shutdown_event.is_set():
             try:
-                with self._lock:
-                    idle_seconds = time.time() - self.last_request_time
-                    idle_minutes = idle_seconds / 60
-                    
-                    if idle_minutes >= self.idle_minutes:
-                        logger.info(f"Idle timeout reached ({idle_minutes:.1f} minutes), shutting down...")
-                        # Use os._exit to force shutdown
-                        os._exit(0)
-                    else:
-                        remaining = self.idle_minutes - idle_minutes
-                        logger.debug(f"Idle check: {idle_minutes:.1f} minutes idle, {remaining:.1f} minutes remaining")
-                
-                # Wait 30 seconds before next check
-                self._shutdown_event.wait(30)
-                
+                if self.pending_work():
+                    # Work in progress counts as activity, so the idle clock starts when it ends
+                    with self._lock:
+                        self.last_activity_time = time.time()
+                elif self.is_idle():
+                    self._exit_when_idle()
+                else:
+                    logger.debug(f"Idle check: {self.seconds_idle():.0f}s idle, "
+                                 f"timeout {self.current_timeout():.0f}s")
             except Exception as e:
                 logger.error(f"Error in idle monitoring: {e}")
-                time.sleep(30)
+
+            self._shutdown_event.wait(self.check_interval)
+
+    def _exit_when_idle(self):
+        # New jobs are refused from here; recheck in case one arrived since the idle check
+        self.draining = True
+        if self.pending_work():
+            self.draining = False
+            return
+
+        logger.info(f"Idle for {self.seconds_idle() / 60:.1f} minutes "
+                    f"(timeout {self.current_timeout() / 60:.1f}), shutting down...")
+        self._running = False
+        # Go through the server's SIGINT handling so shutdown hooks (queue drain) run,
+        # and force the exit if that hangs
+        watchdog = threading.Timer(self.drain_timeout + 30, os._exit, args=(0,))
+        watchdog.daemon = True
+        watchdog.start()
+        signal.raise_signal(signal.SIGINT)
+
 
 # Global instance
 idle_guard = None
 
-def get_idle_guard():
+def get_idle_guard() -> IdleGuard:
     """Get or create the global idle guard instance"""
     global idle_guard
     if idle_guard is None:
-        idle_minutes = int(os.getenv('IDLE_EXIT_MIN', '8'))
-        idle_guard = IdleGuard(idle_minutes)
-    return idle_guard 
\ No newline at end of file
+        idle_guard = IdleGuard()
+    return idle_guard
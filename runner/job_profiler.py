@@ -0,0 +1,254 @@
+"""
+Per-job profiling for the runner.
+
+A job is profiled in full (cProfile call graph plus tracemalloc peak and top
+allocations) when the caller asks for it with the X-Profile header, or when
+profiling is switched on (env or admin endpoint) and the job falls inside the
+sample rate. Separately, every job is watched by a low-rate stack sampler; the
+samples are thrown away unless the job runs past PROFILE_SLOW_JOB_SEC, in which
+case they are written out as collapsed stacks (flamegraph input). Artifacts go
+into WORK_DIR/<job_id>/ next to the job's SVG.
+"""
+import io
+import os
+import sys
+import time
+import pstats
+import random
+import cProfile
+import threading
+import tracemalloc
+import logging
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# === CONFIG ===
+PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', 'false').lower() == 'true'
+# Fraction of jobs profiled while profiling is enabled
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0.01'))
+# Whether callers may request a profile per job with "X-Profile: 1"
+PROFILE_ALLOW_HEADER = os.getenv('PROFILE_ALLOW_HEADER', 'true').lower() == 'true'
+# Jobs slower than this keep their sampled stacks (0 disables the watch)
+PROFILE_SLOW_JOB_SEC = float(os.getenv('PROFILE_SLOW_JOB_SEC', '60'))
+PROFILE_STACK_INTERVAL_MS = int(os.getenv('PROFILE_STACK_INTERVAL_MS', '50'))
+PROFILE_TOP_N = int(os.getenv('PROFILE_TOP_N', '40'))
+
+TRUTHY = ('1', 'true', 'yes', 'on')
+
+
+class StackSampler:
+    """One background thread that samples the stacks of the threads it is watching"""
+
+    def __init__(self, interval_ms: int = PROFILE_STACK_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self._watched: Dict[int, Counter] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def watch(self, thread_id: int):
+        """Start collecting samples for a thread"""
+        with self._lock:
+            self._watched[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample_loop, daemon=True, name="stack-sampler")
+                self._thread.start()
+        self._wake.set()
+
+    def unwatch(self, thread_id: int) -> Counter:
+        """Stop sampling a thread and return its collapsed stack counts"""
+        with self._lock:
+            return self._watched.pop(thread_id, Counter())
+
+    def _sample_loop(self):
+        while True:
+            with self._lock:
+                watched = list(self._watched.items())
+            if not watched:
+                # Nothing running: sleep until the next job starts
+                self._wake.wait()
+                self._wake.clear()
+                continue
+
+            frames = sys._current_frames()
+            for thread_id, counts in watched:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    counts[_collapse(frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+def _collapse(frame) -> str:
+    """A stack as 'outer;...;inner' function labels (the collapsed flamegraph format)"""
+    labels = []
+    while frame is not None:
+        code = frame.f_code
+        labels.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class JobProfiler:
+    """Decides which jobs to profile and writes their artifacts into the job directory"""
+
+    def __init__(self, work_dir: Path):
+        self.work_dir = Path(work_dir)
+        self.enabled = PROFILE_ENABLED
+        self.sample_rate = PROFILE_SAMPLE_RATE
+        self.allow_header = PROFILE_ALLOW_HEADER
+        self.slow_job_sec = PROFILE_SLOW_JOB_SEC
+        self.sampler = StackSampler()
+        self._tracemalloc_users = 0
+        self._tracemalloc_owned = False
+        self._lock = threading.Lock()
+        self.profiled = 0
+        self.slow_captures = 0
+
+    def settings(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "allow_header": self.allow_header,
+            "slow_job_sec": self.slow_job_sec,
+            "profiled": self.profiled,
+            "slow_captures": self.slow_captures,
+        }
+
+    def update(self, enabled: Optional[bool] = None, sample_rate: Optional[float] = None,
+               slow_job_sec: Optional[float] = None) -> Dict[str, Any]:
+        """Admin toggle: change settings at runtime"""
+        if enabled is not None:
+            self.enabled = enabled
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if slow_job_sec is not None:
+            self.slow_job_sec = slow_job_sec
+        logger.info(f"Profiling settings updated: {self.settings()}")
+        return self.settings()
+
+    def choose(self, header: Optional[str] = None) -> Optional[str]:
+        """Why a new job should be profiled ('header' or 'sampled'), or None"""
+        if header and self.allow_header and header.lower() in TRUTHY:
+            return 'header'
+        if self.enabled and random.random() < self.sample_rate:
+            return 'sampled'
+        return None
+
+    def wrap(self, handler: Callable) -> Callable:
+        """Wrap a JobQueue handler so the jobs it runs can be profiled"""
+        def profiled_handler(job):
+            return self.run(job, handler)
+        return profiled_handler
+
+    def run(self, job, handler: Callable) -> Dict[str, Any]:
+        reason = job.context.get('profile')
+        thread_id = threading.get_ident()
+        slow_job_sec = self.slow_job_sec
+        if slow_job_sec > 0:
+            self.sampler.watch(thread_id)
+
+        profile = None
+        if reason:
+            self._start_tracemalloc()
+            profile = cProfile.Profile()
+            profile.enable()
+
+        start = time.perf_counter()
+        result = None
+        try:
+            result = handler(job)
+            return result
+        finally:
+            duration = time.perf_counter() - start
+            artifacts = {}
+            if profile is not None:
+                profile.disable()
+                artifacts.update(self._write_profile(job.job_id, profile))
+                artifacts.update(self._write_memory(job.job_id))
+                self._stop_tracemalloc()
+                self.profiled += 1
+            if slow_job_sec > 0:
+                stacks = self.sampler.unwatch(thread_id)
+                if duration >= slow_job_sec and stacks:
+                    artifacts.update(self._write_stacks(job.job_id, stacks, duration))
+                    self.slow_captures += 1
+                    reason = reason or 'slow'
+
+            if artifacts:
+                logger.info(f"Profile for job {job.job_id} ({reason}, {duration:.1f}s) written to "
+                            f"{self.work_dir / job.job_id}")
+                if result is not None:
+                    result["profile"] = {
+                        "reason": reason,
+                        "duration_ms": int(duration * 1000),
+                        "artifacts": artifacts,
+                    }
+
+    def _job_dir(self, job_id: str) -> Path:
+        job_dir = self.work_dir / job_id
+        job_dir.mkdir(parents=True, exist_ok=True)
+        return job_dir
+
+    def _write_profile(self, job_id: str, profile: cProfile.Profile) -> Dict[str, str]:
+        """cProfile dump (for snakeviz/pstats) plus a cumulative-time summary"""
+        job_dir = self._job_dir(job_id)
+        dump_path = job_dir / 'profile.prof'
+        text_path = job_dir / 'profile.txt'
+        profile.dump_stats(str(dump_path))
+
+        summary = io.StringIO()
+        stats = pstats.Stats(profile, stream=summary)
+        stats.sort_stats('cumulative').print_stats(PROFILE_TOP_N)
+        text_path.write_text(summary.getvalue(), encoding='utf-8')
+        return {"cprofile": str(dump_path), "cprofile_summary": str(text_path)}
+
+    def _write_memory(self, job_id: str) -> Dict[str, str]:
+        """tracemalloc peak and the largest allocation sites"""
+        current, peak = tracemalloc.get_traced_memory()
+        # Leave out what the profilers themselves allocated
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, module.__file__) for module in (cProfile, pstats, tracemalloc)
+        ])
+        top = snapshot.statistics('lineno')[:PROFILE_TOP_N]
+
+        lines = [
+            f"Peak traced memory: {peak / 1024 / 1024:.1f} MB",
+            f"Traced at job end: {current / 1024 / 1024:.1f} MB",
+            "(Python allocations only, process-wide while tracing; Pillow pixel buffers are not traced)",
+            "",
+            f"Top {len(top)} allocation sites still held at job end:",
+        ]
+        lines.extend(f"  {stat.size / 1024:10.1f} KB  {stat.count:8d} blocks  {stat.traceback}" for stat in top)
+
+        path = self._job_dir(job_id) / 'memory.txt'
+        path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+        return {"memory": str(path)}
+
+    def _write_stacks(self, job_id: str, stacks: Counter, duration: float) -> Dict[str, str]:
+        """Collapsed stacks of a slow job; each sample is PROFILE_STACK_INTERVAL_MS of wall time"""
+        path = self._job_dir(job_id) / 'slow_stacks.txt'
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.warning(f"Job {job_id} took {duration:.1f}s, sampled stacks written to {path}")
+        return {"slow_stacks": str(path)}
+
+    def _start_tracemalloc(self):
+        # Tracing slows every allocation, so it only runs while a profiled job does
+        with self._lock:
+            if self._tracemalloc_users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._tracemalloc_owned = True
+            tracemalloc.reset_peak()
+            self._tracemalloc_users += 1
+
+    def _stop_tracemalloc(self):
+        with self._lock:
+            self._tracemalloc_users -= 1
+            if self._tracemalloc_users == 0 and self._tracemalloc_owned:
+                tracemalloc.stop()
+                self._tracemalloc_owned = False
@@ -0,0 +1,244 @@
+import time
+import uuid
+import queue
+import threading
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Job states reported by /status/{job_id}
+QUEUED = "queued"
+RUNNING = "running"
+# The handler returned, but a Future it left in job.context["upload"] is still settling
+UPLOADING = "uploading"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when the queue already holds the maximum number of pending jobs"""
+
+
+class QueueClosedError(Exception):
+    """Raised when a job is submitted while the queue drains for shutdown"""
+
+
+@dataclass
+class Job:
+    payload: Any
+    job_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    # Per-job data for the handler that is not part of the public status
+    context: Dict[str, Any] = field(default_factory=dict)
+    callbacks: List[Callable[["Job"], None]] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the job for the status endpoint"""
+        data = {
+            "job_id": self.job_id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.started_at:
+            end = self.finished_at or time.time()
+            data["duration_ms"] = int((end - self.started_at) * 1000)
+        if self.result is not None:
+            data.update(self.result)
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+
+class JobQueue:
+    """Bounded worker pool that runs jobs off the event loop and keeps their state
+
+    Jobs start in arrival order unless a scheduler with the put()/get() interface of
+    queue.Queue decides the order. prepare is called with each accepted job before any
+    worker can see it, e.g. to start fetching its input.
+    """
+
+    def __init__(self, handler: Callable[[Job], Dict[str, Any]], workers: int = 2,
+                 max_queued: int = 100, retention_seconds: int = 3600, scheduler=None,
+                 prepare: Optional[Callable[[Job], None]] = None):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.retention_seconds = retention_seconds
+        self.prepare = prepare
+        self._pending = scheduler or queue.Queue()
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        # Notified whenever a job finishes, so drain() can wait for the last one
+        self._finished = threading.Condition(self._lock)
+        self._threads = []
+        self._running = False
+        self._closed = False
+
+    def start(self):
+        """Start the worker threads"""
+        if self._running:
+            return
+
+        self._running = True
+        self._closed = False
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, daemon=True, name=f"job-worker-{i}")
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Job queue started ({self.workers} workers, max {self.max_queued} queued)")
+
+    def stop(self, timeout: float = 5):
+        """Stop the worker threads once they finish their current job"""
+        if not self._running:
+            return
+
+        self._running = False
+        for _ in self._threads:
+            self._pending.put(None)
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+        logger.info("Job queue stopped")
+
+    def drain(self, timeout: float) -> bool:
+        """Refuse new jobs and wait for queued and running ones to finish
+
+        Returns False if jobs were still outstanding when the timeout ran out.
+        """
+        with self._lock:
+            self._closed = True
+            outstanding = self.pending_count()
+            if outstanding:
+                logger.info(f"Draining {outstanding} job(s) (up to {timeout:.0f}s)...")
+            drained = self._finished.wait_for(lambda: self.pending_count() == 0, timeout)
+            left = self.pending_count()
+        if not drained:
+            logger.warning(f"Drain timed out with {left} job(s) left")
+        return drained
+
+    def submit(self, payload: Any, context: Optional[Dict[str, Any]] = None,
+               on_done: Optional[Callable[[Job], None]] = None) -> Job:
+        """Register a new job and hand it to the worker pool
+
+        on_done is called from the worker thread once the job is done or failed.
+        """
+        job = Job(payload=payload, context=context or {})
+        if on_done:
+            job.callbacks.append(on_done)
+        with self._lock:
+            if self._closed:
+                raise QueueClosedError("Runner is shutting down")
+            self._expire_finished()
+            if self.queued_count() >= self.max_queued:
+                raise QueueFullError(f"Queue is full ({self.max_queued} jobs pending)")
+            self._jobs[job.job_id] = job
+        if self.prepare:
+            try:
+                self.prepare(job)
+            except Exception:
+                with self._lock:
+                    del self._jobs[job.job_id]
+                raise
+        self._pending.put(job)
+        logger.info(f"Queued job {job.job_id}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Look up a job by id"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def queued_count(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status == QUEUED)
+
+    def running_count(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status == RUNNING)
+
+    def uploading_count(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status == UPLOADING)
+
+    def pending_count(self) -> int:
+        """Jobs that are not finished yet"""
+        return sum(1 for job in self._jobs.values() if job.status in (QUEUED, RUNNING, UPLOADING))
+
+    def stats(self) -> Dict[str, int]:
+        """Summary of the queue for the health endpoint"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queued": self.queued_count(),
+                "running": self.running_count(),
+                "uploading": self.uploading_count(),
+                "tracked": len(self._jobs),
+            }
+
+    def _expire_finished(self):
+        """Forget finished jobs older than the retention window (caller holds the lock)"""
+        cutoff = time.time() - self.retention_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _worker_loop(self):
+        while self._running:
+            job = self._pending.get()
+            if job is None:
+                break
+
+            with self._lock:
+                job.status = RUNNING
+                job.started_at = time.time()
+
+            try:
+                result = self.handler(job)
+            except Exception as e:
+                self._finish(job, error=e)
+                continue
+
+            upload = job.context.pop('upload', None)
+            if upload is None:
+                self._finish(job, result)
+                continue
+
+            # The worker moves on while the upload runs; its Future settles the job
+            with self._lock:
+                job.result = result
+                job.status = UPLOADING
+            upload.add_done_callback(lambda future, job=job: self._settle_upload(job, future))
+
+    def _settle_upload(self, job: Job, future):
+        error = future.exception()
+        if error is not None:
+            self._finish(job, error=error)
+        else:
+            self._finish(job, {**(job.result or {}), **future.result()})
+
+    def _finish(self, job: Job, result: Optional[Dict[str, Any]] = None, error: Optional[Exception] = None):
+        """Record the outcome, wake drain() and run the job's callbacks"""
+        if error is not None:
+            logger.error(f"Job {job.job_id} failed: {error}")
+        with self._lock:
+            if error is not None:
+                job.error = str(error)
+                job.status = FAILED
+            else:
+                job.result = result
+                job.status = DONE
+            job.finished_at = time.time()
+            self._finished.notify_all()
+
+        for callback in job.callbacks:
+            try:
+                callback(job)
+            except Exception as e:
+                logger.error(f"Job {job.job_id} callback failed: {e}")
@@ -0,0 +1,175 @@
+"""
+Shortest-expected-job-first scheduling with weighted fair sharing between users.
+
+Queued jobs are grouped into flows, one per user (or per plan tier when the
+caller did not say who the user is). Each flow's weight comes from its tier,
+so a Pro user's jobs get twice the compute share of a Free user's under
+contention. Flows are served by self-clocked fair queueing: when a flow gets
+work its start tag is max(virtual time, the flow's last tag), its next job is
+tagged start + predicted seconds / weight, and the smallest tag runs next
+(the flow then starts again from that tag). Cheap jobs therefore get small tags and jump
+ahead of expensive ones, within a flow as well as across flows, while every
+job served pushes its flow's tag (and the virtual time) forward, so a user
+sending many jobs cannot crowd out the others and an expensive job's turn
+always comes. As a backstop, a job that has waited longer than
+SCHED_MAX_WAIT_SEC runs before anything else.
+
+Tags are computed when a worker asks for its next job, from the job's current
+prediction, so predictions that arrive after the job was queued (the input's
+header is read in the background) are used as soon as they exist.
+
+The scheduler reads tier, user and predicted_seconds from job.context and has
+the put()/get() interface of queue.Queue, including a None stop sentinel.
+"""
+import os
+import time
+import threading
+import logging
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# === CONFIG ===
+# Compute share per plan tier (tier:weight,...); unknown tiers count as free
+SCHED_TIER_WEIGHTS = os.getenv('SCHED_TIER_WEIGHTS', 'free:1,pro:2,ultimate:4')
+# Jobs queued longer than this run first, whatever their predicted cost
+SCHED_MAX_WAIT_SEC = float(os.getenv('SCHED_MAX_WAIT_SEC', '600'))
+# Predicted seconds assumed for a job whose input header has not been read yet
+SCHED_DEFAULT_COST_SEC = float(os.getenv('SCHED_DEFAULT_COST_SEC', '5'))
+
+DEFAULT_TIER = "free"
+DEFAULT_TIER_WEIGHT = 1.0
+
+
+def parse_tier_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for item in spec.split(','):
+        tier, _, weight = item.partition(':')
+        if not tier.strip():
+            continue
+        try:
+            weights[tier.strip().lower()] = max(0.1, float(weight))
+        except ValueError:
+            logger.warning(f"Ignoring bad tier weight '{item}'")
+    return weights
+
+
+class _Flow:
+    __slots__ = ("key", "tier", "weight", "jobs", "start_tag", "last_tag")
+
+    def __init__(self, key: str, tier: str, weight: float):
+        self.key = key
+        self.tier = tier
+        self.weight = weight
+        self.jobs: List[Any] = []
+        self.start_tag = 0.0
+        self.last_tag = 0.0
+
+
+class FairScheduler:
+    """Pending-job queue ordered by predicted cost, fair between users and weighted by tier"""
+
+    def __init__(self, tier_weights: Optional[Dict[str, float]] = None,
+                 max_wait: float = SCHED_MAX_WAIT_SEC, default_cost: float = SCHED_DEFAULT_COST_SEC):
+        self.tier_weights = tier_weights if tier_weights is not None else parse_tier_weights(SCHED_TIER_WEIGHTS)
+        self.max_wait = max_wait
+        self.default_cost = default_cost
+        self.virtual_time = 0.0
+        self.aged = 0
+        self._flows: Dict[str, _Flow] = {}
+        self._stops = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+    def tier_of(self, job) -> str:
+        """The job's tier; unknown tiers are scheduled (and reported) as the default one"""
+        tier = (job.context.get("tier") or DEFAULT_TIER).lower()
+        return tier if tier in self.tier_weights else DEFAULT_TIER
+
+    def weight_of(self, tier: str) -> float:
+        return self.tier_weights.get(tier, DEFAULT_TIER_WEIGHT)
+
+    def cost_of(self, job) -> float:
+        predicted = job.context.get("predicted_seconds")
+        return predicted if predicted is not None else self.default_cost
+
+    def put(self, job):
+        """Queue a job, or None to release one waiting worker (stop sentinel)"""
+        with self._lock:
+            if job is None:
+                self._stops += 1
+            else:
+                tier = self.tier_of(job)
+                key = f"user:{job.context['user']}" if job.context.get("user") else f"tier:{tier}"
+                flow = self._flows.get(key)
+                if flow is None:
+                    flow = self._flows[key] = _Flow(key, tier, self.weight_of(tier))
+                if not flow.jobs:
+                    # Fixed while the flow stays backlogged, so waiting earns it its turn
+                    flow.start_tag = max(self.virtual_time, flow.last_tag)
+                flow.jobs.append(job)
+            self._available.notify()
+
+    def get(self):
+        """Block until a job is due and return it (None after a stop sentinel)"""
+        with self._lock:
+            self._available.wait_for(lambda: self._stops or any(flow.jobs for flow in self._flows.values()))
+            if self._stops:
+                self._stops -= 1
+                return None
+            return self._next()
+
+    def _next(self):
+        now = time.time()
+        # Backstop against starvation: the oldest job past the wait limit goes first
+        overdue = [(flow.jobs[0].created_at, flow) for flow in self._flows.values()
+                   if flow.jobs and now - flow.jobs[0].created_at > self.max_wait]
+        if overdue:
+            _, flow = min(overdue, key=lambda item: item[0])
+            job = flow.jobs.pop(0)
+            tag = flow.start_tag + self.cost_of(job) / flow.weight
+            self.aged += 1
+        else:
+            best = None
+            for flow in self._flows.values():
+                if not flow.jobs:
+                    continue
+                # The flow's cheapest job, earliest first among equals
+                candidate = min(flow.jobs, key=self.cost_of)
+                tag = flow.start_tag + self.cost_of(candidate) / flow.weight
+                # Equal tags go to the job that has waited longest
+                if best is None or (tag, candidate.created_at) < (best[0], best[2].created_at):
+                    best = (tag, flow, candidate)
+            tag, flow, job = best
+            flow.jobs.remove(job)
+
+        flow.start_tag = tag
+        flow.last_tag = tag
+        self.virtual_time = max(self.virtual_time, tag)
+        self._forget_idle_flows()
+        return job
+
+    def _forget_idle_flows(self):
+        """Drop empty flows whose tag the virtual time has passed: they would restart from it anyway"""
+        idle = [key for key, flow in self._flows.items()
+                if not flow.jobs and flow.last_tag <= self.virtual_time]
+        for key in idle:
+            del self._flows[key]
+
+    def qsize(self) -> int:
+        with self._lock:
+            return sum(len(flow.jobs) for flow in self._flows.values())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            queued: Dict[str, int] = {}
+            for flow in self._flows.values():
+                if flow.jobs:
+                    queued[flow.tier] = queued.get(flow.tier, 0) + len(flow.jobs)
+            return {
+                "flows": sum(1 for flow in self._flows.values() if flow.jobs),
+                "queued_by_tier": queued,
+                "tier_weights": dict(self.tier_weights),
+                "virtual_time": round(self.virtual_time, 2),
+                "aged": self.aged,
+            }
@@ -0,0 +1,222 @@
+"""
+Background upload of job results to per-job signed URLs.
+
+Workers hand the finished SVG to this pool and go straight back to the queue;
+the job reports "uploading" until the transfer settles. Targets that ask for gzip
+get the body compressed in the upload thread (sent with Content-Encoding: gzip,
+so browsers and CDNs serving the object decode it transparently); otherwise the
+bytes and headers go out exactly as given, since presigned URLs often sign them.
+Every request is retried with exponential backoff. Targets marked resumable
+(GCS-style session URIs) are sent in RESULT_UPLOAD_CHUNK_BYTES pieces with
+Content-Range headers; after a failure the store is asked how many bytes it
+already holds and the upload carries on from there instead of starting over.
+"""
+import os
+import re
+import gzip
+import time
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# === CONFIG ===
+RESULT_UPLOAD_WORKERS = int(os.getenv('RESULT_UPLOAD_WORKERS', '4'))
+# Retries per upload (per chunk for resumable targets) after the first attempt
+RESULT_UPLOAD_RETRIES = int(os.getenv('RESULT_UPLOAD_RETRIES', '4'))
+RESULT_UPLOAD_BACKOFF_SEC = float(os.getenv('RESULT_UPLOAD_BACKOFF_SEC', '1'))
+# Resumable sessions need every chunk but the last to be a multiple of 256 KiB
+RESULT_UPLOAD_CHUNK_BYTES = int(os.getenv('RESULT_UPLOAD_CHUNK_BYTES', str(8 * 1024 * 1024)))
+# For per-job targets that do not choose; gzip changes what a presigned URL has to allow
+RESULT_UPLOAD_COMPRESSION = os.getenv('RESULT_UPLOAD_COMPRESSION', 'none')
+RESULT_UPLOAD_GZIP_LEVEL = int(os.getenv('RESULT_UPLOAD_GZIP_LEVEL', '6'))
+RESULT_UPLOAD_TIMEOUT = float(os.getenv('RESULT_UPLOAD_TIMEOUT', '60'))
+
+COMPRESSIONS = ('gzip', 'none')
+# Answers worth another attempt; any other error status fails the upload at once
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+MAX_BACKOFF_SEC = 30
+
+_RANGE_RE = re.compile(r'bytes=0-(\d+)')
+
+
+class UploadError(Exception):
+    """The result could not be stored at the job's upload target"""
+
+
+def display_url(url: str) -> str:
+    """The URL without its query string, which carries the signature"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}{parts.path}"
+
+
+def encode_body(data: bytes, compression: str) -> bytes:
+    if compression == 'gzip':
+        # mtime=0 keeps the bytes identical across retries and runs
+        return gzip.compress(data, compresslevel=RESULT_UPLOAD_GZIP_LEVEL, mtime=0)
+    return data
+
+
+class ResultUploader:
+    """Thread pool that PUTs results to their targets with retries and resumable chunking"""
+
+    def __init__(self, workers: int = RESULT_UPLOAD_WORKERS, retries: int = RESULT_UPLOAD_RETRIES,
+                 backoff: float = RESULT_UPLOAD_BACKOFF_SEC, chunk_bytes: int = RESULT_UPLOAD_CHUNK_BYTES,
+                 timeout: float = RESULT_UPLOAD_TIMEOUT):
+        self.retries = retries
+        self.backoff = backoff
+        self.chunk_bytes = max(1, chunk_bytes)
+        self._client = httpx.Client(timeout=timeout, limits=httpx.Limits(max_connections=max(1, workers)))
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="result-upload")
+        self.metrics = get_metrics()
+        self.uploads = 0
+        self.failures = 0
+        self.retried = 0
+        self.resumes = 0
+
+    def submit(self, job_id: str, data: bytes, url: str, headers: Optional[Dict[str, str]] = None,
+               resumable: bool = False, compression: Optional[str] = None) -> Future:
+        """Queue an upload; the Future resolves to the job's output fields or raises UploadError"""
+        return self._executor.submit(self._upload, job_id, data, url, dict(headers or {}), resumable,
+                                     compression or RESULT_UPLOAD_COMPRESSION)
+
+    def shutdown(self):
+        """Wait for queued uploads, then close the connection pool"""
+        self._executor.shutdown(wait=True)
+        self._client.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {"uploads": self.uploads, "failures": self.failures, "retried": self.retried,
+                "resumes": self.resumes}
+
+    def _upload(self, job_id: str, data: bytes, url: str, headers: Dict[str, str],
+                resumable: bool, compression: str) -> Dict[str, Any]:
+        start = time.perf_counter()
+        body = encode_body(data, compression)
+        # Only the target's own headers: one the signature does not cover can make the store refuse the PUT
+        if compression != 'none':
+            headers['Content-Encoding'] = compression
+
+        try:
+            if resumable:
+                attempts = self._put_resumable(url, body, headers)
+            else:
+                attempts = self._put_single(url, body, headers)
+        except Exception as e:
+            self.failures += 1
+            self.metrics.error(e)
+            logger.error(f"Upload for job {job_id} to {display_url(url)} failed: {e}")
+            raise
+        finally:
+            self.metrics.stage_seconds.labels('upload').observe(time.perf_counter() - start)
+
+        self.uploads += 1
+        duration_ms = int((time.perf_counter() - start) * 1000)
+        logger.info(f"Uploaded job {job_id} to {display_url(url)}: {len(data)} -> {len(body)} bytes "
+                    f"({compression}), {attempts} request(s) in {duration_ms}ms")
+        return {
+            "output": {"uploaded_url": display_url(url)},
+            "upload": {
+                "bytes": len(data),
+                "sent_bytes": len(body),
+                "compression": compression,
+                "resumable": resumable,
+                "requests": attempts,
+                "duration_ms": duration_ms,
+            }
+        }
+
+    def _wait_before_retry(self, failures: int, reason: str, url: str):
+        if failures > self.retries:
+            raise UploadError(f"Giving up on {display_url(url)} after {failures} failed attempts: {reason}")
+        delay = min(MAX_BACKOFF_SEC, self.backoff * 2 ** (failures - 1))
+        self.retried += 1
+        logger.warning(f"Upload to {display_url(url)} failed ({reason}), retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+    def _put_single(self, url: str, body: bytes, headers: Dict[str, str]) -> int:
+        """One PUT of the whole body, retried; returns the number of requests made"""
+        failures = 0
+        while True:
+            try:
+                response = self._client.put(url, content=body, headers=headers)
+                if response.status_code < 300:
+                    return failures + 1
+                if response.status_code not in RETRY_STATUSES:
+                    raise UploadError(f"{display_url(url)} answered {response.status_code}")
+                reason = f"status {response.status_code}"
+            except httpx.TransportError as e:
+                reason = str(e) or type(e).__name__
+            failures += 1
+            self._wait_before_retry(failures, reason, url)
+
+    def _put_resumable(self, url: str, body: bytes, headers: Dict[str, str]) -> int:
+        """Content-Range chunks, resuming from the store's committed offset after a failure"""
+        total = len(body)
+        offset = 0
+        requests_made = 0
+        failures = 0
+        while True:
+            end = min(offset + self.chunk_bytes, total) - 1
+            chunk_headers = dict(headers, **{'Content-Range': f'bytes {offset}-{end}/{total}'})
+            try:
+                requests_made += 1
+                response = self._client.put(url, content=body[offset:end + 1], headers=chunk_headers)
+                if response.status_code == 308:
+                    committed = _committed_bytes(response)
+                    if committed > offset:
+                        failures = 0
+                        offset = committed
+                        continue
+                    # The store did not take the chunk: carry on from what it holds, as a failed attempt
+                    offset = committed
+                    reason = f"no progress past byte {committed}"
+                elif response.status_code < 300:
+                    return requests_made
+                elif response.status_code in RETRY_STATUSES:
+                    reason = f"status {response.status_code}"
+                else:
+                    raise UploadError(f"{display_url(url)} answered {response.status_code}")
+            except httpx.TransportError as e:
+                reason = str(e) or type(e).__name__
+            failures += 1
+            self._wait_before_retry(failures, reason, url)
+
+            # Ask how much of the chunk made it before the failure
+            try:
+                requests_made += 1
+                status = self._client.put(url, content=b'',
+                                          headers=dict(headers, **{'Content-Range': f'bytes */{total}'}))
+            except httpx.TransportError:
+                continue
+            if status.status_code < 300:
+                return requests_made
+            if status.status_code == 308:
+                committed = _committed_bytes(status)
+                if committed:
+                    self.resumes += 1
+                    logger.info(f"Resuming upload to {display_url(url)} at byte {committed} of {total}")
+                offset = committed
+
+
+def _committed_bytes(response: httpx.Response) -> int:
+    """Bytes the store holds, from a 308's Range header (none means nothing yet)"""
+    match = _RANGE_RE.match(response.headers.get('Range', ''))
+    return int(match.group(1)) + 1 if match else 0
+
+
+_result_uploader: Optional[ResultUploader] = None
+
+
+def get_result_uploader() -> ResultUploader:
+    """Get or create the process-wide upload pool"""
+    global _result_uploader
+    if _result_uploader is None:
+        _result_uploader = ResultUploader()
+    return _result_uploader
@@ -0,0 +1,122 @@
+"""
+Startup timing and readiness for the scale-to-zero runner.
+
+The runner is started on demand, so the time from process start to the first
+served job matters. The tracker records how long each startup phase took
+(imports, init, listening, prewarm) measured from process start, and keeps the
+readiness flag separate from liveness: the server answers /live as soon as it
+is listening, while /ready only turns green once the optional prewarm (a tiny
+image pushed through Waifu2x and VTracer) has loaded everything the first real
+job would otherwise pay for.
+"""
+import io
+import os
+import time
+import threading
+import logging
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# === CONFIG ===
+RUNNER_PREWARM = os.getenv('RUNNER_PREWARM', 'true').lower() == 'true'
+# Side of the generated warm-up image in pixels
+RUNNER_PREWARM_SIZE = int(os.getenv('RUNNER_PREWARM_SIZE', '64'))
+
+
+def _process_start_time() -> float:
+    """Wall-clock time the process started (Linux), else the time this module was imported"""
+    try:
+        with open('/proc/self/stat') as f:
+            # starttime is field 22, counted after the parenthesised command name
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/stat') as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith('btime'))
+        return boot_time + start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, StopIteration, AttributeError):
+        return time.time()
+
+
+PROCESS_STARTED = _process_start_time()
+
+
+class StartupTracker:
+    """Phase timings since process start plus the readiness flag"""
+
+    def __init__(self, started: float = PROCESS_STARTED):
+        self.started = started
+        self.phases: Dict[str, float] = {}
+        self.prewarm_error: Optional[str] = None
+        self._ready = threading.Event()
+        self._last = started
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def mark(self, phase: str) -> float:
+        """Record how long the phase since the previous mark took"""
+        now = time.time()
+        self.phases[phase] = round(now - self._last, 3)
+        self._last = now
+        logger.info(f"Startup phase '{phase}' took {self.phases[phase]:.2f}s "
+                    f"({now - self.started:.2f}s since process start)")
+        return self.phases[phase]
+
+    def mark_ready(self):
+        self.phases['total'] = round(time.time() - self.started, 3)
+        self._ready.set()
+        logger.info(f"Runner ready {self.phases['total']:.2f}s after process start")
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def start_prewarm(self, prewarm: Optional[Callable[[], None]]):
+        """Run the warm-up in the background, then mark the runner ready"""
+        if prewarm is None:
+            self.mark_ready()
+            return
+
+        def run():
+            try:
+                prewarm()
+            except Exception as e:
+                # A failed warm-up only costs the first job its speed, so the runner still goes ready
+                self.prewarm_error = str(e)
+                logger.warning(f"Prewarm failed: {e}")
+            self.mark('prewarm')
+            self.mark_ready()
+
+        threading.Thread(target=run, daemon=True, name="prewarm").start()
+
+    def state(self) -> Dict:
+        return {
+            "ready": self.ready,
+            "uptime_seconds": round(time.time() - self.started, 3),
+            "phases": dict(self.phases),
+            "prewarm_error": self.prewarm_error,
+        }
+
+
+def make_prewarm_image(size: int = RUNNER_PREWARM_SIZE) -> bytes:
+    """A small two-colour PNG that still gives VTracer a few shapes to trace"""
+    from PIL import Image, ImageDraw
+
+    img = Image.new('RGB', (size, size), (255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((size // 8, size // 8, size // 2, size // 2), fill=(200, 30, 30))
+    draw.rectangle((size // 2, size // 2, size - size // 8, size - size // 8), fill=(30, 30, 200))
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+_startup_tracker: Optional[StartupTracker] = None
+
+
+def get_startup_tracker() -> StartupTracker:
+    """Get or create the process-wide startup tracker"""
+    global _startup_tracker
+    if _startup_tracker is None:
+        _startup_tracker = StartupTracker()
+    return _startup_tracker
@@ -0,0 +1,7 @@
+"""Runner modules import the shared ones from ../python, where the fakes live too (the serve fixture is in the root conftest)"""
+import os
+import sys
+
+RUNNER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RUNNER_DIR)
+sys.path.insert(1, os.path.join(RUNNER_DIR, '..', 'python'))
@@ -0,0 +1,130 @@
+import gzip
+import os
+
+import pytest
+
+import fake_object_store
+from result_uploader import ResultUploader, UploadError
+
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg"><path d="M0 0 L1 0 1 1 Z"/></svg>'
+
+
+class ScriptedRandom:
+    """Replaces the fake's random draws: the given values first, then ones that never trigger"""
+
+    def __init__(self, *values):
+        self.values = list(values)
+
+    def random(self):
+        return self.values.pop(0) if self.values else 0.99
+
+
+class ForbiddenHandler(fake_object_store.FakeObjectStoreHandler):
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get('Content-Length', '0')))
+        with fake_object_store._lock:
+            fake_object_store._stats["puts"] += 1
+        self._reply(403)
+
+
+@pytest.fixture
+def store(serve):
+    for state in (fake_object_store._objects, fake_object_store._sessions):
+        state.clear()
+    for name in fake_object_store._stats:
+        fake_object_store._stats[name] = 0
+    return serve(fake_object_store.FakeObjectStoreHandler)
+
+
+@pytest.fixture
+def uploader():
+    uploader = ResultUploader(workers=2, retries=3, backoff=0.01, chunk_bytes=1000, timeout=10)
+    yield uploader
+    uploader.shutdown()
+
+
+def stored(key):
+    return fake_object_store._objects[key]
+
+
+def test_plain_put_stores_the_exact_bytes_without_extra_headers(store, uploader):
+    result = uploader.submit("job-1", SVG, f"{store}/results/a.svg?X-Signature=secret").result(timeout=30)
+
+    body, meta = stored("/results/a.svg")
+    assert body == SVG
+    # No Content-Type or Content-Encoding beyond what the target asked for
+    assert meta == {"content_type": "application/octet-stream", "content_encoding": None}
+    assert result["output"] == {"uploaded_url": f"{store}/results/a.svg"}
+    assert result["upload"]["compression"] == "none"
+    assert result["upload"]["requests"] == 1
+
+
+def test_target_headers_and_gzip_are_sent_when_asked(store, uploader):
+    headers = {'Content-Type': 'image/svg+xml'}
+    result = uploader.submit("job-1", SVG, f"{store}/results/a.svg", headers, compression='gzip').result(timeout=30)
+
+    body, meta = stored("/results/a.svg")
+    assert gzip.decompress(body) == SVG
+    assert meta == {"content_type": "image/svg+xml", "content_encoding": "gzip"}
+    assert result["upload"]["sent_bytes"] == len(body)
+
+
+def test_failed_puts_are_retried(store, uploader, monkeypatch):
+    monkeypatch.setenv('FAKE_STORE_FAIL_RATE', '0.5')
+    monkeypatch.setattr(fake_object_store, 'random', ScriptedRandom(0.0, 0.0))
+
+    result = uploader.submit("job-1", SVG, f"{store}/results/a.svg").result(timeout=30)
+
+    assert stored("/results/a.svg")[0] == SVG
+    assert result["upload"]["requests"] == 3
+    assert uploader.stats()["retried"] == 2
+    assert fake_object_store._stats["forced_failures"] == 2
+
+
+def test_upload_gives_up_after_the_retries(store, uploader, monkeypatch):
+    monkeypatch.setenv('FAKE_STORE_FAIL_RATE', '1')
+
+    with pytest.raises(UploadError):
+        uploader.submit("job-1", SVG, f"{store}/results/a.svg").result(timeout=30)
+
+    assert fake_object_store._stats["puts"] == 4
+    assert uploader.stats()["failures"] == 1
+    assert "/results/a.svg" not in fake_object_store._objects
+
+
+def test_rejected_put_is_not_retried(serve, uploader):
+    url = serve(ForbiddenHandler)
+
+    with pytest.raises(UploadError, match="403"):
+        uploader.submit("job-1", SVG, f"{url}/results/a.svg").result(timeout=30)
+
+    assert uploader.stats()["retried"] == 0
+
+
+def test_resumable_upload_continues_after_a_dropped_chunk(store, uploader, monkeypatch):
+    data = os.urandom(3500)
+    monkeypatch.setenv('FAKE_STORE_FAIL_RATE', '0.5')
+    # The second chunk fails after the store took half of it
+    monkeypatch.setattr(fake_object_store, 'random', ScriptedRandom(0.99, 0.0))
+
+    result = uploader.submit("job-1", data, f"{store}/session/a", resumable=True).result(timeout=30)
+
+    assert stored("/session/a")[0] == data
+    assert uploader.stats()["resumes"] == 1
+    # 0-999, 1000-1999 (dropped at 1500), status query, 1500-2499, 2500-3499
+    assert result["upload"]["requests"] == 5
+    assert fake_object_store._stats["status_queries"] == 1
+    assert fake_object_store._sessions == {}
+
+
+def test_resumable_gzip_upload_is_byte_identical_once_decoded(store, uploader, monkeypatch):
+    data = b''.join(b'<path d="M%d 0 L%d 1"/>' % (i, i) for i in range(2000))
+    monkeypatch.setenv('FAKE_STORE_FAIL_RATE', '0.5')
+    monkeypatch.setattr(fake_object_store, 'random', ScriptedRandom(0.0))
+
+    uploader.submit("job-1", data, f"{store}/session/b", resumable=True, compression='gzip').result(timeout=30)
+
+    body, meta = stored("/session/b")
+    assert gzip.decompress(body) == data
+    assert meta["content_encoding"] == "gzip"
+    assert uploader.stats()["retried"] == 1